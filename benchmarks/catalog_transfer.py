@@ -0,0 +1,61 @@
+"""
+NDJSON catalog import/export throughput against a SQLite database.
+
+Usage: python benchmarks/catalog_transfer.py [--rows 1000000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mvp.settings')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--rows', type=int, default=1000000)
+    arg_parser.add_argument('--batch-size', type=int, default=5000)
+    args = arg_parser.parse_args()
+
+    db_dir = tempfile.mkdtemp()
+    settings.DATABASES['default']['NAME'] = os.path.join(db_dir, 'bench.sqlite3')
+    django.setup()
+
+    from django.core.management import call_command
+
+    from vending_machine import json_backend
+    from vending_machine.models import User
+
+    call_command('migrate', verbosity=0)
+    seller = User.objects.create_user('seller', 'password')
+    seller.role = 'seller'
+    seller.save()
+
+    source = os.path.join(db_dir, 'catalog.ndjson')
+    with open(source, 'wb') as f:
+        for i in range(args.rows):
+            f.write(json_backend.dumps({
+                "product_name": f"product {i}", "seller": seller.pk, "cost": 5 * (i % 20 + 1),
+                "amount_available": i % 50,
+            }) + b'\n')
+
+    for name, command, command_args in (
+        ('import (create)', 'import_products', [source, '--batch-size', str(args.batch_size)]),
+        ('export', 'export_products', ['--output', os.path.join(db_dir, 'export.ndjson')]),
+        ('import (update)', 'import_products', [
+            os.path.join(db_dir, 'export.ndjson'), '--batch-size', str(args.batch_size)
+        ]),
+    ):
+        start = time.perf_counter()
+        call_command(command, *command_args, stderr=open(os.devnull, 'w'))
+        elapsed = time.perf_counter() - start
+        print(f"{name:<16} {args.rows} rows in {elapsed:.1f}s ({args.rows / elapsed:.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Encode/decode throughput of the API JSON renderer and parser for catalog sized payloads.
+
+Usage: python benchmarks/json_throughput.py [--rows 1000 10000 100000]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mvp.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.test import override_settings  # noqa: E402
+
+from vending_machine.parsers import FastJSONParser  # noqa: E402
+from vending_machine.renderers import FastJSONRenderer  # noqa: E402
+
+
+def catalog(rows):
+    return [
+        {
+            "id": i,
+            "product_name": f"Product number {i}",
+            "seller": i % 97,
+            "cost": 5 * (i % 40 + 1),
+            "amount_available": i % 13,
+        }
+        for i in range(rows)
+    ]
+
+
+def measure(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    print(f"{'backend':<8} {'rows':>8} {'MB':>7} {'encode MB/s':>12} {'decode MB/s':>12}")
+    for backend in ('json', 'orjson'):
+        with override_settings(JSON_BACKEND=backend):
+            for rows in args.rows:
+                data = catalog(rows)
+                renderer, parser = FastJSONRenderer(), FastJSONParser()
+                body = renderer.render(data)
+                size = len(body) / 1e6
+                encode = measure(lambda: renderer.render(data), args.repeat)
+                decode = measure(lambda: parser.parse(io.BytesIO(body)), args.repeat)
+                print(f"{backend:<8} {rows:>8} {size:>7.2f} {size / encode:>12.1f} {size / decode:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Product name search latency against a SQLite catalog of --rows products.
+
+Usage: python benchmarks/product_search.py [--rows 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mvp.settings')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+WORDS = [
+    'cola', 'zero', 'orange', 'juice', 'apple', 'water', 'sparkling', 'still', 'chocolate',
+    'bar', 'dark', 'milk', 'crisps', 'salted', 'paprika', 'gum', 'mint', 'coffee', 'tea',
+    'lemon', 'energy', 'drink', 'cookie', 'oat', 'peanut', 'caramel', 'vanilla', 'berry',
+]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--rows', type=int, default=1000000)
+    arg_parser.add_argument('--queries', type=int, default=200)
+    args = arg_parser.parse_args()
+
+    db_dir = tempfile.mkdtemp()
+    settings.DATABASES['default']['NAME'] = os.path.join(db_dir, 'bench.sqlite3')
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connection, transaction
+
+    from vending_machine.models import Product, User
+    from vending_machine.search import search_products
+
+    call_command('migrate', verbosity=0)
+    seller = User.objects.create_user('seller', 'password')
+    rng = random.Random(42)
+    start = time.perf_counter()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {Product._meta.db_table} (product_name, cost, amount_available, seller_id) "
+            f"VALUES (%s, %s, %s, %s)",
+            (
+                (f"{' '.join(rng.sample(WORDS, 3))} {i}", 5, 10, seller.pk)
+                for i in range(args.rows)
+            )
+        )
+    print(f"inserted {args.rows} products in {time.perf_counter() - start:.1f}s")
+
+    queries = {
+        'exact id token': [str(rng.randrange(args.rows)) for _ in range(args.queries)],
+        'two words + id prefix': [
+            f"{rng.choice(WORDS)} {rng.choice(WORDS)} {rng.randrange(args.rows) // 10}"
+            for _ in range(args.queries)
+        ],
+    }
+    for name, terms in queries.items():
+        timings = []
+        for term in terms:
+            start = time.perf_counter()
+            search_products(term, limit=20)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print(
+            f"{name:<24} p50 {timings[len(timings) // 2] * 1e3:.3f}ms "
+            f"p99 {timings[int(len(timings) * 0.99)] * 1e3:.3f}ms"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Per-request overhead of the token bucket throttles.
+
+Usage: python benchmarks/throttle_overhead.py [--requests 200000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mvp.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.test import override_settings  # noqa: E402
+
+from vending_machine.throttling import (  # noqa: E402
+    IPTokenBucketThrottle, UserTokenBucketThrottle, get_throttle_cache
+)
+
+
+class User:
+    is_authenticated = True
+
+    def __init__(self, pk):
+        self.pk = pk
+
+
+class Request:
+    def __init__(self, pk):
+        self.user = User(pk)
+        self.META = {'REMOTE_ADDR': f'10.0.{pk // 256 % 256}.{pk % 256}'}
+
+
+class View:
+    throttle_scope = 'buy'
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--requests', type=int, default=200000)
+    arg_parser.add_argument('--clients', type=int, default=1000)
+    args = arg_parser.parse_args()
+
+    requests = [Request(i % args.clients) for i in range(args.requests)]
+    view = View()
+    cache = get_throttle_cache()
+    keys = [f'throttle_buy_user_{request.user.pk}' for request in requests]
+    for key in set(keys):
+        cache.set(key, 0)
+    start = time.perf_counter()
+    for key in keys:
+        cache.incr(key, 1)
+    baseline = (time.perf_counter() - start) / args.requests * 1e6
+    print(f"{'cache.incr() alone':<32} {baseline:.2f}us per call ({cache.__class__.__name__})")
+
+    scenarios = [
+        # Clients come back faster than the refill interval: one cache.incr() per check
+        ('active', '6000/min'),
+        # Clients come back after their bucket refilled: cache.incr() + cache.set()
+        ('idle', '1000000/s'),
+    ]
+    for name, rate in scenarios:
+        with override_settings(REST_FRAMEWORK={'DEFAULT_THROTTLE_RATES': {'buy': rate, 'buy_ip': rate}}):
+            for throttle_class in (UserTokenBucketThrottle, IPTokenBucketThrottle):
+                cache.clear()
+                throttle = throttle_class()
+                for request in requests[:args.clients]:
+                    throttle.allow_request(request, view)
+                start = time.perf_counter()
+                for request in requests:
+                    throttle.allow_request(request, view)
+                elapsed = (time.perf_counter() - start) / args.requests * 1e6
+                print(
+                    f"{throttle_class.__name__ + ' ' + name:<32} {elapsed:.2f}us per check, "
+                    f"{elapsed - baseline:.2f}us more than one cache.incr()"
+                )
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,8 @@
 ASGI config for mvp project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Server-sent events of product changes are streamed by a plain ASGI application
+mounted next to Django (see vending_machine.sse).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
@@ -13,4 +15,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mvp.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from vending_machine.sse import SSE_PATH, product_events_app  # noqa: E402
+from vending_machine.warmup import warm_up_on_startup  # noqa: E402
+
+warm_up_on_startup()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == SSE_PATH:
+        return await product_events_app(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -27,6 +28,9 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
+# Running under `manage.py test`
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
 # Django Autofield
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
@@ -48,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'vending_machine.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,6 +60,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'vending_machine.query_budget.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'mvp.urls'
@@ -85,9 +91,64 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # User shards, used when listed in USER_SHARDS
+    'users_0': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_users_0.sqlite3',
+    },
+    'users_1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_users_1.sqlite3',
+    },
 }
 
+# Users and their tokens are spread over the USER_SHARDS databases by a hash of their id
+# (see vending_machine/sharding.py). Empty keeps them in the default database. Every database
+# needs `manage.py migrate --database <alias>`; use `manage.py reshard_users` to change the list.
+USER_SHARDS = []
+DATABASE_ROUTERS = ['vending_machine.sharding.ShardRouter']
+# Opt in to database constraints on the foreign keys to the user table, read when migrations
+# are generated. They cannot hold once users live on other databases, so they are off here:
+# the test suite and reshard_users move users off the default database. Deployments which will
+# never shard users can set it to True before generating their migrations.
+USER_FOREIGN_KEY_CONSTRAINTS = False
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# Throttling state must be shared by every worker process for the limits to hold:
+# point the 'throttle' cache at memcached or redis in production.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'throttle',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    'lists': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'lists',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+if TESTING:
+    # Sequences restart with every test transaction, cached lists would leak between tests
+    CACHES['lists']['BACKEND'] = 'django.core.cache.backends.dummy.DummyCache'
+
+THROTTLE_CACHE = 'throttle'
+
+# Cached /products bodies with their gzip (and brotli/zstd when installed) variants, see
+# vending_machine/response_cache.py. Entries are keyed by catalog version, which moves when a
+# product is created, deleted, renamed, repriced, hidden or goes in or out of stock, but not on
+# every sale: the stock counts and versions of a cached list lag sales by up to
+# LIST_CACHE_TIMEOUT seconds. /buy checks the live stock.
+LIST_CACHE = 'lists'
+LIST_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -126,3 +187,130 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'vending_machine.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'vending_machine.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'vending_machine.throttling.UserTokenBucketThrottle',
+        'vending_machine.throttling.IPTokenBucketThrottle',
+    ],
+    # Token buckets per view function: '<view>' is per user, '<view>_ip' per client address
+    'DEFAULT_THROTTLE_RATES': {
+        'buy': '60/min',
+        'buy_ip': '1000/min',
+        'deposit': '60/min',
+        'deposit_ip': '1000/min',
+        'reset': '60/min',
+        'reset_ip': '1000/min',
+        'product_create': '60/min',
+        'product_create_ip': '1000/min',
+        'product_bulk_update': '60/min',
+        'product_bulk_update_ip': '1000/min',
+        'machine_buy': '60/min',
+        'machine_buy_ip': '1000/min',
+        'machine_deposit': '60/min',
+        'machine_deposit_ip': '1000/min',
+        'machine_reset': '60/min',
+        'machine_reset_ip': '1000/min',
+    },
+}
+
+# JSON encoding backend used by the API renderer/parser: 'auto', 'orjson' or 'json'.
+# 'auto' uses orjson when it is installed and falls back to the standard library.
+JSON_BACKEND = 'auto'
+
+# Idempotency-Key support on the mutating endpoints (see vending_machine/idempotency.py)
+# Stored responses are replayed for IDEMPOTENCY_KEY_TTL seconds, expired ones are removed by
+# `manage.py purge_idempotency_keys`. Retries of an in-flight request wait up to
+# IDEMPOTENCY_WAIT_TIMEOUT seconds for its response. Processes refresh the placeholders of their
+# requests in flight every IDEMPOTENCY_HEARTBEAT_INTERVAL seconds; retries take over the ones
+# left without a heartbeat for three intervals by a crashed process.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_WAIT_TIMEOUT = 10
+IDEMPOTENCY_HEARTBEAT_INTERVAL = 2
+
+# Server-sent product events (see vending_machine/events.py and vending_machine/sse.py)
+# Events kept in memory for resuming clients, events buffered per subscriber before it is
+# dropped as too slow, and seconds between keepalive comments on idle streams
+EVENTS_HISTORY_SIZE = 1000
+EVENTS_QUEUE_SIZE = 100
+EVENTS_KEEPALIVE = 15
+
+# Build model relation trees, URL resolvers, DRF setting classes, view imports and the ?fields=
+# tables of serializers when the WSGI/ASGI application is loaded, instead of on the first
+# requests of each worker (see vending_machine/warmup.py)
+WARM_UP_ON_STARTUP = True
+
+# Signed tokens issued by /login (see vending_machine/authentication.py)
+# Tokens are signed with SIGNED_TOKEN_ACTIVE_KEY and verified with any key of SIGNED_TOKEN_KEYS:
+# to rotate, add a new key, make it active, and drop the old one once SIGNED_TOKEN_TTL has passed.
+# Revoked tokens are reloaded from the database at most every SIGNED_TOKEN_REVOCATION_REFRESH seconds.
+SIGNED_TOKEN_KEYS = {
+    'k1': SECRET_KEY,
+}
+SIGNED_TOKEN_ACTIVE_KEY = 'k1'
+SIGNED_TOKEN_TTL = 15 * 60
+SIGNED_TOKEN_REVOCATION_REFRESH = 5
+
+# Per-view SQL budgets declared with @query_budget (see vending_machine/query_budget.py)
+# Overruns raise in DEBUG and under tests and are logged otherwise; set QUERY_BUDGET_RAISE to force
+# either behaviour. `manage.py query_budget_report` lists observed costs against the budgets.
+# QUERY_BUDGET_TIME_MS is the milliseconds of SQL allowed to views declaring no time budget.
+QUERY_BUDGET_TIME_MS = 100
+
+# Background tasks (see vending_machine/tasks.py)
+# Tasks are stored in the enqueuing transaction and run after commit by TASKS_WORKERS threads per
+# process, in batches of up to TASKS_BATCH_SIZE tasks collected for at most TASKS_BATCH_WAIT seconds.
+# Tasks left behind by a crash or a full queue are run by `manage.py drain_tasks`.
+# TASKS_EAGER runs them in the committing thread instead, as the tests do.
+TASKS_WORKERS = 2
+TASKS_QUEUE_SIZE = 10000
+TASKS_BATCH_SIZE = 100
+TASKS_BATCH_WAIT = 0.05
+TASKS_EAGER = TESTING
+
+# Sellers get a StockAlert when a sale takes a product down to this amount
+LOW_STOCK_THRESHOLD = 5
+
+# Soft deleted users are removed by the purge_user task with DELETE statements of at most
+# USER_PURGE_BATCH_SIZE rows, each in its own short transaction
+USER_PURGE_BATCH_SIZE = 500
+
+# PATCH /products/bulk: products per request, and products per UPDATE statement of explicit changes
+PRODUCT_BULK_MAX_PRODUCTS = 5000
+PRODUCT_BULK_BATCH_SIZE = 500
+
+# POST /batch (see vending_machine/batch.py): requests per batch, and threads per process running
+# the independent GETs of batches concurrently
+BATCH_MAX_REQUESTS = 20
+BATCH_WORKERS = 4
+
+# Admin changelists count matching rows exactly up to ADMIN_EXACT_COUNT_LIMIT, and use the
+# table estimate of the database past it (see vending_machine/admin.py)
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# Request profiling (see vending_machine/profiling.py)
+# A PROFILING_SAMPLE_RATE fraction of the requests is profiled, as are the requests sending
+# PROFILING_SECRET in their X-Profile header; no secret disables the header. PROFILING_MODE is
+# 'cprofile' (.prof files) or 'sampling' (collapsed stacks, one sample every PROFILING_SAMPLING_INTERVAL
+# seconds). The PROFILING_MAX_FILES most recent profiles are kept in PROFILING_DIR and summarized
+# by `manage.py profile_summary`.
+PROFILING_SAMPLE_RATE = 0
+PROFILING_SECRET = None
+PROFILING_MODE = 'cprofile'
+PROFILING_SAMPLING_INTERVAL = 0.005
+# Defaults to the git-ignored profiles/ directory of the checkout; point it outside in deployments
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_MAX_FILES = 200
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mvp.settings')
 
 application = get_wsgi_application()
+
+from vending_machine.warmup import warm_up_on_startup  # noqa: E402
+
+warm_up_on_startup()
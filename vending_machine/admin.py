@@ -1,9 +1,182 @@
+from django.conf import settings
 from django.contrib import admin
-from vending_machine.models import User
-from django.contrib.auth.admin import UserAdmin
+from django.contrib.admin.views.main import ALL_VAR, IS_POPUP_VAR, ORDER_VAR, PAGE_VAR, TO_FIELD_VAR
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
+from vending_machine.models import Product, User
+from vending_machine.search import filter_products
+from vending_machine.sharding import shard_for_user, sharding_enabled
 
-# Register your models here.
+# Changelist parameters which do not restrict the rows listed
+_UNFILTERED_PARAMS = {ALL_VAR, IS_POPUP_VAR, ORDER_VAR, PAGE_VAR, TO_FIELD_VAR}
 
-admin.register(User, UserAdmin)
 
+def estimated_row_count(model, using='default'):
+    """
+    Number of rows of the table of model from the database statistics, without scanning it.
+    None when the database keeps no such estimate.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT table_rows FROM information_schema.tables "
+                "WHERE table_schema = DATABASE() AND table_name = %s", [table]
+            )
+        elif connection.vendor == 'sqlite':
+            # No statistics: ids are allocated in increasing order, the largest one bounds the row count
+            cursor.execute(f"SELECT MAX({model._meta.pk.column}) FROM {connection.ops.quote_name(table)}")
+        else:
+            return None
+        row = cursor.fetchone()
+    # PostgreSQL reports -1 for tables never analyzed
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts up to ADMIN_EXACT_COUNT_LIMIT rows exactly. Beyond that, unfiltered lists use the table
+    estimate of the database, and filtered ones stop counting at the limit: narrow the filter or
+    the search to reach the rows past it. Pages are still fetched with LIMIT/OFFSET.
+    """
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, estimate=True):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.estimate = estimate
+
+    @cached_property
+    def count(self):
+        limit = getattr(settings, 'ADMIN_EXACT_COUNT_LIMIT', 10000)
+        count = self.object_list.order_by()[:limit + 1].count()
+        if count <= limit or not self.estimate:
+            return count
+        estimate = estimated_row_count(self.object_list.model, self.object_list.db)
+        return max(count, estimate or 0)
+
+
+class ScalableAdminMixin:
+    """
+    Changelist settings for tables of millions of rows: no full COUNT(*) per page, and
+    ordering restricted by `sortable_by` to indexed columns.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-id', )
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        filtered = any(param not in _UNFILTERED_PARAMS for param in request.GET)
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, estimate=not filtered)
+
+
+class CostRangeFilter(admin.SimpleListFilter):
+    """
+    Cost ranges, served by product_cost_stock_idx
+    """
+    title = 'cost'
+    parameter_name = 'cost_range'
+    ranges = {
+        '0-50': (0, 50),
+        '50-100': (50, 100),
+        '100-500': (100, 500),
+        '500-': (500, None),
+    }
+
+    def lookups(self, request, model_admin):
+        return [
+            (key, f'{low} and more' if high is None else f'{low} to {high}')
+            for key, (low, high) in self.ranges.items()
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() not in self.ranges:
+            return queryset
+        low, high = self.ranges[self.value()]
+        queryset = queryset.filter(cost__gte=low)
+        return queryset if high is None else queryset.filter(cost__lt=high)
+
+
+@admin.register(User)
+class UserAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    """
+    Users are created through the API and soft deleted from here, like DELETE /users/<id> does:
+    their rows are removed by the purge_user task.
+    Search takes an exact id or a username prefix, both served by an index.
+    """
+    list_display = ('id', 'username', 'role', 'deposit', 'is_active', 'is_admin')
+    sortable_by = ('id', 'username')
+    # Searched by get_search_results, declared to show the search box
+    search_fields = ('username', )
+    fields = ('username', 'role', 'deposit', 'is_active', 'is_admin', 'deleted_at', 'last_login', 'version')
+    readonly_fields = ('deleted_at', 'last_login', 'version')
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_object(self, request, object_id, from_field=None):
+        if sharding_enabled() and object_id.isdigit():
+            queryset = self.get_queryset(request).using(shard_for_user(int(object_id)))
+            return queryset.filter(pk=object_id).first()
+        return super().get_object(request, object_id, from_field)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            if sharding_enabled():
+                queryset = queryset.using(shard_for_user(int(search_term)))
+            return queryset.filter(pk=search_term), False
+        # A prefix as a range of the unique index of username: LIKE 'term%' only uses an index with
+        # text_pattern_ops on PostgreSQL, and never on SQLite, where LIKE is case insensitive.
+        # Usernames continuing the prefix with a character beyond U+FFFF are left out.
+        return queryset.filter(username__gte=search_term, username__lt=search_term + '\uffff'), False
+
+    def get_deleted_objects(self, objs, request):
+        # Related rows are left to the purge_user task, do not collect them
+        return [str(obj) for obj in objs], {User._meta.verbose_name_plural: len(objs)}, set(), []
+
+    def delete_model(self, request, obj):
+        obj.soft_delete()
+
+    def delete_queryset(self, request, queryset):
+        for user in queryset:
+            user.soft_delete()
+
+
+@admin.register(Product)
+class ProductAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    """
+    Sellers are loaded with the products of a page in one join and picked by id, instead of
+    rendering every user in a select. Search takes an exact id or words of the product
+    name, matched through the FTS5 index on SQLite.
+    When users are sharded, sellers live on other databases and are shown by id.
+    """
+    list_display = ('id', 'product_name', 'seller', 'cost', 'amount_available')
+    list_select_related = ('seller', )
+    list_filter = (CostRangeFilter, )
+    sortable_by = ('id', 'cost')
+    # Searched by get_search_results, declared to show the search box
+    search_fields = ('product_name', )
+    raw_id_fields = ('seller', )
+    readonly_fields = ('change_seq', 'seller_deleted', 'version')
+
+    def get_list_display(self, request):
+        if sharding_enabled():
+            return tuple('seller_id' if field == 'seller' else field for field in self.list_display)
+        return self.list_display
+
+    def get_list_select_related(self, request):
+        return () if sharding_enabled() else self.list_select_related
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(pk=search_term), False
+        return filter_products(queryset, search_term), False
@@ -1,5 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class VendingMachineConfig(AppConfig):
     name = 'vending_machine'
+
+    def ready(self):
+        from vending_machine import signals  # noqa: F401
+        from vending_machine.search import create_search_index
+
+        post_migrate.connect(create_search_index, sender=self)
+        post_migrate.connect(signals.create_sequences, sender=self)
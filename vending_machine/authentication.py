@@ -0,0 +1,204 @@
+import base64
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, TokenAuthentication, get_authorization_header
+
+from vending_machine.models import User, RevokedToken
+from vending_machine.sharding import shard_for_user, sharding_enabled, user_databases, user_id_of_token
+
+TOKEN_VERSION = 'v1'
+SIGNATURE_LENGTH = 16
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _signing_keys():
+    """
+    Returns {key id: secret}. The first key is derived from SECRET_KEY unless SIGNED_TOKEN_KEYS is set
+    """
+    return getattr(settings, 'SIGNED_TOKEN_KEYS', None) or {
+        'default': hashlib.sha256(f'signed-token:{settings.SECRET_KEY}'.encode()).hexdigest()
+    }
+
+
+def _active_key_id():
+    return getattr(settings, 'SIGNED_TOKEN_ACTIVE_KEY', None) or next(iter(_signing_keys()))
+
+
+def _sign(key_id, payload):
+    secret = _signing_keys()[key_id]
+    return hmac.new(secret.encode(), f'{key_id}.{payload}'.encode(), hashlib.sha256).digest()[:SIGNATURE_LENGTH]
+
+
+class TokenClaims:
+    __slots__ = ('user_id', 'role', 'expires_at', 'jti')
+
+    def __init__(self, user_id, role, expires_at, jti):
+        self.user_id, self.role, self.expires_at, self.jti = user_id, role, expires_at, jti
+
+    @property
+    def expires_at_datetime(self):
+        return datetime.fromtimestamp(self.expires_at, tz=dt_timezone.utc)
+
+
+def issue_token(user, ttl=None):
+    """
+    Returns a token 'v1.<key id>.<payload>.<signature>' carrying the user id, role, expiry and a token id,
+    signed with HMAC-SHA256 by the active key, and its claims
+    """
+    ttl = ttl if ttl is not None else getattr(settings, 'SIGNED_TOKEN_TTL', 15 * 60)
+    claims = TokenClaims(user.pk, user.role, int(time.time()) + ttl, secrets.token_hex(8))
+    payload = _b64encode(f'{claims.user_id}:{claims.role}:{claims.expires_at}:{claims.jti}'.encode())
+    key_id = _active_key_id()
+    return f'{TOKEN_VERSION}.{key_id}.{payload}.{_b64encode(_sign(key_id, payload))}', claims
+
+
+def decode_token(token):
+    """
+    Verifies a token and returns its claims, raises AuthenticationFailed when it is invalid,
+    expired or revoked
+    """
+    try:
+        version, key_id, payload, signature = token.split('.')
+        if version != TOKEN_VERSION or key_id not in _signing_keys():
+            raise ValueError
+        if not hmac.compare_digest(_b64decode(signature), _sign(key_id, payload)):
+            raise ValueError
+        user_id, role, expires_at, jti = _b64decode(payload).decode().split(':')
+        claims = TokenClaims(int(user_id), role, int(expires_at), jti)
+    except (ValueError, UnicodeDecodeError):
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    if claims.expires_at <= time.time():
+        raise exceptions.AuthenticationFailed('Token has expired.')
+    if revocation_list.is_revoked(claims.jti):
+        raise exceptions.AuthenticationFailed('Token has been revoked.')
+    return claims
+
+
+class RevocationList:
+    """
+    In-process copy of the RevokedToken table, reloaded at most every SIGNED_TOKEN_REVOCATION_REFRESH
+    seconds: checking a token never queries the database on its own.
+    """
+
+    def __init__(self):
+        self.revoked = frozenset()
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def is_revoked(self, jti):
+        refresh = getattr(settings, 'SIGNED_TOKEN_REVOCATION_REFRESH', 5)
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > refresh:
+            self.reload()
+        return jti in self.revoked
+
+    def reload(self):
+        with self.lock:
+            self.revoked = frozenset(
+                RevokedToken.objects.filter(expires_at__gt=timezone.now()).values_list('jti', flat=True)
+            )
+            self.loaded_at = time.monotonic()
+
+    def revoke(self, claims):
+        RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+        RevokedToken.objects.get_or_create(jti=claims.jti, defaults={"expires_at": claims.expires_at_datetime})
+        with self.lock:
+            self.revoked = self.revoked | {claims.jti}
+
+
+revocation_list = RevocationList()
+
+
+class SignedTokenUser(SimpleLazyObject):
+    """
+    request.user for signed tokens: id and role come from the token claims,
+    any other attribute loads the user from the database on first access
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, claims):
+        self.__dict__['claims'] = claims
+        super().__init__(lambda: self.load_user(claims))
+
+    @staticmethod
+    def load_user(claims):
+        try:
+            return User.objects.using(shard_for_user(claims.user_id)).get(pk=claims.user_id, is_active=True)
+        except User.DoesNotExist:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+    @property
+    def pk(self):
+        return self.claims.user_id
+
+    id = pk
+
+    @property
+    def role(self):
+        return self.claims.role
+
+    def __bool__(self):
+        return True
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Authenticates 'Authorization: Bearer <token>' headers carrying tokens from issue_token()
+    without any database query. request.auth is the token claims.
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+        claims = decode_token(token)
+        return SignedTokenUser(claims), claims
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+class ShardedTokenAuthentication(TokenAuthentication):
+    """
+    DRF token authentication when users are sharded. Tokens issued by authenticate_user() start
+    with the user id and are looked up on its shard only; older tokens are looked up on every shard.
+    Signed tokens carry the user id and need a single lookup.
+    """
+
+    def authenticate_credentials(self, key):
+        if not sharding_enabled():
+            return super().authenticate_credentials(key)
+        model = self.get_model()
+        user_id = user_id_of_token(key)
+        for alias in user_databases() if user_id is None else [shard_for_user(user_id)]:
+            token = model.objects.using(alias).select_related('user').filter(key=key).first()
+            if token is not None:
+                break
+        else:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return token.user, token
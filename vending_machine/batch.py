@@ -0,0 +1,186 @@
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve, reverse
+
+from vending_machine import json_backend
+from vending_machine.query_budget import check_budget, count_queries
+
+logger = logging.getLogger(__name__)
+
+BATCH_URLCONF = 'vending_machine.urls'
+BATCH_URL_NAME = 'batch'
+
+# Headers of the batch request that sub-requests can not override
+RESERVED_HEADERS = {'AUTHORIZATION', 'HOST', 'CONTENT_TYPE', 'CONTENT_LENGTH'}
+# Headers of the sub-responses left out of the batch response
+SKIPPED_RESPONSE_HEADERS = {'content-length', 'vary'}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Thread pool shared by the batch requests of the process, BATCH_WORKERS threads at most
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'BATCH_WORKERS', 4), thread_name_prefix='batch'
+            )
+        return _executor
+
+
+class SubRequest:
+    __slots__ = ('request', 'match', 'error')
+
+    def __init__(self, request=None, match=None, error=None):
+        self.request, self.match, self.error = request, match, error
+
+    @property
+    def concurrent(self):
+        """
+        GETs of views without side effects: views marked @idempotent write even when routed as GET
+        """
+        return self.error is None and self.request.method == 'GET' \
+            and not getattr(self.match.func, 'idempotent', False)
+
+
+def _api_path(path):
+    """
+    Returns path relative to the root of the API, accepting paths with or without the API prefix
+    """
+    prefix = reverse(BATCH_URL_NAME)[:-len(BATCH_URL_NAME)]
+    if path.startswith(prefix):
+        return path[len(prefix):]
+    return path.lstrip('/')
+
+
+def build_sub_request(parent, method, path, headers=None, body=None):
+    """
+    Builds the HttpRequest of a sub-request, authenticated as the batch request
+    """
+    url = urlsplit(path)
+    api_path = _api_path(url.path)
+    try:
+        match = resolve('/' + api_path, urlconf=BATCH_URLCONF)
+    except Resolver404:
+        return SubRequest(error=(404, {"detail": f"No route matches {path}"}))
+    if match.url_name == BATCH_URL_NAME:
+        return SubRequest(error=(400, {"detail": "Batches can not be nested"}))
+
+    request = HttpRequest()
+    request.method = method
+    request.path = request.path_info = parent.path[:-len(BATCH_URL_NAME)] + api_path
+    request.META = {
+        key: value for key, value in parent.META.items()
+        if not key.startswith(('HTTP_', 'CONTENT_', 'wsgi.'))
+    }
+    request.META.update({
+        'HTTP_AUTHORIZATION': parent.META.get('HTTP_AUTHORIZATION', ''),
+        'HTTP_ACCEPT': 'application/json',
+        'QUERY_STRING': url.query,
+        'REQUEST_METHOD': method,
+        'PATH_INFO': request.path_info,
+    })
+    for name, value in (headers or {}).items():
+        name = name.upper().replace('-', '_')
+        if name not in RESERVED_HEADERS:
+            request.META[f'HTTP_{name}'] = value
+    request.GET = QueryDict(url.query)
+    content = json_backend.dumps(body) if body is not None else b''
+    request.META['CONTENT_TYPE'] = 'application/json'
+    request.META['CONTENT_LENGTH'] = str(len(content))
+    request._stream = io.BytesIO(content)
+    request._read_started = False
+    request.resolver_match = match
+    # Skip authentication: DRF uses these credentials instead of running the authenticators
+    request._force_auth_user = parent.user
+    request._force_auth_token = parent.auth
+    return SubRequest(request, match)
+
+
+def _result(status_code, body, headers=None):
+    return {"status": status_code, "headers": headers or {}, "body": body}
+
+
+def _response_body(response):
+    if not getattr(response, 'is_rendered', True):
+        # DRF responses are returned unrendered, their data goes into the batch payload as is
+        return response.data
+    if not response.content:
+        return None
+    if response.get('Content-Type', '').startswith('application/json'):
+        return json_backend.loads(response.content)
+    return response.content.decode(response.charset)
+
+
+def run_sub_request(sub):
+    """
+    Calls the view of a sub-request and returns its status, headers and body
+    """
+    if sub.error is not None:
+        return _result(*sub.error)
+    with count_queries() as counter:
+        try:
+            response = sub.match.func(sub.request, *sub.match.args, **sub.match.kwargs)
+        except Exception:
+            logger.exception('Batched %s %s failed', sub.request.method, sub.request.path)
+            return _result(500, {"detail": "Internal server error"})
+    check_budget(sub.request, sub.match, counter)
+    if response.streaming:
+        return _result(400, {"detail": "Streaming responses can not be batched"})
+    headers = {
+        name: value for name, value in response.items()
+        if name.lower() not in SKIPPED_RESPONSE_HEADERS
+    }
+    return _result(response.status_code, _response_body(response), headers)
+
+
+def _run_in_worker(sub):
+    close_old_connections()
+    try:
+        return run_sub_request(sub)
+    finally:
+        close_old_connections()
+
+
+def _in_transaction():
+    return any(connection.in_atomic_block for connection in connections.all())
+
+
+def _run_group(subs):
+    """
+    Runs independent GETs on the thread pool. Inside a transaction they run in this thread,
+    as other threads would not see its uncommitted writes.
+    """
+    if len(subs) < 2 or _in_transaction():
+        return [run_sub_request(sub) for sub in subs]
+    return list(get_executor().map(_run_in_worker, subs))
+
+
+def dispatch(parent, sub_requests):
+    """
+    Runs the sub-requests of a batch and returns their results in order. Consecutive GETs
+    without side effects run concurrently; any other sub-request waits for the ones before
+    it and runs alone, so writes are applied in the order they were sent.
+    """
+    subs = [build_sub_request(parent, **sub_request) for sub_request in sub_requests]
+    results, group = [], []
+    for sub in subs:
+        if sub.concurrent:
+            group.append(sub)
+            continue
+        results += _run_group(group)
+        group = []
+        results.append(run_sub_request(sub))
+    results += _run_group(group)
+    return results
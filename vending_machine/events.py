@@ -0,0 +1,122 @@
+import asyncio
+import bisect
+import threading
+from collections import deque
+
+from django.conf import settings
+
+PRODUCT_CREATED = 'product.created'
+PRODUCT_UPDATED = 'product.updated'
+PRODUCT_DELETED = 'product.deleted'
+# Sent instead of a replay when the requested history is no longer available
+RESET = 'reset'
+# Sent to a subscriber before disconnecting it for not keeping up
+DROPPED = 'dropped'
+
+
+class Event:
+    __slots__ = ('id', 'type', 'data')
+
+    def __init__(self, id, type, data):
+        self.id, self.type, self.data = id, type, data
+
+    def __lt__(self, other):
+        return self.id < other.id
+
+    def __repr__(self):
+        return f'Event({self.id!r}, {self.type!r}, {self.data!r})'
+
+
+class Subscription:
+    """
+    Bounded event buffer of one subscriber, only touched from its event loop
+    """
+
+    def __init__(self, hub, loop, max_size):
+        self.hub, self.loop, self.max_size = hub, loop, max_size
+        self.buffer = deque()
+        self.ready = asyncio.Event()
+        self.dropped = False
+        self.closed = False
+
+    def offer(self, event):
+        if self.closed:
+            return
+        if len(self.buffer) >= self.max_size:
+            # Slow consumer: stop buffering for it, it resumes from its last event id on reconnect
+            self.dropped = True
+            self.hub.unsubscribe(self)
+        else:
+            self.buffer.append(event)
+        self.ready.set()
+
+    def close(self):
+        self.closed = True
+        self.hub.unsubscribe(self)
+        self.ready.set()
+
+    async def get(self, timeout=None):
+        """
+        Returns the buffered events, an empty list on timeout
+        """
+        if not self.buffer and not self.dropped and not self.closed:
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self.ready.clear()
+        events = list(self.buffer)
+        self.buffer.clear()
+        return events
+
+
+class EventHub:
+    """
+    In-process fan-out of events to asyncio subscribers.
+    publish() may be called from any thread; each subscriber gets the events through a bounded
+    buffer on its own event loop and is dropped when the buffer overflows. The last `history_size`
+    events are kept, ordered by id, to let reconnecting subscribers resume from their last event id.
+    """
+
+    def __init__(self, history_size=None, queue_size=None):
+        self.history_size = history_size or getattr(settings, 'EVENTS_HISTORY_SIZE', 1000)
+        self.queue_size = queue_size or getattr(settings, 'EVENTS_QUEUE_SIZE', 100)
+        self.history = []
+        # Id of the most recent event evicted from the history
+        self.evicted_id = None
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def publish(self, event):
+        with self.lock:
+            bisect.insort(self.history, event)
+            if len(self.history) > self.history_size:
+                self.evicted_id = self.history.pop(0).id
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:  # Event loop closed
+                self.unsubscribe(subscription)
+
+    def subscribe(self, last_event_id=None):
+        """
+        Registers a subscriber on the running event loop. Returns the subscription and the events
+        to replay: those after last_event_id, or a single RESET event if some were evicted already.
+        """
+        subscription = Subscription(self, asyncio.get_running_loop(), self.queue_size)
+        with self.lock:
+            self.subscribers.add(subscription)
+            if last_event_id is None:
+                return subscription, []
+            if self.evicted_id is not None and last_event_id < self.evicted_id:
+                return subscription, [Event(last_event_id, RESET, {"since": last_event_id})]
+            start = bisect.bisect_right([event.id for event in self.history], last_event_id)
+            return subscription, self.history[start:]
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+
+product_events = EventHub()
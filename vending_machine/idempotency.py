@@ -0,0 +1,232 @@
+import hashlib
+import logging
+import os
+import secrets
+import socket
+import threading
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError, connection, transaction
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from vending_machine.models import IdempotencyKey
+from vending_machine.sharding import atomic_on, user_databases
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+# A placeholder whose owner missed this many heartbeats belongs to a crashed request
+MISSED_HEARTBEATS = 3
+HOST_NAME = socket.gethostname()[:30]
+
+# Requests in flight in this process, by key digest
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+# Owners of the placeholders of the requests running in this process, by key digest
+_owned = {}
+_heartbeat_thread = None
+
+
+def _ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+
+def _wait_timeout():
+    return getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 10)
+
+
+def _heartbeat_interval():
+    return getattr(settings, 'IDEMPOTENCY_HEARTBEAT_INTERVAL', 2)
+
+
+def _digest(request, key):
+    """
+    Scopes the key to the credentials and the request, so that it can be checked before authentication
+    """
+    fingerprint = '\n'.join([
+        request.method, request.get_full_path(), request.META.get('HTTP_AUTHORIZATION', ''), key
+    ])
+    return hashlib.sha256(fingerprint.encode()).hexdigest()
+
+
+def _lookup(digest):
+    return IdempotencyKey.objects.filter(
+        key=digest, status_code__isnull=False, expires_at__gt=timezone.now()
+    ).first()
+
+
+def _replay(stored):
+    response = HttpResponse(bytes(stored.body), status=stored.status_code, content_type=stored.content_type)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def _conflict():
+    return JsonResponse(
+        {"detail": "A request with this Idempotency-Key is still being processed"}, status=409
+    )
+
+
+def _claim(digest):
+    """
+    Inserts the in-flight placeholder row and returns its owner, or None if another request holds the key.
+    The owner names the host and process running the request, and is unique to the request.
+    """
+    now = timezone.now()
+    owner = f'{HOST_NAME}:{os.getpid()}/{secrets.token_hex(8)}'
+    placeholder = IdempotencyKey(key=digest, owner=owner, heartbeat_at=now, expires_at=now + _ttl())
+    try:
+        with transaction.atomic():
+            placeholder.save(force_insert=True)
+        return owner
+    except IntegrityError:
+        pass
+    # Take over expired responses, and placeholders whose owner stopped sending heartbeats
+    stale = now - timedelta(seconds=_heartbeat_interval() * MISSED_HEARTBEATS)
+    with transaction.atomic():
+        if IdempotencyKey.objects.filter(
+            Q(status_code__isnull=False, expires_at__lte=now) | Q(status_code__isnull=True, heartbeat_at__lte=stale),
+            key=digest
+        ).delete()[0]:
+            placeholder.save(force_insert=True)
+            return owner
+    return None
+
+
+def _send_heartbeats():
+    """
+    Refreshes the placeholders of the requests running in this process every
+    IDEMPOTENCY_HEARTBEAT_INTERVAL seconds, with one UPDATE for all of them
+    """
+    while True:
+        time.sleep(_heartbeat_interval())
+        with _in_flight_lock:
+            keys, owners = list(_owned), list(_owned.values())
+        if not keys:
+            continue
+        try:
+            connection.close_if_unusable_or_obsolete()
+            IdempotencyKey.objects.filter(key__in=keys, owner__in=owners).update(heartbeat_at=timezone.now())
+        except DatabaseError:
+            logger.exception('Could not refresh %d idempotency keys', len(keys))
+
+
+def _own(digest, owner):
+    global _heartbeat_thread
+    with _in_flight_lock:
+        _owned[digest] = owner
+        # Also restarts the thread in processes forked after it started
+        if _heartbeat_thread is None or not _heartbeat_thread.is_alive():
+            _heartbeat_thread = threading.Thread(
+                target=_send_heartbeats, name='idempotency-heartbeat', daemon=True
+            )
+            _heartbeat_thread.start()
+
+
+def _disown(digest):
+    with _in_flight_lock:
+        _owned.pop(digest, None)
+
+
+class _Superseded(Exception):
+    """
+    Another request took the key over: the writes of this one must not commit
+    """
+
+
+def _run_and_store(view, request, args, kwargs, digest, owner):
+    """
+    Runs the view and stores its response in the transaction of its writes, so that they commit
+    together or not at all
+    """
+    with atomic_on(DEFAULT_DB_ALIAS, *user_databases()):
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            response.render()
+        placeholder = IdempotencyKey.objects.filter(key=digest, owner=owner)
+        if response.status_code >= 500 or response.streaming:
+            placeholder.delete()
+        elif not placeholder.update(
+            status_code=response.status_code,
+            content_type=response.get('Content-Type', ''),
+            body=response.content,
+            expires_at=timezone.now() + _ttl(),
+        ):
+            raise _Superseded
+    return response
+
+
+def _wait_for_other_process(digest):
+    deadline = time.monotonic() + _wait_timeout()
+    while time.monotonic() < deadline:
+        stored = _lookup(digest)
+        if stored:
+            return stored
+        time.sleep(0.05)
+    return None
+
+
+def idempotent(view):
+    """
+    Makes a view honour the Idempotency-Key header.
+    The first response (unless it is a server error) is stored for IDEMPOTENCY_KEY_TTL seconds
+    and replayed for retries without running the view again. Concurrent retries wait for the
+    first request: within a process on an event, across processes on the placeholder row.
+    The placeholder is kept until the first request stores its response or fails; a retry only
+    takes it over once its owner missed MISSED_HEARTBEATS heartbeats, as a crashed process does.
+    The view runs in a transaction on the default and user databases, committed with its response.
+    Must be the outermost decorator, so that replays skip authentication too.
+    """
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return view(request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return JsonResponse(
+                {"detail": f"{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters long"}, status=400
+            )
+
+        digest = _digest(request, key)
+        with _in_flight_lock:
+            event = _in_flight.get(digest)
+            leader = event is None
+            if leader:
+                event = _in_flight[digest] = threading.Event()
+        if not leader:
+            event.wait(_wait_timeout())
+            stored = _lookup(digest)
+            return _replay(stored) if stored else _conflict()
+
+        try:
+            # Most keys are new: claim first, look for a stored response when the key is taken
+            owner = _claim(digest)
+            if owner is None:
+                stored = _wait_for_other_process(digest)
+                return _replay(stored) if stored else _conflict()
+
+            _own(digest, owner)
+            try:
+                return _run_and_store(view, request, args, kwargs, digest, owner)
+            except _Superseded:
+                return _conflict()
+            except BaseException:
+                IdempotencyKey.objects.filter(key=digest, owner=owner).delete()
+                raise
+            finally:
+                _disown(digest)
+        finally:
+            with _in_flight_lock:
+                del _in_flight[digest]
+            event.set()
+
+    # Marks the view as having side effects, whatever its method
+    wrapped.idempotent = True
+    return wrapped
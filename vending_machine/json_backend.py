@@ -0,0 +1,50 @@
+import json
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+BACKEND_AUTO = 'auto'
+BACKEND_ORJSON = 'orjson'
+BACKEND_STDLIB = 'json'
+
+
+def get_backend_name():
+    """
+    Returns the name of the JSON backend to use, based on the JSON_BACKEND
+    setting ('auto', 'orjson' or 'json'). 'auto' picks orjson when it is installed.
+    """
+    name = getattr(settings, 'JSON_BACKEND', BACKEND_AUTO)
+    if name == BACKEND_AUTO:
+        return BACKEND_ORJSON if orjson is not None else BACKEND_STDLIB
+    if name == BACKEND_ORJSON and orjson is None:
+        raise ImproperlyConfigured("JSON_BACKEND is 'orjson' but orjson is not installed")
+    if name not in (BACKEND_ORJSON, BACKEND_STDLIB):
+        raise ImproperlyConfigured(f"Unknown JSON_BACKEND {name!r}")
+    return name
+
+
+def dumps(data, default=None):
+    """
+    Serializes data to UTF-8 encoded JSON bytes with the configured backend
+    """
+    if get_backend_name() == BACKEND_ORJSON:
+        return orjson.dumps(data, default=default)
+    return json.dumps(
+        data, default=default, ensure_ascii=False, separators=(',', ':')
+    ).encode('utf-8')
+
+
+def loads(data):
+    """
+    Deserializes JSON bytes or str with the configured backend
+    """
+    if get_backend_name() == BACKEND_ORJSON:
+        return orjson.loads(data)
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
@@ -0,0 +1,52 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from vending_machine.models import Order, OrderArchive
+
+
+class Command(BaseCommand):
+    help = "Moves orders older than the retention period to the archive table in bounded batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365, help="Retention period in days")
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of orders moved per transaction")
+        parser.add_argument(
+            '--sleep', type=float, default=0.0, help="Seconds to pause between batches to let other writers in"
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        batch_size = options['batch_size']
+        last_pk, total = 0, 0
+        while True:
+            # Orders are created in primary key order, so the ones to archive form a prefix of
+            # the table: walk it by primary key and stop at the first order inside the retention period
+            batch = list(Order.objects.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            expired = []
+            for order in batch:
+                if order.created_at >= cutoff:
+                    break
+                expired.append(order)
+            if expired:
+                with transaction.atomic():
+                    OrderArchive.objects.bulk_create([
+                        OrderArchive(
+                            id=order.id, buyer_id=order.buyer_id, seller_id=order.seller_id,
+                            product_id=order.product_id, quantity=order.quantity,
+                            unit_cost=order.unit_cost, created_at=order.created_at
+                        )
+                        for order in expired
+                    ], ignore_conflicts=True)
+                    Order.objects.filter(pk__in=[order.pk for order in expired]).delete()
+                total += len(expired)
+                last_pk = expired[-1].pk
+                self.stdout.write(f"Archived {total} orders")
+            if len(expired) < batch_size:
+                break
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} orders created before {cutoff.isoformat()}"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from vending_machine.tasks import run_pending, stale_tasks
+
+
+class Command(BaseCommand):
+    help = "Runs background tasks left in the database by crashed processes or a full task queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, default=60,
+            help="Only run tasks enqueued this many seconds ago, to leave recent ones to the workers"
+        )
+        parser.add_argument('--batch-size', type=int, default=100, help="Number of tasks run per batch")
+
+    def handle(self, *args, **options):
+        last_pk, total, ran = 0, 0, 0
+        while True:
+            batch = list(
+                stale_tasks(options['older_than']).filter(pk__gt=last_pk)
+                .order_by('pk')[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            total += len(batch)
+            ran += run_pending(batch)
+        self.stdout.write(self.style.SUCCESS(f"Ran {ran} of {total} pending tasks"))
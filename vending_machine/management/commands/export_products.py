@@ -0,0 +1,41 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from vending_machine import json_backend
+from vending_machine.models import Product
+
+EXPORT_FIELDS = ('id', 'product_name', 'seller', 'cost', 'amount_available')
+
+
+class Command(BaseCommand):
+    help = "Streams the product catalog as NDJSON, one product per line, in constant memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', default='-', help="File to write, '-' for stdout")
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000, help="Number of rows fetched from the database at a time"
+        )
+
+    def handle(self, *args, **options):
+        rows = Product.objects.order_by('pk').values_list(
+            'id', 'product_name', 'seller_id', 'cost', 'amount_available'
+        ).iterator(chunk_size=options['chunk_size'])
+
+        start, count = time.perf_counter(), 0
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        try:
+            for row in rows:
+                output.write(json_backend.dumps(dict(zip(EXPORT_FIELDS, row))) + b'\n')
+                count += 1
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+            else:
+                output.flush()
+
+        elapsed = time.perf_counter() - start
+        self.stderr.write(
+            f"Exported {count} products in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.0f} rows/s)"
+        )
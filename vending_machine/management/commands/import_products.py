@@ -0,0 +1,170 @@
+import sys
+import time
+from collections import defaultdict
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F
+from rest_framework.exceptions import ValidationError
+
+from vending_machine import json_backend
+from vending_machine.models import Product, Sequence, User
+from vending_machine.serializer import ProductImportSerializer
+from vending_machine.sharding import shard_for_user
+from vending_machine.signals import CATALOG_SEQUENCE, PRODUCT_SEQUENCE
+
+# Imported sellers are active: seller_deleted is written too, clearing it on products moved to them
+UPDATE_FIELDS = ('product_name', 'seller', 'cost', 'amount_available', 'change_seq', 'seller_deleted')
+
+
+def existing_sellers(seller_ids):
+    """
+    Returns the ids among seller_ids of existing users with the seller role, one query per shard
+    """
+    by_shard = defaultdict(list)
+    for seller_id in seller_ids:
+        by_shard[shard_for_user(seller_id)].append(seller_id)
+    sellers = set()
+    for alias, ids in by_shard.items():
+        sellers.update(
+            User.objects.using(alias).filter(pk__in=ids, role='seller').values_list('pk', flat=True)
+        )
+    return sellers
+
+
+def upsert_products(products, using=DEFAULT_DB_ALIAS):
+    """
+    Inserts products with explicit ids, or updates the existing rows with these ids.
+    SQLite and PostgreSQL do it in one INSERT ... ON CONFLICT statement per row, run with
+    executemany; bulk_update's CASE WHEN statements get slow as batches grow.
+    """
+    connection = connections[using]
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        existing = set(Product.all_objects.using(using).filter(
+            pk__in=[product.pk for product in products]
+        ).values_list('pk', flat=True))
+        Product.all_objects.using(using).bulk_create(
+            [product for product in products if product.pk not in existing], batch_size=1000
+        )
+        Product.all_objects.using(using).filter(pk__in=existing).update(version=F('version') + 1)
+        Product.all_objects.using(using).bulk_update(
+            [product for product in products if product.pk in existing], UPDATE_FIELDS, batch_size=1000
+        )
+        return
+
+    qn = connection.ops.quote_name
+    table = qn(Product._meta.db_table)
+    columns = [Product._meta.get_field(name).column for name in ('id', ) + UPDATE_FIELDS + ('version', )]
+    sql = (
+        f"INSERT INTO {table} ({', '.join(qn(column) for column in columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON CONFLICT ({qn('id')}) DO UPDATE SET "
+        + ', '.join(f"{qn(column)} = excluded.{qn(column)}" for column in columns[1:-1])
+        + f", {qn('version')} = {table}.{qn('version')} + 1"
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            (product.pk, product.product_name, product.seller_id, product.cost,
+             product.amount_available, product.change_seq, product.seller_deleted, product.version)
+            for product in products
+        ])
+
+
+class Command(BaseCommand):
+    help = "Upserts products from an NDJSON file, as written by export_products, in batched transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="NDJSON file to read, '-' for stdin")
+        parser.add_argument(
+            '--batch-size', type=int, default=5000, help="Number of lines validated and written per transaction"
+        )
+        parser.add_argument('--strict', action='store_true', help="Stop at the first invalid line")
+
+    def handle(self, *args, **options):
+        stream = sys.stdin.buffer if options['input'] == '-' else open(options['input'], 'rb')
+        start = time.perf_counter()
+        self.created = self.updated = self.invalid = 0
+        try:
+            line_number = 0
+            while True:
+                lines = list(islice(stream, options['batch_size']))
+                if not lines:
+                    break
+                self.import_batch(lines, line_number, options['strict'])
+                line_number += len(lines)
+                if options['verbosity'] > 1:
+                    self.report(line_number, start)
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+        if self.created:
+            # Move the primary key sequence past explicitly imported ids
+            connection = connections[DEFAULT_DB_ALIAS]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Product]):
+                    cursor.execute(sql)
+        self.report(self.created + self.updated + self.invalid, start)
+
+    def report(self, lines, start):
+        elapsed = time.perf_counter() - start
+        self.stderr.write(
+            f"{lines} lines: {self.created} created, {self.updated} updated, {self.invalid} invalid "
+            f"in {elapsed:.1f}s ({lines / elapsed if elapsed else 0:.0f} rows/s)"
+        )
+
+    def reject(self, line_number, errors, strict):
+        if strict:
+            raise CommandError(f"Line {line_number}: {errors}")
+        self.stderr.write(f"Line {line_number} skipped: {errors}")
+        self.invalid += 1
+
+    def import_batch(self, lines, first_line, strict):
+        rows, row_lines = [], []
+        for offset, line in enumerate(lines, start=first_line + 1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json_backend.loads(line))
+                row_lines.append(offset)
+            except ValueError as e:
+                self.reject(offset, f"invalid JSON ({e})", strict)
+
+        # One serializer for the batch, as ListSerializer does, but keeping the valid rows
+        serializer = ProductImportSerializer()
+        valid = []
+        for line_number, row in zip(row_lines, rows):
+            try:
+                valid.append((line_number, serializer.run_validation(row)))
+            except ValidationError as e:
+                self.reject(line_number, e.detail, strict)
+
+        sellers = existing_sellers({data['seller'] for _, data in valid})
+        products = []
+        for line_number, data in valid:
+            if data['seller'] not in sellers:
+                self.reject(line_number, {"seller": [f"No seller with id {data['seller']}"]}, strict)
+                continue
+            products.append(Product(
+                id=data.get('id'), product_name=data['product_name'], seller_id=data['seller'],
+                cost=data['cost'], amount_available=data.get('amount_available'),
+            ))
+
+        with transaction.atomic():
+            ids = [product.pk for product in products if product.pk is not None]
+            existing = set(Product.all_objects.filter(pk__in=ids).values_list('pk', flat=True))
+            # bulk writes skip the save signals: stamp the batch with one change sequence value
+            # so that delta sync clients pick it up
+            change_seq = Sequence.next_value(PRODUCT_SEQUENCE)
+            Sequence.next_value(CATALOG_SEQUENCE)
+            to_create, to_upsert = [], []
+            for product in products:
+                product.change_seq = change_seq
+                (to_create if product.pk is None else to_upsert).append(product)
+            Product.all_objects.bulk_create(to_create, batch_size=1000)
+            upsert_products(to_upsert)
+        updated = sum(1 for product in to_upsert if product.pk in existing)
+        self.created += len(products) - updated
+        self.updated += updated
@@ -0,0 +1,96 @@
+import os
+import pstats
+from collections import Counter, defaultdict
+from io import StringIO
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vending_machine.profiling import PROFILE_FILE_PATTERN, get_profile_dir
+
+
+def list_profiles(directory, url_name=None):
+    """
+    Returns (url name, latency ms, kind, path) for the profile files of directory
+    """
+    profiles = []
+    for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+        match = PROFILE_FILE_PATTERN.match(entry.name)
+        if match and (url_name is None or match['name'] == url_name):
+            profiles.append((match['name'], int(match['latency']), match['kind'], entry.path))
+    return profiles
+
+
+def summarize_cprofile(paths, sort, top):
+    """
+    Merges .prof files and returns (function, calls, total ms, cumulative ms) for the top functions
+    """
+    stats = pstats.Stats(*paths, stream=StringIO())
+    rows = [
+        (pstats.func_std_string(function), calls, total * 1000, cumulative * 1000)
+        for function, (_, calls, total, cumulative, _) in stats.stats.items()
+    ]
+    rows.sort(key=lambda row: -row[3 if sort == 'cumulative' else 2])
+    return rows[:top]
+
+
+def summarize_collapsed(paths, sort, top):
+    """
+    Merges collapsed stack files and returns (function, self samples, inclusive samples) for the top functions
+    """
+    own, inclusive = Counter(), Counter()
+    for path in paths:
+        with open(path) as lines:
+            for line in lines:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                frames = stack.split(';')
+                own[frames[-1]] += int(count)
+                for frame in set(frames):
+                    inclusive[frame] += int(count)
+    counts = inclusive if sort == 'cumulative' else own
+    return [(function, own[function], inclusive[function]) for function, _ in counts.most_common(top)]
+
+
+class Command(BaseCommand):
+    help = "Lists the functions taking the most time across the profiles written by ProfilingMiddleware"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help="Profile directory, defaults to PROFILING_DIR")
+        parser.add_argument('--name', help="Only summarize the profiles of this url name")
+        parser.add_argument('--top', type=int, default=20, help="Number of functions to list")
+        parser.add_argument(
+            '--sort', choices=['tottime', 'cumulative'], default='tottime',
+            help="Rank functions by their own time or by the time spent in them and their callees"
+        )
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or get_profile_dir()
+        if not os.path.isdir(directory):
+            raise CommandError(f"No profile directory at {directory}")
+        profiles = list_profiles(directory, options['name'])
+        if not profiles:
+            self.stdout.write("No profiles captured")
+            return
+
+        latencies = defaultdict(list)
+        for name, latency_ms, _, _ in profiles:
+            latencies[name].append(latency_ms)
+        self.stdout.write("Requests:")
+        for name, values in sorted(latencies.items()):
+            values.sort()
+            self.stdout.write(
+                f"  {name}: {len(values)} profiled, median {values[len(values) // 2]}ms, max {values[-1]}ms"
+            )
+
+        prof = [path for _, _, kind, path in profiles if kind == 'prof']
+        if prof:
+            self.stdout.write(f"\nTop functions of {len(prof)} cProfile profiles (by {options['sort']}):")
+            self.stdout.write(f"  {'calls':>9}  {'tottime ms':>10}  {'cumtime ms':>10}  function")
+            for function, calls, total_ms, cumulative_ms in summarize_cprofile(prof, options['sort'], options['top']):
+                self.stdout.write(f"  {calls:9d}  {total_ms:10.2f}  {cumulative_ms:10.2f}  {function}")
+
+        collapsed = [path for _, _, kind, path in profiles if kind == 'collapsed']
+        if collapsed:
+            self.stdout.write(f"\nTop functions of {len(collapsed)} sampled profiles (by {options['sort']}):")
+            self.stdout.write(f"  {'self':>9}  {'inclusive':>10}  function")
+            for function, own, inclusive in summarize_collapsed(collapsed, options['sort'], options['top']):
+                self.stdout.write(f"  {own:9d}  {inclusive:10d}  {function}")
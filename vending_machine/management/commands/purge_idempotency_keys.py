@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from vending_machine.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Deletes expired idempotency keys in bounded batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of keys deleted per statement")
+
+    def handle(self, *args, **options):
+        now, total = timezone.now(), 0
+        while True:
+            keys = list(
+                IdempotencyKey.objects.filter(expires_at__lte=now)
+                .values_list('key', flat=True)[:options['batch_size']]
+            )
+            if not keys:
+                break
+            IdempotencyKey.objects.filter(key__in=keys).delete()
+            total += len(keys)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {total} expired idempotency keys"))
@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import get_runner, override_settings
+from django.urls import URLPattern, URLResolver, get_resolver
+
+from vending_machine.query_budget import get_budget, observed
+
+
+def iter_endpoints(patterns=None, prefix=''):
+    """
+    Yields (route, url name, view) for every named url pattern
+    """
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        if isinstance(pattern, URLResolver):
+            namespace = f'{pattern.namespace}:' if pattern.namespace else ''
+            for route, name, view in iter_endpoints(pattern.url_patterns, prefix + str(pattern.pattern)):
+                yield route, namespace + name, view
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            yield prefix + str(pattern.pattern), pattern.name, pattern.callback
+
+
+def report_rows(costs=None):
+    """
+    Returns (route, url name, budgeted queries, observed queries, budgeted ms, observed ms, requests, status)
+    for every endpoint with a budget or an observed cost
+    """
+    costs = observed if costs is None else costs
+    rows = []
+    for route, name, view in iter_endpoints():
+        budget, cost = get_budget(view), costs.get(name)
+        if budget is None and cost is None:
+            continue
+        if cost is None:
+            status = 'NOT COVERED'
+        elif cost.violations:
+            status = 'OVER'
+        else:
+            status = 'OK'
+        rows.append((
+            route, name,
+            budget.queries if budget else None, cost.max_queries if cost else None,
+            budget.time_limit_ms if budget else None, round(cost.max_time_ms, 1) if cost else None,
+            cost.requests if cost else 0, status,
+        ))
+    return rows
+
+
+class Command(BaseCommand):
+    help = "Runs the test suite and lists every endpoint's observed SQL cost against its query budget"
+
+    def add_arguments(self, parser):
+        parser.add_argument('test_labels', nargs='*', default=['vending_machine'])
+
+    def handle(self, *args, **options):
+        observed.clear()
+        runner = get_runner(settings)(verbosity=0, interactive=False)
+        # Record overruns instead of failing the tests that trigger them
+        with override_settings(QUERY_BUDGET_RAISE=False, TESTING=True):
+            failures = runner.run_tests(options['test_labels'])
+
+        header = ('endpoint', 'name', 'budget', 'max queries', 'budget ms', 'max ms', 'requests', 'status')
+        rows = [header] + [tuple('-' if value is None else str(value) for value in row) for row in report_rows()]
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        for row in rows:
+            self.stdout.write('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+        if failures:
+            self.stderr.write(f'{failures} test(s) failed, costs of their requests may be incomplete')
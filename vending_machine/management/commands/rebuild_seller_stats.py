@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Sum
+
+from vending_machine.models import Order, OrderArchive, Product, SellerProductStats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the seller sales summaries from the purchase records (including archived ones), "
+        "one chunk of products at a time"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Number of products per transaction")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk, total = 0, 0
+        while True:
+            products = list(
+                Product.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'seller_id')[:chunk_size]
+            )
+            if not products:
+                break
+            last_pk = products[-1][0]
+            sellers = dict(products)
+            with transaction.atomic():
+                sales = {}
+                for model in (Order, OrderArchive):
+                    rows = (
+                        model.objects.filter(product_id__in=sellers)
+                        .values('product_id')
+                        .annotate(units_sold=Sum('quantity'), revenue=Sum(F('quantity') * F('unit_cost')))
+                    )
+                    for row in rows:
+                        units_sold, revenue = sales.get(row['product_id'], (0, 0))
+                        sales[row['product_id']] = (units_sold + row['units_sold'], revenue + row['revenue'])
+                SellerProductStats.objects.filter(product_id__in=sellers).delete()
+                SellerProductStats.objects.bulk_create([
+                    SellerProductStats(
+                        seller_id=sellers[product_id], product_id=product_id,
+                        units_sold=units_sold, revenue=revenue
+                    )
+                    for product_id, (units_sold, revenue) in sales.items()
+                ])
+            total += len(products)
+            self.stdout.write(f"Rebuilt sales summaries of {total} products")
+        self.stdout.write(self.style.SUCCESS("Seller sales summaries rebuilt"))
@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+from rest_framework.authtoken.models import Token
+
+from vending_machine.models import User, Sequence
+from vending_machine.sharding import USER_ID_SEQUENCE, shard_for_user, user_databases
+
+
+class Command(BaseCommand):
+    help = "Moves users and their tokens to the shard they hash to in a new USER_SHARDS list"
+
+    def add_arguments(self, parser):
+        parser.add_argument('shards', nargs='+', help="Database aliases of the new USER_SHARDS")
+        parser.add_argument(
+            '--from', dest='sources', nargs='+',
+            help="Databases currently holding users, defaults to the current USER_SHARDS"
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of users read per query")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the users to move")
+
+    def handle(self, *args, **options):
+        shards, sources = options['shards'], options['sources'] or user_databases()
+        for alias in set(shards) | set(sources):
+            if alias not in connections.databases:
+                raise CommandError(f"Unknown database {alias!r}")
+
+        moves = {}
+        for source in sources:
+            last_pk = 0
+            while True:
+                batch = list(
+                    User.all_objects.using(source).filter(pk__gt=last_pk).order_by('pk')
+                    .values_list('pk', flat=True)[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                last_pk = batch[-1]
+                for user_id in batch:
+                    target = shard_for_user(user_id, shards)
+                    if target != source:
+                        moves[(source, target)] = moves.get((source, target), 0) + 1
+                        if not options['dry_run']:
+                            self.move_user(user_id, source, target)
+
+        if not options['dry_run']:
+            self.advance_id_sequence(set(shards) | set(sources))
+        for (source, target), count in sorted(moves.items()):
+            self.stdout.write(f"{source} -> {target}: {count} users")
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {sum(moves.values())} users"))
+
+    def move_user(self, user_id, source, target):
+        """
+        Copies a user, its tokens and its group/permission links to target, then deletes them
+        from source. Copies are skipped when present, so an interrupted run can be resumed.
+        """
+        user = User.all_objects.using(source).get(pk=user_id)
+        tokens = list(Token.objects.using(source).filter(user_id=user_id))
+        links = [
+            (through, list(through.objects.using(source).filter(user_id=user_id)))
+            for through in (User.groups.through, User.user_permissions.through)
+        ]
+        with transaction.atomic(using=target):
+            if not User.all_objects.using(target).filter(pk=user_id).exists():
+                user.save(using=target, force_insert=True)
+                Token.objects.using(target).bulk_create(tokens)
+                for through, rows in links:
+                    through.objects.using(target).bulk_create(rows)
+        with transaction.atomic(using=source):
+            for through, _ in links:
+                through.objects.using(source).filter(user_id=user_id)._raw_delete(source)
+            Token.objects.using(source).filter(user_id=user_id)._raw_delete(source)
+            User.all_objects.using(source).filter(pk=user_id)._raw_delete(source)
+
+    def advance_id_sequence(self, aliases):
+        """
+        Moves the user id sequence past the ids created before sharding
+        """
+        max_id = max(
+            (User.all_objects.using(alias).aggregate(max_id=Max('pk'))['max_id'] or 0 for alias in aliases),
+            default=0
+        )
+        Sequence.objects.using(DEFAULT_DB_ALIAS).get_or_create(name=USER_ID_SEQUENCE)
+        Sequence.objects.using(DEFAULT_DB_ALIAS).filter(name=USER_ID_SEQUENCE, value__lt=max_id).update(value=max_id)
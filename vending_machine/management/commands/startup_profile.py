@@ -0,0 +1,80 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter, so that imports are measured from a cold start
+PROFILE_SCRIPT = """
+import json, os, sys, time
+start = time.perf_counter()
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings_module!r})
+django.setup()
+phases = {{'django.setup()': time.perf_counter() - start}}
+from vending_machine.warmup import warm_up
+phases.update(warm_up())
+sys.stdout.write(json.dumps(phases))
+"""
+
+
+def parse_import_times(lines):
+    """
+    Parses `python -X importtime` output into {module: (self_us, cumulative_us)}
+    """
+    modules = {}
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+class Command(BaseCommand):
+    help = "Reports import and initialization time of a cold start, by package, module and warm-up step"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=15, help="Number of packages and modules to list")
+        parser.add_argument('--json', action='store_true', help="Output the report as JSON")
+
+    def handle(self, *args, **options):
+        script = PROFILE_SCRIPT.format(settings_module=os.environ.get('DJANGO_SETTINGS_MODULE', 'mvp.settings'))
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', script],
+            capture_output=True, text=True, cwd=str(settings.BASE_DIR)
+        )
+        if result.returncode:
+            raise CommandError(f"Profiled startup failed:\n{result.stderr[-2000:]}")
+
+        phases = json.loads(result.stdout)
+        modules = parse_import_times(result.stderr.splitlines())
+        packages = defaultdict(int)
+        for name, (self_us, _) in modules.items():
+            packages[name.split('.')[0]] += self_us
+        top = options['top']
+        report = {
+            "total_import_ms": sum(self_us for self_us, _ in modules.values()) / 1000,
+            "phases_ms": {name: seconds * 1000 for name, seconds in phases.items()},
+            "packages_ms": {
+                name: self_us / 1000 for name, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]
+            },
+            "modules_ms": {
+                name: self_us / 1000
+                for name, (self_us, _) in sorted(modules.items(), key=lambda item: -item[1][0])[:top]
+            },
+        }
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"Imports: {report['total_import_ms']:.1f}ms in {len(modules)} modules\n")
+        for title, key in (("Phases", 'phases_ms'), ("Packages (self import time)", 'packages_ms'),
+                           ("Modules (self import time)", 'modules_ms')):
+            self.stdout.write(f"\n{title}:")
+            for name, ms in report[key].items():
+                self.stdout.write(f"  {ms:9.2f}ms  {name}")
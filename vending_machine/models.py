@@ -1,9 +1,14 @@
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, connections, models, router, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser, PermissionsMixin
 from django.utils.translation import gettext_lazy as _
 
 from mvp.settings import AUTH_USER_MODEL
+from vending_machine.sharding import (
+    USER_FOREIGN_KEY_CONSTRAINT, allocate_user_id, atomic_on, shard_for_user, sharding_enabled, user_databases
+)
 
 
 class UserRoleChoices(models.TextChoices):
@@ -20,11 +25,60 @@ class CoinChoices(models.IntegerChoices):
     COIN_100 = 100
 
 
+class VersionConflict(Exception):
+    """
+    Raised by a conditional save when the row changed since the expected version
+    """
+
+
+class VersionedModel(models.Model):
+    """
+    Optimistic concurrency control. Every save increments version in the UPDATE statement.
+    Setting expected_version before save() makes it UPDATE ... WHERE id = ? AND version = ?,
+    raising VersionConflict when another write got there first. The exception marks the current
+    transaction for rollback: run the save in its own atomic block to handle it.
+    """
+    version = models.PositiveIntegerField(default=1)
+
+    expected_version = None
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'version' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'version']
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            self.expected_version = None
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        values = [
+            (field, model, F('version') + 1 if field.name == 'version' else value)
+            for field, model, value in values
+        ]
+        expected_version = self.expected_version
+        if expected_version is not None:
+            base_qs = base_qs.filter(version=expected_version)
+        updated = super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        if not updated and expected_version is not None:
+            raise VersionConflict(f'{self._meta.object_name} {pk_val} is no longer at version {expected_version}')
+        if updated:
+            self.version = (expected_version or self.version) + 1
+        return updated
+
+
 class MyUserManager(BaseUserManager):
     """
     Custom user manager
     override create_user and create_superuser method of BaseUserManager
+    Soft deleted users are hidden, User.all_objects includes them.
     """
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
     def create_user(self, username, password):
         """
         Creates new user and saves it to database
@@ -35,9 +89,29 @@ class MyUserManager(BaseUserManager):
             raise ValueError(_("Users must specify a password field"))
         user = self.model(username=username)
         user.set_password(password)
-        user.save(using=self._db)
+        self.save_new(user)
         return user
 
+    def save_new(self, user):
+        """
+        Saves a new user, on its shard with an id from the global sequence when users are sharded
+        """
+        if sharding_enabled():
+            user.pk = allocate_user_id()
+            user.save(using=shard_for_user(user.pk), force_insert=True)
+        else:
+            user.save(using=self._db)
+
+    def get_by_natural_key(self, username):
+        if not sharding_enabled() or self._db:
+            return super().get_by_natural_key(username)
+        # The shard of a user is only known from its id, look the username up on every shard
+        for alias in user_databases():
+            user = self.db_manager(alias).filter(username=username).first()
+            if user is not None:
+                return user
+        raise self.model.DoesNotExist
+
     def create_superuser(self, username, password=None):
         """
         Creates and saves a superuser with the given username and password.
@@ -51,7 +125,7 @@ class MyUserManager(BaseUserManager):
         return user
 
 
-class User(AbstractBaseUser, PermissionsMixin):
+class User(VersionedModel, AbstractBaseUser, PermissionsMixin):
 
     username = models.CharField(max_length=255, unique=True)
     role = models.CharField(choices=UserRoleChoices.choices, default=UserRoleChoices.BUYER, max_length=20)
@@ -59,8 +133,11 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     is_active = models.BooleanField(default=True)
     is_admin = models.BooleanField(default=False)
+    # Set by soft_delete(), the row and its dependents are removed by the purge_user task
+    deleted_at = models.DateTimeField(null=True, blank=True)
 
     objects = MyUserManager()
+    all_objects = models.Manager()
 
     USERNAME_FIELD = 'username'
     REQUIRED_FIELDS = ['']
@@ -75,9 +152,320 @@ class User(AbstractBaseUser, PermissionsMixin):
     def is_staff(self):
         return self.is_admin
 
+    def soft_delete(self):
+        """
+        Hides the user and their products right away, and leaves deleting their rows
+        to the purge_user background task. The user row may live on a shard: both databases
+        roll back if any write fails, then commit one after the other.
+        """
+        from vending_machine.signals import CATALOG_SEQUENCE
+        from vending_machine.tasks import enqueue
 
-class Product(models.Model):
+        self.deleted_at = timezone.now()
+        self.is_active = False
+        with atomic_on(self._state.db or DEFAULT_DB_ALIAS, DEFAULT_DB_ALIAS):
+            self.save(update_fields=['deleted_at', 'is_active'])
+            Product.all_objects.filter(seller_id=self.pk).update(seller_deleted=True)
+            # Their products leave the product list: invalidate the cached ones
+            Sequence.next_value(CATALOG_SEQUENCE)
+            enqueue('purge_user', user_id=self.pk)
+
+
+class Sequence(models.Model):
+    """
+    Named monotonically increasing counters
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    @classmethod
+    def next_value(cls, name, using='default'):
+        """
+        Increments the counter and returns its new value. Holds the counter row locked until the
+        end of the transaction, so values become visible in the order they are handed out.
+        """
+        connection = connections[using]
+        if connection.vendor == 'postgresql' or (
+                connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {cls._meta.db_table} SET value = value + 1 WHERE name = %s RETURNING value", [name]
+                )
+                row = cursor.fetchone()
+            if row:
+                return row[0]
+        elif cls.objects.using(using).filter(name=name).update(value=F('value') + 1):
+            return cls.objects.using(using).get(name=name).value
+        cls.objects.using(using).get_or_create(name=name)
+        return cls.next_value(name, using)
+
+    @classmethod
+    def current_value(cls, name, using='default'):
+        return cls.objects.using(using).filter(name=name).values_list('value', flat=True).first() or 0
+
+
+class ProductManager(models.Manager):
+    """
+    Hides the products of soft deleted sellers, Product.all_objects includes them.
+    """
+    def get_queryset(self):
+        return super().get_queryset().filter(seller_deleted=False)
+
+
+class Product(VersionedModel):
     product_name = models.CharField(max_length=255)
     cost = models.IntegerField()
     amount_available = models.IntegerField(null=True)
-    seller = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE)
+    seller = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=USER_FOREIGN_KEY_CONSTRAINT)
+    # Value of the 'product' Sequence when the product was last written, for delta sync
+    change_seq = models.BigIntegerField(default=0, db_index=True)
+    # Set by User.soft_delete(), hides the product until purge_user deletes it without joining
+    # the seller, who may live on another database
+    seller_deleted = models.BooleanField(default=False)
+
+    objects = ProductManager()
+    all_objects = models.Manager()
+
+    # Attributes of the catalog_state() of a product
+    CATALOG_FIELDS = {'product_name', 'cost', 'seller_id', 'seller_deleted', 'amount_available'}
+    # catalog_state() when the product was loaded or last saved, None when unknown
+    _loaded_catalog_state = None
+
+    class Meta:
+        indexes = [
+            # Serve the product list filters/orderings whitelisted in ProductFilterSerializer
+            models.Index(fields=['cost', 'amount_available'], name='product_cost_stock_idx'),
+            models.Index(fields=['seller', 'cost', 'amount_available'], name='product_seller_cost_idx'),
+            # in_stock ordered by id: an ordered scan of the matching products only
+            models.Index(fields=['id'], condition=Q(amount_available__gt=0), name='product_in_stock_id_idx'),
+            models.Index(
+                fields=['id'], condition=Q(amount_available__lte=0) | Q(amount_available__isnull=True),
+                name='product_sold_out_id_idx'
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        # The pre_save signal stamps change_seq: commit the sequence increment with the row, so that
+        # change_seq values become visible in order and delta sync never skips past an uncommitted one
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+        self.remember_catalog_state()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if len(values) == len(cls._meta.concrete_fields):
+            instance._loaded_catalog_state = instance.catalog_state()
+        return instance
+
+    def catalog_state(self):
+        """
+        What the cached product lists show of the product, apart from its stock count and version:
+        its name, cost, seller, and whether it is in stock and visible
+        """
+        return self.product_name, self.cost, self.seller_id, self.seller_deleted, (self.amount_available or 0) > 0
+
+    def catalog_changed(self):
+        """
+        Whether catalog_state() changed since the product was loaded or saved. Products never
+        saved, or loaded with deferred fields, count as changed: comparing would load the fields.
+        """
+        return self._loaded_catalog_state is None or self._loaded_catalog_state != self.catalog_state()
+
+    def remember_catalog_state(self):
+        # Unless that would load deferred fields
+        if not self.get_deferred_fields() & self.CATALOG_FIELDS:
+            self._loaded_catalog_state = self.catalog_state()
+
+
+class ProductTombstone(models.Model):
+    """
+    Records a product deletion in the product change sequence
+    """
+    product_id = models.IntegerField()
+    change_seq = models.BigIntegerField(db_index=True)
+
+
+class Order(models.Model):
+    """
+    Purchase record written by /buy
+    """
+    # Indexed through order_buyer_created_idx
+    buyer = models.ForeignKey(
+        AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='orders', db_index=False,
+        db_constraint=USER_FOREIGN_KEY_CONSTRAINT
+    )
+    seller = models.ForeignKey(
+        AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sales', db_constraint=USER_FOREIGN_KEY_CONSTRAINT
+    )
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
+    quantity = models.PositiveIntegerField()
+    unit_cost = models.IntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['buyer', 'created_at', 'id'], name='order_buyer_created_idx'),
+        ]
+
+
+class OrderArchive(models.Model):
+    """
+    Orders moved out of Order by the archive_orders command.
+    References are kept as plain ids so archived rows never block deletes.
+    """
+    id = models.IntegerField(primary_key=True)
+    buyer_id = models.IntegerField()
+    seller_id = models.IntegerField()
+    product_id = models.IntegerField(null=True, db_index=True)
+    quantity = models.PositiveIntegerField()
+    unit_cost = models.IntegerField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['buyer_id', 'created_at', 'id'], name='archive_buyer_created_idx'),
+        ]
+
+
+class SellerProductStats(models.Model):
+    """
+    Per product sales summary, incremented by /buy in the purchase transaction
+    """
+    # Indexed through stats_seller_revenue_idx
+    seller = models.ForeignKey(
+        AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='product_stats', db_index=False,
+        db_constraint=USER_FOREIGN_KEY_CONSTRAINT
+    )
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='stats')
+    units_sold = models.BigIntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['seller', '-revenue'], name='stats_seller_revenue_idx'),
+        ]
+
+    @classmethod
+    def add_sale(cls, product, quantity, using='default'):
+        """
+        Adds a sale to the summary of product, creating it on the first sale. A single upsert
+        where the database supports INSERT ... ON CONFLICT.
+        """
+        revenue = quantity * product.cost
+        connection = connections[using]
+        if connection.vendor == 'postgresql' or (
+                connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 24)):
+            table = cls._meta.db_table
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} (seller_id, product_id, units_sold, revenue) VALUES (%s, %s, %s, %s) "
+                    f"ON CONFLICT (product_id) DO UPDATE SET units_sold = {table}.units_sold + excluded.units_sold, "
+                    f"revenue = {table}.revenue + excluded.revenue",
+                    [product.seller_id, product.pk, quantity, revenue]
+                )
+            return
+        increment = {"units_sold": F('units_sold') + quantity, "revenue": F('revenue') + revenue}
+        if cls.objects.using(using).filter(product=product).update(**increment):
+            return
+        _, created = cls.objects.using(using).get_or_create(
+            product=product, defaults={"seller_id": product.seller_id, "units_sold": quantity, "revenue": revenue}
+        )
+        if not created:  # Created concurrently
+            cls.objects.using(using).filter(product=product).update(**increment)
+
+
+class IdempotencyKey(models.Model):
+    """
+    Response stored for an Idempotency-Key header, keyed by a digest of the key and the request
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    # Null while the first request is being processed
+    status_code = models.PositiveSmallIntegerField(null=True)
+    # Request processing the key, and the last time its process reported it alive
+    owner = models.CharField(max_length=64, blank=True)
+    heartbeat_at = models.DateTimeField(null=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    body = models.BinaryField(blank=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+
+class RevokedToken(models.Model):
+    """
+    Revocation list of signed tokens, kept until the tokens expire
+    """
+    jti = models.CharField(max_length=32, primary_key=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+
+class PendingTask(models.Model):
+    """
+    Durable copy of a background task, written in the transaction that enqueues it
+    and deleted once the task has run
+    """
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+
+
+class StockAlert(models.Model):
+    """
+    Low stock notification for the seller of a product
+    """
+    seller = models.ForeignKey(
+        AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='stock_alerts',
+        db_constraint=USER_FOREIGN_KEY_CONSTRAINT
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_alerts')
+    amount_available = models.IntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+
+class Machine(models.Model):
+    """
+    A vending machine of the fleet. Its stock and its buyers' balances are kept in
+    tables whose keys lead with machine_id, so each machine's rows are partitioned
+    from the others and can later be moved to a database of their own.
+    """
+    name = models.CharField(max_length=255)
+    location = models.CharField(max_length=255, blank=True)
+
+    def __str__(self):
+        return self.name
+
+
+class MachineStock(models.Model):
+    """
+    Amount of a product available in a machine
+    """
+    # Indexed through machine_stock_unique
+    machine = models.ForeignKey(Machine, on_delete=models.CASCADE, related_name='stock', db_index=False)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='machine_stock')
+    amount_available = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['machine', 'product'], name='machine_stock_unique'),
+        ]
+
+
+class MachineBalance(models.Model):
+    """
+    Coins a buyer has inserted in a machine and not spent yet.
+    Stays in the default database when users are sharded: a machine purchase debits the balance
+    and the machine stock in one transaction.
+    """
+    # Indexed through machine_balance_unique
+    machine = models.ForeignKey(Machine, on_delete=models.CASCADE, related_name='balances', db_index=False)
+    buyer = models.ForeignKey(
+        AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='machine_balances',
+        db_constraint=USER_FOREIGN_KEY_CONSTRAINT
+    )
+    deposit = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['machine', 'buyer'], name='machine_balance_unique'),
+        ]
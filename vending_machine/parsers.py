@@ -0,0 +1,24 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from vending_machine import json_backend
+from vending_machine.renderers import FastJSONRenderer
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser that decodes with the configured JSON backend (see JSON_BACKEND setting)
+    """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', 'utf-8')
+        if json_backend.get_backend_name() != json_backend.BACKEND_ORJSON \
+                or encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return json_backend.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -27,8 +27,8 @@ class IsSellerOwnerOfProduct(BasePermission):
     def has_permission(self, request, view):
         if request.method in ('PUT', 'PATCH', 'DELETE'):
             pk = view.kwargs.get('pk', None)
-            product = Product.objects.get(pk=pk)
-            if request.user.pk == product.seller.pk and request.user.role == 'seller':
+            product = Product.objects.only('seller_id').get(pk=pk)
+            if request.user.pk == product.seller_id and request.user.role == 'seller':
                 return True
         elif request.method == 'GET':
             return True
@@ -0,0 +1,144 @@
+import cProfile
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_FILE_HEADER = 'X-Profile-File'
+# Profile files are named <epoch ms>-<url name>-<latency ms>ms.<prof|collapsed>
+PROFILE_FILE_PATTERN = re.compile(r'^(?P<time>\d+)-(?P<name>.+)-(?P<latency>\d+)ms\.(?P<kind>prof|collapsed)$')
+_unsafe_characters = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def get_profile_dir():
+    return Path(getattr(settings, 'PROFILING_DIR', settings.BASE_DIR / 'profiles'))
+
+
+class SamplingProfiler:
+    """
+    Records the stack of one thread every `interval` seconds from a background thread, for
+    collapsed stack (flame graph) output. The profiled thread runs at full speed in between.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._target = None
+
+    @staticmethod
+    def collapse(frame):
+        names = []
+        while frame is not None:
+            names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def sample(self):
+        frame = sys._current_frames().get(self._target)
+        if frame is not None:
+            self.stacks[self.collapse(frame)] += 1
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def enable(self):
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def dump_stats(self, path):
+        with open(path, 'w') as output:
+            for stack, count in self.stacks.most_common():
+                output.write(f'{stack} {count}\n')
+
+
+def profile_file_name(url_name, latency_ms, kind):
+    name = _unsafe_characters.sub('_', url_name or 'unresolved')
+    return f'{int(time.time() * 1000)}-{name}-{int(latency_ms)}ms.{kind}'
+
+
+def rotate(directory, keep):
+    """
+    Removes the oldest profile files of directory beyond the `keep` most recent ones
+    """
+    files = sorted(
+        (entry for entry in os.scandir(directory) if PROFILE_FILE_PATTERN.match(entry.name)),
+        key=lambda entry: entry.name, reverse=True
+    )
+    for entry in files[keep:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:  # Removed by another process
+            pass
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a random PROFILING_SAMPLE_RATE fraction of the requests, and the requests whose
+    X-Profile header holds PROFILING_SECRET. PROFILING_MODE 'cprofile' writes .prof files for
+    pstats/snakeviz, 'sampling' writes collapsed stacks for flame graphs with much less overhead.
+    Files are tagged with the url name and the latency of the request, and only the
+    PROFILING_MAX_FILES most recent ones are kept in PROFILING_DIR.
+    `manage.py profile_summary` aggregates them.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def authorized(self, request):
+        secret = getattr(settings, 'PROFILING_SECRET', None)
+        header = request.headers.get(PROFILE_HEADER)
+        return bool(secret) and header is not None and hmac.compare_digest(header.encode(), secret.encode())
+
+    def should_profile(self, request):
+        sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        return self.authorized(request) or (sample_rate > 0 and random.random() < sample_rate)
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        mode = getattr(settings, 'PROFILING_MODE', 'cprofile')
+        if mode == 'sampling':
+            profiler, kind = SamplingProfiler(getattr(settings, 'PROFILING_SAMPLING_INTERVAL', 0.005)), 'collapsed'
+        else:
+            profiler, kind = cProfile.Profile(), 'prof'
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        file_name = profile_file_name(match.view_name if match else None, latency_ms, kind)
+        directory = get_profile_dir()
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(str(directory / file_name))
+            rotate(directory, getattr(settings, 'PROFILING_MAX_FILES', 200))
+        except OSError:
+            logger.exception('Could not write profile %s', file_name)
+            return response
+        if self.authorized(request):
+            response[PROFILE_FILE_HEADER] = file_name
+        return response
@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Observed cost per url name: {url name: ViewCost}, filled by QueryBudgetMiddleware
+observed = {}
+_observed_lock = threading.Lock()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryBudget:
+    __slots__ = ('queries', 'time_ms')
+
+    def __init__(self, queries=None, time_ms=None):
+        self.queries, self.time_ms = queries, time_ms
+
+    @property
+    def time_limit_ms(self):
+        return self.time_ms if self.time_ms is not None else getattr(settings, 'QUERY_BUDGET_TIME_MS', None)
+
+    def violations(self, queries, time_ms):
+        _violations = []
+        time_limit_ms = self.time_limit_ms
+        if self.queries is not None and queries > self.queries:
+            _violations.append(f'{queries} queries > {self.queries}')
+        if time_limit_ms is not None and time_ms > time_limit_ms:
+            _violations.append(f'{time_ms:.1f}ms of SQL > {time_limit_ms}ms')
+        return _violations
+
+
+class ViewCost:
+    __slots__ = ('requests', 'max_queries', 'max_time_ms', 'violations')
+
+    def __init__(self):
+        self.requests = self.max_queries = self.violations = 0
+        self.max_time_ms = 0.0
+
+    def add(self, queries, time_ms, violated):
+        self.requests += 1
+        self.max_queries = max(self.max_queries, queries)
+        self.max_time_ms = max(self.max_time_ms, time_ms)
+        self.violations += violated
+
+
+def query_budget(queries=None, time_ms=None):
+    """
+    Declares the maximum number of SQL queries and milliseconds of SQL time of a view; time_ms
+    defaults to QUERY_BUDGET_TIME_MS. Set queries to what the most expensive path of the view should
+    cost, such as a first sale with an Idempotency-Key, and cover that path with a test: one more
+    query per request is then caught. `manage.py query_budget_report` lists the observed costs.
+    Place it above @api_view, so that it decorates the view function Django resolves.
+    """
+    def decorator(view):
+        view.query_budget = QueryBudget(queries, time_ms)
+        return view
+    return decorator
+
+
+def get_budget(view):
+    return getattr(view, 'query_budget', None)
+
+
+def _strict():
+    return getattr(settings, 'QUERY_BUDGET_RAISE', settings.DEBUG or getattr(settings, 'TESTING', False))
+
+
+class QueryCounter:
+    """
+    Execute wrapper counting the queries and the time spent in them
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.queries += 1
+
+
+@contextmanager
+def count_queries():
+    """
+    Counts the queries run by the current thread on every database
+    """
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        yield counter
+
+
+def check_budget(request, match, counter):
+    """
+    Records the cost of a request to the view of match and reports an overrun of its budget
+    """
+    budget = get_budget(match.func) if match else None
+    if budget is None:
+        return
+
+    time_ms = counter.time * 1000
+    _violations = budget.violations(counter.queries, time_ms)
+    with _observed_lock:
+        observed.setdefault(match.view_name, ViewCost()).add(counter.queries, time_ms, bool(_violations))
+    if _violations:
+        message = f'{request.method} {request.path} ({match.view_name}) exceeded its query budget: ' \
+                  f'{", ".join(_violations)}'
+        if _strict():
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+class QueryBudgetMiddleware:
+    """
+    Measures the SQL cost of requests to views with a query budget. Overruns raise
+    QueryBudgetExceeded in DEBUG and under tests, and are logged as warnings otherwise.
+    QUERY_BUDGET_RAISE overrides that choice.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with count_queries() as counter:
+            response = self.get_response(request)
+        check_budget(request, getattr(request, 'resolver_match', None), counter)
+        return response
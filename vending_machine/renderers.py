@@ -0,0 +1,25 @@
+from rest_framework.renderers import JSONRenderer
+
+from vending_machine import json_backend
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with the configured JSON backend (see JSON_BACKEND setting)
+    Falls back to DRF's stdlib json encoding for pretty printed or non-strict output.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        if json_backend.get_backend_name() != json_backend.BACKEND_ORJSON \
+                or self.ensure_ascii or not self.strict or not self.compact \
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = json_backend.dumps(data, default=self.encoder_class().default)
+        # Keep DRF's guarantee that the output is a strict javascript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -0,0 +1,134 @@
+import gzip
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from vending_machine.models import Sequence
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Content codings stored next to the raw body, in order of preference
+ENCODINGS = [
+    (name, compress) for name, compress in (
+        ('br', brotli and (lambda body: brotli.compress(body, quality=9))),
+        ('zstd', zstandard and (lambda body: zstandard.ZstdCompressor(level=10).compress(body))),
+        ('gzip', lambda body: gzip.compress(body, compresslevel=9, mtime=0)),
+    ) if compress
+]
+IDENTITY = 'identity'
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESSED_SIZE = 512
+
+
+def get_response_cache():
+    return caches[getattr(settings, 'LIST_CACHE', 'default')]
+
+
+def catalog_version(sequences):
+    """
+    Current values of the sequences a response depends on, in one query
+    """
+    values = dict(Sequence.objects.filter(name__in=sequences).values_list('name', 'value'))
+    return '.'.join(str(values.get(name, 0)) for name in sequences)
+
+
+def cache_key(view_name, version, request):
+    query = '&'.join(sorted(request.GET.urlencode().split('&')))
+    return f'list:{view_name}:{version}:{hashlib.md5(query.encode()).hexdigest()}'
+
+
+def accepted_encodings(header):
+    """
+    Parses Accept-Encoding into {coding: q}
+    """
+    accepted = {}
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(header, available):
+    """
+    Returns the preferred coding among the available variants that the client accepts
+    """
+    accepted = accepted_encodings(header or '')
+    for name, _ in ENCODINGS:
+        if name in available and accepted.get(name, accepted.get('*', 0)) > 0:
+            return name
+    return IDENTITY
+
+
+def compress_variants(body):
+    variants = {IDENTITY: body}
+    if len(body) >= MIN_COMPRESSED_SIZE:
+        for name, compress in ENCODINGS:
+            variants[name] = compress(body)
+    return variants
+
+
+def variant_response(variants, content_type, request):
+    encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING'), variants)
+    response = HttpResponse(variants[encoding], content_type=content_type)
+    if encoding != IDENTITY:
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ('Accept-Encoding', ))
+    return response
+
+
+def cached_list(*sequences):
+    """
+    Caches the JSON body of a list view, and its compressed variants, until one of the sequences
+    it depends on moves or LIST_CACHE_TIMEOUT expires. The variants are compressed once per catalog
+    version and query string; hits cost a sequence lookup and a byte copy of the variant picked by
+    Accept-Encoding.
+    Responses for browsers (text/html) and errors go through the view uncached.
+    Place it between @query_budget and @api_view.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method != 'GET' or 'text/html' in request.META.get('HTTP_ACCEPT', ''):
+                return view(request, *args, **kwargs)
+
+            cache = get_response_cache()
+            key = cache_key(view.__name__, catalog_version(sequences), request)
+            cached = cache.get(key)
+            if cached is not None:
+                return variant_response(cached['variants'], cached['content_type'], request)
+
+            response = view(request, *args, **kwargs)
+            response.render()
+            content_type = response.get('Content-Type', '')
+            if response.status_code != 200 or not content_type.startswith('application/json'):
+                return response
+            variants = compress_variants(response.content)
+            cache.set(
+                key, {'content_type': content_type, 'variants': variants},
+                getattr(settings, 'LIST_CACHE_TIMEOUT', 300)
+            )
+            return variant_response(variants, content_type, request)
+        return wrapped
+    return decorator
@@ -0,0 +1,116 @@
+import re
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+from vending_machine.models import Product
+
+FTS_TABLE = 'vending_machine_product_fts'
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _triggers_sql(product_table):
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {product_table} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, product_name) VALUES (new.id, new.product_name);
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {product_table} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, product_name)
+            VALUES ('delete', old.id, old.product_name);
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF product_name ON {product_table} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, product_name)
+            VALUES ('delete', old.id, old.product_name);
+            INSERT INTO {FTS_TABLE}(rowid, product_name) VALUES (new.id, new.product_name);
+        END
+        """,
+    ]
+
+
+def uses_fts(using='default'):
+    return connections[using].vendor == 'sqlite'
+
+
+def create_search_index(using='default', **kwargs):
+    """
+    Creates the FTS5 index over Product.product_name and the triggers keeping it in sync.
+    Connected to post_migrate: SQLite drops the triggers whenever a migration remakes
+    the product table, in which case they are recreated and the index is rebuilt.
+    """
+    if not uses_fts(using):
+        return
+    product_table = Product._meta.db_table
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = %s",
+            [f'{FTS_TABLE}_ai']
+        )
+        if cursor.fetchone():
+            return
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"product_name, content='{product_table}', content_rowid='id', prefix='2 3')"
+        )
+        for sql in _triggers_sql(product_table):
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def tokenize(query):
+    return _TOKEN_RE.findall(query.lower())
+
+
+def _match_expression(tokens):
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_products(query, limit=20, offset=0, using='default'):
+    """
+    Returns the products whose name contains every token of query as a word or word prefix,
+    best matches first.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+
+    if not uses_fts(using):
+        products = Product.objects.using(using)
+        for token in tokens:
+            products = products.filter(product_name__icontains=token)
+        return list(products.order_by('product_name', 'id')[offset:offset + limit])
+
+    match = _match_expression(tokens)
+    product_table = Product._meta.db_table
+    return list(Product.objects.using(using).raw(
+        f"""
+        SELECT p.* FROM {FTS_TABLE} JOIN {product_table} p ON p.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH %s AND p.seller_deleted = %s
+        ORDER BY {FTS_TABLE}.rank, p.id
+        LIMIT %s OFFSET %s
+        """,
+        [match, False, limit, offset]
+    ))
+
+
+def filter_products(queryset, query):
+    """
+    Restricts a product queryset to the products search_products would find for query,
+    with a subquery of the FTS5 index instead of a scan of the product names
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return queryset.none()
+
+    if not uses_fts(queryset.db):
+        for token in tokens:
+            queryset = queryset.filter(product_name__icontains=token)
+        return queryset
+
+    return queryset.filter(
+        pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [_match_expression(tokens)])
+    )
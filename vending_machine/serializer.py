@@ -1,9 +1,68 @@
+import base64
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 from rest_framework import serializers
-from vending_machine.models import User, Product
+from vending_machine.models import User, Product, SellerProductStats, Order, MachineStock
+from vending_machine.sharding import shard_for_user, user_databases
+
+
+class SparseFieldsetMixin:
+    """
+    Lets clients request a subset of the serializer fields (?fields=id,username)
+    and restricts the queried columns to the ones those fields read.
+    """
+    _readable_sources = {}
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+    @classmethod
+    def readable_sources(cls):
+        """
+        Maps each readable field name to the model attribute it reads
+        """
+        if cls not in SparseFieldsetMixin._readable_sources:
+            SparseFieldsetMixin._readable_sources[cls] = {
+                field.field_name: field.source for field in cls()._readable_fields
+            }
+        return SparseFieldsetMixin._readable_sources[cls]
 
+    @classmethod
+    def parse_fields(cls, value):
+        """
+        Validates a comma separated ?fields= value, returns None when all fields are wanted
+        """
+        if not value:
+            return None
+        fields = list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+        unknown = [name for name in fields if name not in cls.readable_sources()]
+        if unknown or not fields:
+            raise serializers.ValidationError({
+                "fields": [
+                    f"Unknown fields: {', '.join(unknown)}. "
+                    f"Available fields: {', '.join(cls.readable_sources())}"
+                ]
+            })
+        return fields
 
-class UserSerializer(serializers.ModelSerializer):
+    @classmethod
+    def project(cls, queryset, fields, extra=()):
+        """
+        Restricts queryset to the columns of fields, plus the model attributes in extra
+        """
+        if fields is None:
+            return queryset
+        sources = cls.readable_sources()
+        return queryset.only(*(sources[name] for name in fields), *extra)
+
+
+class UserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     password = serializers.CharField(
         max_length=50, min_length=6, write_only=True, allow_blank=False
     )
@@ -11,12 +70,27 @@ class UserSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = User
-        fields = ('id', 'username', 'password', 'deposit', 'role')
+        fields = ('id', 'username', 'password', 'deposit', 'role', 'version')
+        read_only_fields = ('version', )
+        extra_kwargs = {
+            # Checked on every user shard by validate_username
+            'username': {'validators': []},
+        }
+
+    def validate_username(self, value):
+        # Soft deleted users keep their username until they are purged
+        for alias in user_databases():
+            _users = User.all_objects.using(alias).filter(username=value)
+            if self.instance is not None:
+                _users = _users.exclude(pk=self.instance.pk)
+            if _users.exists():
+                raise serializers.ValidationError('user with this username already exists.', code='unique')
+        return value
 
     def create(self, validated_data):
         _user = User(**validated_data)
         _user.set_password(validated_data['password'])
-        _user.save()
+        User.objects.save_new(_user)
         return _user
 
     def update(self, instance, validated_data):
@@ -32,7 +106,285 @@ class UserSerializer(serializers.ModelSerializer):
         return instance
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class UserPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Looks the user up on its shard
+    """
+
+    def to_internal_value(self, data):
+        try:
+            pk = int(data)
+            return self.get_queryset().using(shard_for_user(pk)).get(pk=pk)
+        except User.DoesNotExist:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    serializer_related_field = UserPrimaryKeyRelatedField
+
     class Meta:
         model = Product
+        fields = ('id', 'product_name', 'seller', 'cost', 'amount_available', 'version')
+        read_only_fields = ('version', )
+
+
+class ProductImportSerializer(ProductSerializer):
+    """
+    Validates one NDJSON line of import_products. Sellers are checked in bulk by the command.
+    """
+    id = serializers.IntegerField(min_value=1, required=False)
+    seller = serializers.IntegerField(min_value=1)
+
+
+class ProductPatchSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Product
+        fields = ('product_name', 'cost', 'amount_available')
+        extra_kwargs = {name: {"required": False} for name in fields}
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError(f"Set at least one of {', '.join(self.Meta.fields)}")
+        return attrs
+
+
+class ProductRuleSerializer(serializers.Serializer):
+    field = serializers.ChoiceField(choices=['cost', 'amount_available'])
+    operation = serializers.ChoiceField(choices=['set', 'add', 'multiply'])
+    value = serializers.FloatField()
+
+    def validate(self, attrs):
+        if attrs['operation'] == 'multiply':
+            if attrs['value'] < 0:
+                raise serializers.ValidationError({"value": "A multiplier can not be negative"})
+        elif not attrs['value'].is_integer():
+            raise serializers.ValidationError({"value": f"{attrs['operation']} takes an integer"})
+        else:
+            attrs['value'] = int(attrs['value'])
+            if attrs['operation'] == 'set' and attrs['value'] < 0:
+                raise serializers.ValidationError({"value": "Ensure this value is greater than or equal to 0."})
+        return attrs
+
+
+class ProductBulkUpdateSerializer(serializers.Serializer):
+    """
+    Either explicit changes, {"products": {"<id>": {"cost": 15}}}, or rules applied to all the
+    seller's products or to ids, {"rules": [{"field": "cost", "operation": "multiply", "value": 1.1}]}
+    """
+    products = serializers.DictField(child=ProductPatchSerializer(), required=False, allow_empty=False)
+    rules = ProductRuleSerializer(many=True, required=False, allow_empty=False)
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False)
+
+    @staticmethod
+    def check_size(value):
+        max_products = getattr(settings, 'PRODUCT_BULK_MAX_PRODUCTS', 5000)
+        if len(value) > max_products:
+            raise serializers.ValidationError(f"At most {max_products} products can be updated at once")
+
+    def validate_products(self, value):
+        self.check_size(value)
+        try:
+            return {int(pk): data for pk, data in value.items()}
+        except ValueError:
+            raise serializers.ValidationError("Products must be keyed by id")
+
+    def validate_ids(self, value):
+        value = sorted(set(value))
+        self.check_size(value)
+        return value
+
+    def validate_rules(self, value):
+        fields = [rule['field'] for rule in value]
+        if len(fields) != len(set(fields)):
+            raise serializers.ValidationError("At most one rule per field")
+        return value
+
+    def validate(self, attrs):
+        if ('products' in attrs) == ('rules' in attrs):
+            raise serializers.ValidationError("Send either products or rules")
+        if 'ids' in attrs and 'rules' not in attrs:
+            raise serializers.ValidationError({"ids": "ids restrict rules"})
+        return attrs
+
+
+class MachineStockSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='product_id', read_only=True)
+    product_name = serializers.CharField(source='product.product_name', read_only=True)
+    seller = serializers.IntegerField(source='product.seller_id', read_only=True)
+    cost = serializers.IntegerField(source='product.cost', read_only=True)
+    amount_available = serializers.IntegerField(min_value=0)
+
+    class Meta:
+        model = MachineStock
         fields = ('id', 'product_name', 'seller', 'cost', 'amount_available')
+
+
+class SellerProductStatsSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.product_name', read_only=True)
+
+    class Meta:
+        model = SellerProductStats
+        fields = ('product', 'product_name', 'units_sold', 'revenue')
+
+
+class ProductSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=255)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+    offset = serializers.IntegerField(min_value=0, default=0)
+
+
+class ProductFilterSerializer(serializers.Serializer):
+    """
+    Validates the product list query parameters.
+    Only the combinations served by an index are accepted:
+        ordering by id:   primary key, or the seller foreign key index when filtering by seller,
+                          product_in_stock_id_idx or product_sold_out_id_idx with in_stock
+        ordering by cost: product_cost_stock_idx, or product_seller_cost_idx when filtering by seller
+    in_stock is checked against amount_available, which both cost indexes carry.
+    A cost range needs ordering by cost so that it is an index range scan.
+    """
+    ORDERINGS = {
+        'id': ('id', ),
+        '-id': ('-id', ),
+        # Ties are broken in index order so that no extra sort step is needed
+        'cost': ('cost', 'amount_available', 'id'),
+        '-cost': ('-cost', '-amount_available', '-id'),
+    }
+
+    seller = serializers.IntegerField(min_value=1, required=False)
+    in_stock = serializers.BooleanField(required=False)
+    min_cost = serializers.IntegerField(min_value=0, required=False)
+    max_cost = serializers.IntegerField(min_value=0, required=False)
+    ordering = serializers.ChoiceField(choices=list(ORDERINGS), required=False)
+
+    def validate(self, attrs):
+        if 'min_cost' in attrs or 'max_cost' in attrs:
+            if attrs.get('min_cost', 0) > attrs.get('max_cost', float('inf')):
+                raise serializers.ValidationError({"min_cost": "min_cost must not exceed max_cost"})
+            attrs.setdefault('ordering', 'cost')
+            if attrs['ordering'] not in ('cost', '-cost'):
+                raise serializers.ValidationError(
+                    {"ordering": "Filtering on cost requires ordering by cost or -cost"}
+                )
+        attrs.setdefault('ordering', 'id')
+        return attrs
+
+    def filter_queryset(self, queryset):
+        params = self.validated_data
+        if 'seller' in params:
+            queryset = queryset.filter(seller_id=params['seller'])
+        if 'min_cost' in params:
+            queryset = queryset.filter(cost__gte=params['min_cost'])
+        if 'max_cost' in params:
+            queryset = queryset.filter(cost__lte=params['max_cost'])
+        if params.get('in_stock') is True:
+            queryset = queryset.filter(amount_available__gt=0)
+        elif params.get('in_stock') is False:
+            queryset = queryset.filter(Q(amount_available__lte=0) | Q(amount_available__isnull=True))
+        return queryset.order_by(*self.ORDERINGS[params['ordering']])
+
+
+class OrderSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Order
+        fields = ('id', 'product', 'seller', 'quantity', 'unit_cost', 'created_at')
+
+
+class KeysetCursorField(serializers.CharField):
+    """
+    Opaque pagination cursor encoding the (created_at, id) of the last row of a page
+    """
+    default_error_messages = {'invalid_cursor': 'Invalid cursor'}
+
+    @staticmethod
+    def encode(created_at, pk):
+        return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{pk}'.encode()).decode()
+
+    def to_internal_value(self, data):
+        try:
+            created_at, pk = base64.urlsafe_b64decode(str(data).encode()).decode().split('|')
+            created_at, pk = parse_datetime(created_at), int(pk)
+        except (ValueError, UnicodeDecodeError):
+            self.fail('invalid_cursor')
+        if created_at is None:
+            self.fail('invalid_cursor')
+        return created_at, pk
+
+
+class ProductCostCursorField(serializers.CharField):
+    """
+    Opaque pagination cursor encoding the (cost, amount_available, id) of the last product of a page
+    """
+    default_error_messages = {'invalid_cursor': 'Invalid cursor'}
+
+    @staticmethod
+    def encode(product):
+        return base64.urlsafe_b64encode(
+            f'{product.cost}|{product.amount_available}|{product.pk}'.encode()
+        ).decode()
+
+    def to_internal_value(self, data):
+        try:
+            cost, amount_available, pk = base64.urlsafe_b64decode(str(data).encode()).decode().split('|')
+            return int(cost), int(amount_available), int(pk)
+        except (ValueError, UnicodeDecodeError):
+            self.fail('invalid_cursor')
+
+
+class AffordableProductSerializer(ProductSerializer):
+    max_quantity = serializers.IntegerField(read_only=True)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + ('max_quantity', )
+
+
+class AffordableProductListSerializer(serializers.Serializer):
+    cursor = ProductCostCursorField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
+class OrderListSerializer(serializers.Serializer):
+    cursor = KeysetCursorField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+
+
+class OrderBucketSerializer(serializers.Serializer):
+    bucket = serializers.ChoiceField(choices=['hour', 'day', 'week', 'month'], default='day')
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+
+
+class ProductChangesSerializer(serializers.Serializer):
+    since = serializers.IntegerField(min_value=0, default=0)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100)
+
+
+class LoginSerializer(serializers.Serializer):
+    username = serializers.CharField()
+    password = serializers.CharField(trim_whitespace=False)
+
+
+class UserListSerializer(serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=1000, required=False)
+    after = serializers.IntegerField(min_value=0, required=False)
+
+
+class BatchRequestSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+    path = serializers.CharField(max_length=2048)
+    headers = serializers.DictField(child=serializers.CharField(allow_blank=True), required=False)
+    body = serializers.JSONField(required=False)
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = BatchRequestSerializer(many=True, allow_empty=False)
+
+    def validate_requests(self, value):
+        max_requests = getattr(settings, 'BATCH_MAX_REQUESTS', 20)
+        if len(value) > max_requests:
+            raise serializers.ValidationError(f"A batch holds at most {max_requests} requests")
+        return value
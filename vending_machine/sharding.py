@@ -0,0 +1,147 @@
+import hashlib
+import heapq
+import secrets
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+# Models stored on the shard of a user, with the attribute holding the user id
+SHARDED_MODELS = {
+    ('vending_machine', 'user'): 'pk',
+    ('authtoken', 'token'): 'user_id',
+}
+USER_ID_SEQUENCE = 'user_id'
+
+# Rows of the default database reference users by id, and users may live on other databases:
+# foreign keys to the user table only get a database constraint when the deployment opts in
+# with the USER_FOREIGN_KEY_CONSTRAINTS setting
+USER_FOREIGN_KEY_CONSTRAINT = getattr(settings, 'USER_FOREIGN_KEY_CONSTRAINTS', False)
+
+
+def get_user_shards():
+    """
+    Database aliases users are spread over, from the USER_SHARDS setting.
+    An empty list disables sharding: users stay in the default database.
+    """
+    return list(getattr(settings, 'USER_SHARDS', None) or [])
+
+
+def sharding_enabled():
+    return bool(get_user_shards())
+
+
+def shard_for_user(user_id, shards=None):
+    """
+    Returns the database alias of a user, from a stable hash of its id
+    """
+    shards = get_user_shards() if shards is None else shards
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    digest = hashlib.md5(str(user_id).encode()).digest()
+    return shards[int.from_bytes(digest[:8], 'big') % len(shards)]
+
+
+def user_databases():
+    """
+    Every database holding users
+    """
+    return get_user_shards() or [DEFAULT_DB_ALIAS]
+
+
+def allocate_user_id():
+    """
+    Returns a new user id, unique across shards, from a sequence of the default database
+    """
+    from vending_machine.models import Sequence
+
+    return Sequence.next_value(USER_ID_SEQUENCE, DEFAULT_DB_ALIAS)
+
+
+def token_key_for_user(user_id):
+    """
+    DRF token key starting with the user id in hex, from which authentication finds the shard
+    holding the token instead of trying every shard
+    """
+    prefix = f'{user_id:x}.'
+    return prefix + secrets.token_hex(20)[:40 - len(prefix)]
+
+
+def user_id_of_token(key):
+    """
+    User id encoded by token_key_for_user, None for keys without one
+    """
+    prefix, dot, _ = key.partition('.')
+    if not dot:
+        return None
+    try:
+        return int(prefix, 16)
+    except ValueError:
+        return None
+
+
+@contextmanager
+def atomic_on(*aliases):
+    """
+    One atomic block per distinct database alias, the first one outermost: an exception raised
+    inside rolls all of them back. They commit one after the other on exit, innermost first.
+    """
+    with ExitStack() as stack:
+        for alias in dict.fromkeys(aliases):
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+def merged_scan(queryset, limit=None, after=None):
+    """
+    Runs queryset on every user database ordered by id and merges the results,
+    returning up to limit rows with an id greater than after. Each database
+    returns at most limit rows, so a page costs one indexed range scan per shard.
+    """
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    queryset = queryset.order_by('pk')
+    if limit is not None:
+        queryset = queryset[:limit]
+    databases = user_databases()
+    if len(databases) == 1:
+        return list(queryset.using(databases[0]))
+    rows = heapq.merge(*(queryset.using(alias) for alias in databases), key=lambda row: row.pk)
+    return [row for row, _ in zip(rows, range(limit))] if limit is not None else list(rows)
+
+
+def _user_id_of(model, instance):
+    attribute = SHARDED_MODELS.get((model._meta.app_label, model._meta.model_name))
+    if attribute is None or instance is None or not isinstance(instance, model):
+        return None
+    return getattr(instance, attribute)
+
+
+class ShardRouter:
+    """
+    Routes users and their tokens to the shard of the user when USER_SHARDS is set.
+    Instances are written back to the database they were loaded from, or to the shard of
+    their user id. Queries without an instance go to the default database: look users up
+    with .using(shard_for_user(user_id)), or merged_scan() across shards.
+    Every model is migrated on every database.
+    """
+
+    def _db_for(self, model, instance=None, **hints):
+        if not sharding_enabled():
+            return None
+        if (model._meta.app_label, model._meta.model_name) not in SHARDED_MODELS:
+            return None
+        if isinstance(instance, model) and instance._state.db:
+            return instance._state.db
+        user_id = _user_id_of(model, instance)
+        return shard_for_user(user_id) if user_id is not None else None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Users on a shard are referenced by id from rows of the default database
+        return True if sharding_enabled() else None
@@ -0,0 +1,59 @@
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from vending_machine import events
+from vending_machine.models import Product, ProductTombstone, Sequence
+
+PRODUCT_SEQUENCE = 'product'
+# Moved by writes changing what the product list shows besides stock counts, see Product.catalog_state()
+CATALOG_SEQUENCE = 'catalog'
+
+
+def create_sequences(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Creates the sequence rows up front, so that next_value is a single UPDATE from the first write
+    """
+    for name in (PRODUCT_SEQUENCE, CATALOG_SEQUENCE):
+        Sequence.objects.using(using).get_or_create(name=name)
+
+
+def publish_product_event(event_type, product_id, change_seq, data, using='default'):
+    """
+    Publishes a product event to the in-process hub once the current transaction commits
+    """
+    event = events.Event(change_seq, event_type, dict(data, id=product_id))
+    transaction.on_commit(lambda: events.product_events.publish(event), using=using)
+
+
+def product_event_data(product):
+    return {
+        "product_name": product.product_name,
+        "cost": product.cost,
+        "amount_available": product.amount_available,
+        "seller": product.seller_id,
+    }
+
+
+@receiver(pre_save, sender=Product)
+def stamp_product_change(sender, instance, using, **kwargs):
+    instance.change_seq = Sequence.next_value(PRODUCT_SEQUENCE, using)
+    if instance.catalog_changed():
+        Sequence.next_value(CATALOG_SEQUENCE, using)
+
+
+@receiver(post_save, sender=Product)
+def publish_product_change(sender, instance, created, using, **kwargs):
+    publish_product_event(
+        events.PRODUCT_CREATED if created else events.PRODUCT_UPDATED,
+        instance.pk, instance.change_seq, product_event_data(instance), using
+    )
+
+
+@receiver(post_delete, sender=Product)
+def record_product_deletion(sender, instance, using, **kwargs):
+    tombstone = ProductTombstone.objects.using(using).create(
+        product_id=instance.pk, change_seq=Sequence.next_value(PRODUCT_SEQUENCE, using)
+    )
+    Sequence.next_value(CATALOG_SEQUENCE, using)
+    publish_product_event(events.PRODUCT_DELETED, instance.pk, tombstone.change_seq, {}, using)
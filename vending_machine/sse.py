@@ -0,0 +1,78 @@
+import asyncio
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+from vending_machine import json_backend
+from vending_machine.events import DROPPED, Event, product_events
+
+SSE_PATH = '/api/v1/events/products'
+
+
+def format_event(event):
+    data = b'event: %s\ndata: %s\n\n' % (event.type.encode(), json_backend.dumps(event.data))
+    return data if event.id is None else b'id: %d\n' % event.id + data
+
+
+def _last_event_id(scope):
+    """
+    Reads the Last-Event-ID header sent by reconnecting EventSource clients, or the last_event_id
+    query parameter for the first connection of a client resuming from a stored id
+    """
+    value = dict(scope['headers']).get(b'last-event-id', b'').decode('latin-1')
+    if not value:
+        value = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('last_event_id', [''])[0]
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+async def product_events_app(scope, receive, send, hub=product_events):
+    """
+    ASGI application streaming product stock/price/delete events as server-sent events
+    """
+    if scope['method'] != 'GET':
+        await send({'type': 'http.response.start', 'status': 405, 'headers': [(b'allow', b'GET')]})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    keepalive = getattr(settings, 'EVENTS_KEEPALIVE', 15)
+    subscription, replay = hub.subscribe(_last_event_id(scope))
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        subscription.close()
+
+    disconnect_watcher = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        body = b'retry: 3000\n\n' + b''.join(format_event(event) for event in replay)
+        await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        last_event_id = replay[-1].id if replay else None
+        while True:
+            events = await subscription.get(timeout=keepalive)
+            if subscription.closed:
+                return
+            body = b''.join(format_event(event) for event in events)
+            if events:
+                last_event_id = events[-1].id
+            if subscription.dropped:
+                body += format_event(Event(last_event_id, DROPPED, {"detail": "Too slow, reconnect to resume"}))
+            elif not events:
+                body = b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': not subscription.dropped})
+            if subscription.dropped:
+                return
+    finally:
+        subscription.close()
+        disconnect_watcher.cancel()
@@ -0,0 +1,230 @@
+import logging
+import queue
+import threading
+from collections import defaultdict
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+
+from vending_machine import events
+from vending_machine.models import (
+    PendingTask, Product, StockAlert, User, Order, SellerProductStats, ProductTombstone, Sequence,
+    MachineStock, MachineBalance,
+)
+from vending_machine.sharding import shard_for_user
+from vending_machine.signals import PRODUCT_SEQUENCE, publish_product_event
+
+logger = logging.getLogger(__name__)
+
+# Registered tasks: {name: Task}
+registry = {}
+
+
+class Task:
+    __slots__ = ('name', 'func', 'batch', 'atomic')
+
+    def __init__(self, name, func, batch, atomic):
+        self.name, self.func, self.batch, self.atomic = name, func, batch, atomic
+
+    def run(self, payloads):
+        """
+        Runs the task for a list of payloads, in one call for batch tasks
+        """
+        if self.batch:
+            self.func(payloads)
+        else:
+            for payload in payloads:
+                self.func(**payload)
+
+
+def task(name=None, batch=False, atomic=True):
+    """
+    Registers a background task. Batch tasks receive the list of payloads queued
+    together, so that many small writes become one bulk statement. Tasks run in a
+    transaction unless atomic is False, for long tasks managing their own transactions.
+    """
+    def decorator(func):
+        registry[name or func.__name__] = Task(name or func.__name__, func, batch, atomic)
+        return func
+    return decorator
+
+
+def run_pending(pending_tasks):
+    """
+    Runs PendingTask rows grouped by task, deletes the ones that succeeded and counts an attempt
+    on the others. Returns the number of tasks that ran.
+    """
+    groups = defaultdict(list)
+    for pending in pending_tasks:
+        groups[pending.name].append(pending)
+    done, failed = [], []
+    for name, group in groups.items():
+        _task = registry[name]
+        try:
+            with transaction.atomic() if _task.atomic else nullcontext():
+                _task.run([pending.payload for pending in group])
+        except Exception:
+            logger.exception('Background task %s failed for %d payload(s)', name, len(group))
+            failed.extend(pending.pk for pending in group)
+        else:
+            done.extend(pending.pk for pending in group)
+    if done:
+        PendingTask.objects.filter(pk__in=done).delete()
+    if failed:
+        PendingTask.objects.filter(pk__in=failed).update(attempts=F('attempts') + 1)
+    return len(done)
+
+
+class TaskQueue:
+    """
+    In-process queue of committed PendingTask rows served by a pool of worker threads.
+    Each worker takes up to TASKS_BATCH_SIZE queued tasks at a time, waiting at most
+    TASKS_BATCH_WAIT seconds for a batch to fill. Tasks that do not fit in the queue, or
+    are lost with the process, stay in the table for `manage.py drain_tasks`.
+    """
+
+    def __init__(self):
+        self.queue = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.queue is None:
+                self.queue = queue.Queue(maxsize=getattr(settings, 'TASKS_QUEUE_SIZE', 10000))
+                for i in range(getattr(settings, 'TASKS_WORKERS', 2)):
+                    threading.Thread(target=self.work, name=f'task-worker-{i}', daemon=True).start()
+
+    def submit(self, pending):
+        if getattr(settings, 'TASKS_EAGER', False):
+            run_pending([pending])
+            return
+        self.start()
+        try:
+            self.queue.put_nowait(pending)
+        except queue.Full:
+            logger.warning('Task queue is full, %s task %s is left for drain_tasks', pending.name, pending.pk)
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        batch_size = getattr(settings, 'TASKS_BATCH_SIZE', 100)
+        batch_wait = getattr(settings, 'TASKS_BATCH_WAIT', 0.05)
+        try:
+            while len(batch) < batch_size:
+                batch.append(self.queue.get(timeout=batch_wait))
+        except queue.Empty:
+            pass
+        return batch
+
+    def work(self):
+        while True:
+            batch = self.next_batch()
+            close_old_connections()
+            try:
+                run_pending(batch)
+            except Exception:
+                logger.exception('Background task batch failed')
+            finally:
+                close_old_connections()
+                for _ in batch:
+                    self.queue.task_done()
+
+    def join(self):
+        if self.queue is not None:
+            self.queue.join()
+
+
+task_queue = TaskQueue()
+
+
+def enqueue(name, **payload):
+    """
+    Records a task in the current transaction and hands it to the workers once the
+    transaction commits, so tasks never run for rolled back writes and survive a crash.
+    """
+    pending = PendingTask.objects.create(name=name, payload=payload)
+    transaction.on_commit(lambda: task_queue.submit(pending))
+    return pending
+
+
+def stale_tasks(older_than):
+    return PendingTask.objects.filter(created_at__lte=timezone.now() - timedelta(seconds=older_than))
+
+
+@task(batch=True)
+def low_stock_alert(payloads):
+    existing = set(Product.objects.filter(
+        pk__in=[payload['product_id'] for payload in payloads]
+    ).values_list('pk', flat=True))
+    StockAlert.objects.bulk_create([
+        StockAlert(
+            seller_id=payload['seller_id'], product_id=payload['product_id'],
+            amount_available=payload['amount_available'],
+        )
+        for payload in payloads if payload['product_id'] in existing
+    ])
+
+
+def delete_in_batches(queryset, batch_size):
+    """
+    Deletes the rows of queryset with bounded DELETE ... WHERE id IN (...) statements,
+    each in its own transaction, without loading the rows or collecting cascades.
+    Dependents must be deleted first.
+    """
+    total = 0
+    while True:
+        with transaction.atomic(using=queryset.db):
+            ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return total
+            queryset.model._base_manager.using(queryset.db).filter(pk__in=ids)._raw_delete(queryset.db)
+        total += len(ids)
+
+
+def purge_products(seller_id, batch_size):
+    """
+    Deletes the products of a seller batch by batch with their dependents, recording the
+    deletions for delta sync and server-sent events. The orders of the seller, which are
+    the orders of their products, must be deleted first.
+    """
+    while True:
+        with transaction.atomic():
+            ids = list(Product.all_objects.filter(seller_id=seller_id).values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return
+            StockAlert.objects.filter(product_id__in=ids)._raw_delete(StockAlert.objects.db)
+            MachineStock.objects.filter(product_id__in=ids)._raw_delete(MachineStock.objects.db)
+            SellerProductStats.objects.filter(product_id__in=ids)._raw_delete(SellerProductStats.objects.db)
+            # One change sequence value for the whole batch, delta sync never splits it between pages
+            change_seq = Sequence.next_value(PRODUCT_SEQUENCE)
+            ProductTombstone.objects.bulk_create([
+                ProductTombstone(product_id=product_id, change_seq=change_seq) for product_id in ids
+            ])
+            Product.all_objects.filter(pk__in=ids)._raw_delete(Product.all_objects.db)
+            for product_id in ids:
+                publish_product_event(events.PRODUCT_DELETED, product_id, change_seq, {})
+
+
+@task(atomic=False)
+def purge_user(user_id):
+    """
+    Removes a soft deleted user and everything referencing them in short transactions,
+    so that deleting a large seller neither loads their rows nor holds locks for long
+    """
+    _users = User.all_objects.using(shard_for_user(user_id))
+    if not _users.filter(pk=user_id, deleted_at__isnull=False).exists():
+        return
+    batch_size = getattr(settings, 'USER_PURGE_BATCH_SIZE', 500)
+    delete_in_batches(Order.objects.filter(seller_id=user_id), batch_size)
+    purge_products(user_id, batch_size)
+    delete_in_batches(Order.objects.filter(buyer_id=user_id), batch_size)
+    delete_in_batches(SellerProductStats.objects.filter(seller_id=user_id), batch_size)
+    delete_in_batches(StockAlert.objects.filter(seller_id=user_id), batch_size)
+    delete_in_batches(MachineBalance.objects.filter(buyer_id=user_id), batch_size)
+    Token.objects.using(_users.db).filter(user_id=user_id).delete()
+    _users.filter(pk=user_id).delete()
@@ -0,0 +1,83 @@
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from vending_machine.admin import EstimatedCountPaginator
+from vending_machine.models import Product, User
+from vending_machine.utils import create_user
+
+
+class TestAdmin(APITestCase):
+    """
+        User and product admin tests
+    """
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'adminpass')
+        self.client.force_login(self.admin)
+        self.seller = create_user({"username": "seller1", "password": "passwd1"}, role='seller')
+        Product.objects.bulk_create([
+            Product(
+                product_name=f"cola {i}" if i % 2 else f"water {i}", cost=25 * i, amount_available=i,
+                seller=self.seller
+            )
+            for i in range(30)
+        ])
+        self.products_url = reverse('admin:vending_machine_product_changelist')
+        self.users_url = reverse('admin:vending_machine_user_changelist')
+
+    def test_product_changelist(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.products_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.context['cl'].result_count, 30)
+        # Sellers come with the page, not one query per row
+        self.assertLess(len(queries), 10)
+        self.assertContains(response, 'seller1')
+
+    def test_product_search_and_filter(self):
+        response = self.client.get(self.products_url, {'q': 'col'})
+        self.assertEqual(response.context['cl'].result_count, 15)
+        _product = Product.objects.get(product_name='water 4')
+        response = self.client.get(self.products_url, {'q': str(_product.pk)})
+        self.assertEqual(list(response.context['cl'].result_list), [_product])
+        response = self.client.get(self.products_url, {'cost_range': '100-500'})
+        self.assertEqual(response.context['cl'].result_count, 16)
+
+    def test_product_change_form_uses_raw_id_seller(self):
+        _product = Product.objects.first()
+        response = self.client.get(reverse('admin:vending_machine_product_change', args=[_product.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, 'vForeignKeyRawIdAdminField')
+
+    def test_user_search(self):
+        response = self.client.get(self.users_url, {'q': 'sell'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.seller])
+        # Prefixes are case sensitive index ranges
+        response = self.client.get(self.users_url, {'q': 'Sell'})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+        response = self.client.get(self.users_url, {'q': 'seller1'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.seller])
+        response = self.client.get(self.users_url, {'q': str(self.admin.pk)})
+        self.assertEqual(list(response.context['cl'].result_list), [self.admin])
+
+    def test_user_delete_is_soft(self):
+        response = self.client.post(
+            reverse('admin:vending_machine_user_delete', args=[self.seller.pk]), {'post': 'yes'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertIsNotNone(User.all_objects.get(pk=self.seller.pk).deleted_at)
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=10)
+    def test_estimated_count(self):
+        queryset = Product.objects.order_by('-id')
+        self.assertEqual(EstimatedCountPaginator(queryset, 5).count, Product.objects.order_by('-id')[0].pk)
+        self.assertEqual(EstimatedCountPaginator(queryset, 5, estimate=False).count, 11)
+
+        response = self.client.get(self.products_url, {'cost_range': '100-500'})
+        self.assertEqual(response.context['cl'].result_count, 11)
+        response = self.client.get(self.products_url, {'p': '1'})
+        self.assertGreaterEqual(response.context['cl'].result_count, 30)
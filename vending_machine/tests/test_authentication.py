@@ -0,0 +1,95 @@
+import time
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from vending_machine.authentication import issue_token, revocation_list
+from vending_machine.models import User
+from vending_machine.utils import create_user, authenticate_user
+
+
+class TestSignedTokenAuthentication(APITestCase):
+    """
+        Signed token login, verification, rotation and revocation tests
+    """
+
+    def setUp(self):
+        self.buyer = create_user({"username": "user1", "password": "passwd1"}, role='buyer')
+        self.seller = create_user({"username": "user2", "password": "passwd2"}, role='seller')
+
+    def login(self, username, password):
+        response = self.client.post(reverse('login'), {"username": username, "password": password})
+        return response
+
+    def test_login(self):
+        response = self.login("user1", "passwd1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['user'], self.buyer.pk)
+        self.assertTrue(response.data['token'].startswith('v1.k1.'))
+
+    def test_login_invalid_credentials(self):
+        response = self.login("user1", "wrong")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(reverse('login'), {"username": "user1"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_authenticated_request(self):
+        _, _token = authenticate_user(username="user1", password="passwd1", signed=True)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {_token}')
+        response = self.client.get(reverse('deposit', kwargs={"amount": 50}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(User.objects.get(pk=self.buyer.pk).deposit, 50)
+
+    def test_role_check_without_queries(self):
+        _, _token = authenticate_user(username="user2", password="passwd2", signed=True)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {_token}')
+        revocation_list.reload()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('deposit', kwargs={"amount": 50}))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(len(queries), 0, [q["sql"] for q in queries])
+
+    def test_expired_token(self):
+        _token, _ = issue_token(self.buyer, ttl=-1)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {_token}')
+        response = self.client.get(reverse('deposit', kwargs={"amount": 50}))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_tampered_token(self):
+        _token, _ = issue_token(self.buyer)
+        version, key_id, payload, signature = _token.split('.')
+        _forged, _ = issue_token(self.seller)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {version}.{key_id}.{_forged.split(".")[2]}.{signature}'
+        )
+        response = self.client.post(reverse('product-create'), {"product_name": "p", "cost": 5})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_key_rotation(self):
+        with override_settings(SIGNED_TOKEN_KEYS={'old': 'secret1'}, SIGNED_TOKEN_ACTIVE_KEY='old'):
+            _token, _ = issue_token(self.buyer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {_token}')
+        with override_settings(SIGNED_TOKEN_KEYS={'old': 'secret1', 'new': 'secret2'}, SIGNED_TOKEN_ACTIVE_KEY='new'):
+            response = self.client.get(reverse('deposit', kwargs={"amount": 5}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(issue_token(self.buyer)[0].startswith('v1.new.'))
+        with override_settings(SIGNED_TOKEN_KEYS={'new': 'secret2'}, SIGNED_TOKEN_ACTIVE_KEY='new'):
+            response = self.client.get(reverse('deposit', kwargs={"amount": 5}))
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_logout_revokes_token(self):
+        _token = self.login("user1", "passwd1").data['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {_token}')
+        response = self.client.post(reverse('logout'))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get(reverse('deposit', kwargs={"amount": 5}))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        # other processes pick the revocation up from the database
+        revocation_list.revoked = frozenset()
+        revocation_list.loaded_at = time.monotonic() - 60
+        response = self.client.get(reverse('deposit', kwargs={"amount": 5}))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,178 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command, CommandError
+from django.test import SimpleTestCase
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from vending_machine.models import Product, Order, OrderArchive, SellerProductStats, Sequence
+from vending_machine.management.commands.startup_profile import parse_import_times
+from vending_machine.utils import create_user, record_sale
+from vending_machine.warmup import warm_up
+
+
+class TestRebuildSellerStatsCommand(APITestCase):
+    """
+        rebuild_seller_stats command tests
+    """
+
+    def setUp(self):
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        self.buyer = create_user({"username": "user2", "password": "passwd2"}, role='buyer')
+        self.products = [
+            Product.objects.create(product_name=f"prod{i}", amount_available=10, cost=5 * i, seller=self.seller)
+            for i in range(1, 6)
+        ]
+
+    def test_rebuild_from_orders(self):
+        for product in self.products:
+            record_sale(self.buyer, product, 2)
+        record_sale(self.buyer, self.products[0], 1)
+        SellerProductStats.objects.filter(product=self.products[1]).delete()
+        SellerProductStats.objects.filter(product=self.products[2]).update(units_sold=100, revenue=0)
+
+        call_command('rebuild_seller_stats', chunk_size=2, stdout=StringIO())
+
+        self.assertEqual(
+            list(SellerProductStats.objects.order_by('product_id').values_list('product_id', 'units_sold', 'revenue')),
+            [(self.products[0].id, 3, 15)] + [
+                (product.id, 2, 2 * product.cost) for product in self.products[1:]
+            ]
+        )
+        self.assertEqual(Order.objects.count(), 6)
+
+
+class TestArchiveOrdersCommand(APITestCase):
+    """
+        archive_orders command tests
+    """
+
+    def setUp(self):
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        self.buyer = create_user({"username": "user2", "password": "passwd2"}, role='buyer')
+        self.product = Product.objects.create(product_name="prod", amount_available=10, cost=5, seller=self.seller)
+        now = timezone.now()
+        self.orders = [
+            Order.objects.create(
+                buyer=self.buyer, seller=self.seller, product=self.product, quantity=1, unit_cost=5,
+                created_at=now - timedelta(days=days)
+            )
+            for days in (400, 380, 370, 10, 1)
+        ]
+
+    def test_archive_old_orders_in_batches(self):
+        call_command('archive_orders', days=365, batch_size=2, stdout=StringIO())
+        self.assertEqual(
+            list(Order.objects.order_by('pk').values_list('pk', flat=True)),
+            [order.pk for order in self.orders[3:]]
+        )
+        self.assertEqual(
+            list(OrderArchive.objects.order_by('pk').values_list('pk', 'buyer_id', 'product_id')),
+            [(order.pk, self.buyer.pk, self.product.pk) for order in self.orders[:3]]
+        )
+
+    def test_rebuild_seller_stats_includes_archive(self):
+        call_command('archive_orders', days=365, stdout=StringIO())
+        call_command('rebuild_seller_stats', stdout=StringIO())
+        self.assertEqual(SellerProductStats.objects.get(product=self.product).units_sold, 5)
+
+
+class TestStartupProfileCommand(SimpleTestCase):
+    """
+        startup_profile command and warm-up tests
+    """
+
+    def test_warm_up_steps(self):
+        self.assertEqual(
+            list(warm_up()),
+            ['models', 'url resolver', 'rest framework settings', 'views', 'serializers']
+        )
+
+    def test_startup_profile_report(self):
+        out = StringIO()
+        call_command('startup_profile', '--json', top=5, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertIn('django.setup()', report['phases_ms'])
+        self.assertIn('url resolver', report['phases_ms'])
+        self.assertIn('django', report['packages_ms'])
+        self.assertEqual(len(report['modules_ms']), 5)
+        self.assertGreater(report['total_import_ms'], 0)
+
+    def test_parse_import_times(self):
+        self.assertEqual(
+            parse_import_times([
+                "import time: self [us] | cumulative | imported package",
+                "import time:       120 |        150 |   vending_machine.models",
+                "unrelated line",
+            ]),
+            {"vending_machine.models": (120, 150)}
+        )
+
+
+class TestProductExportImportCommands(APITestCase):
+    """
+        export_products and import_products command tests
+    """
+
+    def setUp(self):
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        self.buyer = create_user({"username": "user2", "password": "passwd2"}, role='buyer')
+        self.products = [
+            Product.objects.create(product_name=f"prod{i}", amount_available=i, cost=5 * i, seller=self.seller)
+            for i in range(1, 6)
+        ]
+        fd, self.path = tempfile.mkstemp(suffix='.ndjson')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write_lines(self, lines):
+        with open(self.path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def test_export_ndjson(self):
+        call_command('export_products', '--output', self.path, '--chunk-size', '2', stderr=StringIO())
+        with open(self.path) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(rows[0], {
+            "id": self.products[0].pk, "product_name": "prod1", "seller": self.seller.pk,
+            "cost": 5, "amount_available": 1,
+        })
+        self.assertEqual([row['id'] for row in rows], [product.pk for product in self.products])
+
+    def test_round_trip(self):
+        call_command('export_products', '--output', self.path, stderr=StringIO())
+        Product.objects.filter(pk__in=[product.pk for product in self.products[:2]]).delete()
+        Product.objects.filter(pk=self.products[4].pk).update(cost=1)
+        err = StringIO()
+        call_command('import_products', self.path, '--batch-size', '2', stderr=err)
+        self.assertIn('5 lines: 2 created, 3 updated, 0 invalid', err.getvalue())
+        self.assertEqual(
+            list(Product.objects.order_by('pk').values_list('pk', 'cost')),
+            [(product.pk, product.cost) for product in self.products]
+        )
+        # Imported rows are stamped for delta sync
+        self.assertEqual(
+            Product.objects.filter(change_seq__gt=self.products[-1].change_seq).count(), 5
+        )
+        self.assertGreater(Sequence.current_value('product'), self.products[-1].change_seq)
+
+    def test_invalid_lines_are_skipped(self):
+        self.write_lines([
+            json.dumps({"product_name": "new", "seller": self.seller.pk, "cost": 5, "amount_available": 3}),
+            '{not json',
+            json.dumps({"product_name": "bad cost", "seller": self.seller.pk, "cost": "x"}),
+            json.dumps({"product_name": "buyer", "seller": self.buyer.pk, "cost": 5}),
+        ])
+        err = StringIO()
+        call_command('import_products', self.path, stderr=err)
+        self.assertIn('4 lines: 1 created, 0 updated, 3 invalid', err.getvalue())
+        self.assertIn('Line 2 skipped', err.getvalue())
+        self.assertTrue(Product.objects.filter(product_name='new', amount_available=3).exists())
+        with self.assertRaisesMessage(CommandError, 'Line 2'):
+            call_command('import_products', self.path, '--strict', stderr=StringIO())
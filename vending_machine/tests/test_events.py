@@ -0,0 +1,142 @@
+import asyncio
+import json
+import threading
+
+from django.test import SimpleTestCase
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from vending_machine import events
+from vending_machine.events import Event, EventHub
+from vending_machine.models import Product
+from vending_machine.sse import SSE_PATH, product_events_app
+from vending_machine.utils import create_user, authenticate_user
+
+
+def parse_stream(body):
+    parsed = []
+    for block in body.decode().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n') if ': ' in line and line[0] != ':')
+        if 'event' in fields:
+            parsed.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+    return parsed
+
+
+class TestEventHub(SimpleTestCase):
+    """
+        In-process event hub tests
+    """
+
+    def test_publish_from_other_threads(self):
+        hub = EventHub(history_size=10, queue_size=10)
+
+        async def consume():
+            subscription, replay = hub.subscribe()
+            self.assertEqual(replay, [])
+            publisher = threading.Thread(target=lambda: [hub.publish(Event(i, 'test', {})) for i in (1, 2, 3)])
+            publisher.start()
+            received = []
+            while len(received) < 3:
+                received += await subscription.get(timeout=1)
+            publisher.join()
+            return [event.id for event in received]
+
+        self.assertEqual(asyncio.run(consume()), [1, 2, 3])
+
+    def test_slow_consumer_is_dropped(self):
+        hub = EventHub(history_size=10, queue_size=2)
+
+        async def consume():
+            subscription, _ = hub.subscribe()
+            for i in range(1, 5):
+                hub.publish(Event(i, 'test', {}))
+            await asyncio.sleep(0)
+            received = await subscription.get(timeout=1)
+            return [event.id for event in received], subscription.dropped, subscription in hub.subscribers
+
+        self.assertEqual(asyncio.run(consume()), ([1, 2], True, False))
+
+    def test_resume_from_last_event_id(self):
+        hub = EventHub(history_size=3, queue_size=10)
+        for i in (1, 3, 2, 4):
+            hub.publish(Event(i, 'test', {}))
+
+        async def subscribe(last_event_id):
+            return [(event.id, event.type) for event in hub.subscribe(last_event_id)[1]]
+
+        self.assertEqual(asyncio.run(subscribe(2)), [(3, 'test'), (4, 'test')])
+        self.assertEqual(asyncio.run(subscribe(4)), [])
+        # Event 1 is no longer in the history
+        self.assertEqual(asyncio.run(subscribe(0)), [(0, events.RESET)])
+
+
+class TestProductEventsApp(SimpleTestCase):
+    """
+        Server-sent events ASGI application tests
+    """
+
+    def test_stream_events(self):
+        hub = EventHub(history_size=10, queue_size=10)
+        hub.publish(Event(1, events.PRODUCT_CREATED, {"id": 7}))
+
+        async def run():
+            sent, disconnect = [], asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if len(sent) == 3:
+                    disconnect.set()
+
+            scope = {
+                'type': 'http', 'method': 'GET', 'path': SSE_PATH, 'query_string': b'last_event_id=0',
+                'headers': [],
+            }
+            app = asyncio.ensure_future(product_events_app(scope, receive, send, hub=hub))
+            await asyncio.sleep(0.01)
+            hub.publish(Event(2, events.PRODUCT_UPDATED, {"id": 7, "amount_available": 3}))
+            await asyncio.wait_for(app, 1)
+            return sent
+
+        sent = asyncio.run(run())
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertEqual(
+            parse_stream(b''.join(message['body'] for message in sent[1:])),
+            [(1, events.PRODUCT_CREATED, {"id": 7}), (2, events.PRODUCT_UPDATED, {"id": 7, "amount_available": 3})]
+        )
+
+
+class TestProductEventPublishing(APITestCase):
+    """
+        Product events published on commit
+    """
+
+    def setUp(self):
+        self.published = []
+        self._publish, events.product_events.publish = events.product_events.publish, self.published.append
+
+    def tearDown(self):
+        events.product_events.publish = self._publish
+
+    def test_buy_publishes_stock_change(self):
+        seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        create_user({"username": "user2", "password": "passwd2"}, role='buyer')
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(product_name="prod1", amount_available=10, cost=5, seller=seller)
+        _, _token = authenticate_user(username="user2", password="passwd2")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        self.client.get(reverse('deposit', args=[50]))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('buy'), data={"amount": 2, "product_id": product.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+
+        self.assertEqual(
+            [(event.type, event.data.get('amount_available')) for event in self.published],
+            [(events.PRODUCT_CREATED, 10), (events.PRODUCT_UPDATED, 8), (events.PRODUCT_DELETED, None)]
+        )
+        self.assertEqual(self.published, sorted(self.published))
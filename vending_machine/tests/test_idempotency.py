@@ -0,0 +1,124 @@
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from vending_machine import idempotency
+from vending_machine.idempotency import _digest, idempotent
+from vending_machine.models import IdempotencyKey, Machine
+
+
+class TestIdempotentDecorator(TransactionTestCase):
+    """
+        idempotent view decorator tests
+    """
+
+    def test_concurrent_duplicates_run_once(self):
+        calls = []
+
+        @idempotent
+        def view(request):
+            calls.append(request)
+            time.sleep(0.2)
+            return HttpResponse(b'done', status=201)
+
+        responses = []
+
+        def send():
+            try:
+                responses.append(view(RequestFactory().post('/buy', HTTP_IDEMPOTENCY_KEY='same-key')))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=send) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([(r.status_code, r.content) for r in responses], [(201, b'done')] * 4)
+
+    def test_server_errors_are_not_stored(self):
+        @idempotent
+        def view(request):
+            return HttpResponse(status=503)
+
+        view(RequestFactory().get('/buy', HTTP_IDEMPOTENCY_KEY='key'))
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0.1)
+    def test_placeholder_of_a_running_request_is_kept(self):
+        IdempotencyKey.objects.create(
+            key=self.digest('key'), owner='other:1/a', heartbeat_at=timezone.now(),
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        calls = []
+
+        @idempotent
+        def view(request):
+            calls.append(request)
+            return HttpResponse(status=201)
+
+        response = view(RequestFactory().get('/buy', HTTP_IDEMPOTENCY_KEY='key'))
+        self.assertEqual((response.status_code, calls), (409, []))
+
+    def test_placeholder_of_a_crashed_request_is_taken_over(self):
+        IdempotencyKey.objects.create(
+            key=self.digest('key'), owner='other:1/a', heartbeat_at=timezone.now() - timedelta(minutes=1),
+            expires_at=timezone.now() + timedelta(hours=1)
+        )
+
+        @idempotent
+        def view(request):
+            return HttpResponse(b'done', status=201)
+
+        response = view(RequestFactory().get('/buy', HTTP_IDEMPOTENCY_KEY='key'))
+        self.assertEqual((response.status_code, response.content), (201, b'done'))
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 201)
+
+    def test_response_is_stored_with_the_writes_of_the_view(self):
+        @idempotent
+        def view(request):
+            Machine.objects.create(name='machine')
+            # As if a retry took the key over
+            IdempotencyKey.objects.update(owner='other:1/a')
+            return HttpResponse(status=201)
+
+        response = view(RequestFactory().get('/buy', HTTP_IDEMPOTENCY_KEY='key'))
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Machine.objects.exists())
+        self.assertIsNone(IdempotencyKey.objects.get().status_code)
+
+    @override_settings(IDEMPOTENCY_HEARTBEAT_INTERVAL=0.05)
+    def test_heartbeats_while_running(self):
+        @idempotent
+        def view(request):
+            time.sleep(0.3)
+            return HttpResponse(status=201)
+
+        start = timezone.now()
+        # Start a thread with the interval of the test
+        with mock.patch.object(idempotency, '_heartbeat_thread', None):
+            view(RequestFactory().get('/buy', HTTP_IDEMPOTENCY_KEY='key'))
+        self.assertGreater(IdempotencyKey.objects.get().heartbeat_at, start + timedelta(seconds=0.05))
+
+    def test_purge_expired_keys(self):
+        now = timezone.now()
+        IdempotencyKey.objects.bulk_create([
+            IdempotencyKey(key=f'expired-{i}', status_code=200, expires_at=now - timedelta(seconds=1))
+            for i in range(5)
+        ] + [IdempotencyKey(key='fresh', status_code=200, expires_at=now + timedelta(hours=1))])
+        call_command('purge_idempotency_keys', batch_size=2, stdout=StringIO())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['fresh'])
+
+    @staticmethod
+    def digest(key):
+        return _digest(RequestFactory().get('/buy'), key)
@@ -1,5 +1,8 @@
+from django.db import IntegrityError, transaction
+from django.test import TransactionTestCase
 from rest_framework.test import APITestCase
-from vending_machine.models import User
+from vending_machine.models import User, Product, Sequence, VersionConflict
+from vending_machine.signals import PRODUCT_SEQUENCE
 
 
 class TestModel(APITestCase):
@@ -29,3 +32,51 @@ class TestModel(APITestCase):
 
     def test_raise_error_when_no_password(self):
         self.assertRaises(ValueError, User.objects.create_user, username='user1', password=None)
+
+
+class TestVersionedModel(APITestCase):
+    """
+        Optimistic concurrency control tests
+    """
+
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', 'testpass')
+        self.product = Product.objects.create(product_name='water', cost=10, amount_available=5, seller=self.seller)
+
+    def test_every_save_increments_version(self):
+        self.assertEqual(self.product.version, 1)
+        self.product.save()
+        self.product.amount_available = 4
+        self.product.save(update_fields=['amount_available'])
+        self.assertEqual(self.product.version, 3)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.version, 3)
+
+    def test_conditional_save(self):
+        first, second = Product.objects.get(pk=self.product.pk), Product.objects.get(pk=self.product.pk)
+        first.expected_version = first.version
+        first.cost = 15
+        first.save()
+
+        second.expected_version = second.version
+        second.amount_available = 0
+        with self.assertRaises(VersionConflict):
+            with transaction.atomic():
+                second.save()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.cost, self.product.amount_available, self.product.version), (15, 5, 2))
+        self.assertIsNone(second.expected_version)
+
+
+class TestProductChangeSequence(TransactionTestCase):
+    """
+        Change sequence stamping tests, outside of a test transaction
+    """
+
+    def test_failed_write_does_not_consume_a_value(self):
+        seller = User.objects.create_user('seller', 'passwd')
+        Product.objects.create(product_name='water', cost=5, amount_available=1, seller=seller)
+        before = Sequence.current_value(PRODUCT_SEQUENCE)
+        with self.assertRaises(IntegrityError):
+            Product.objects.create(product_name=None, cost=5, amount_available=1, seller=seller)
+        self.assertEqual(Sequence.current_value(PRODUCT_SEQUENCE), before)
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from vending_machine.profiling import PROFILE_FILE_HEADER, PROFILE_FILE_PATTERN, SamplingProfiler, rotate
+from vending_machine.utils import create_user, authenticate_user
+
+
+class TestProfilingMiddleware(APITestCase):
+    """
+        Request profiling and profile summary tests
+    """
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        self.settings = override_settings(PROFILING_DIR=self.profile_dir, PROFILING_SECRET='s3cret')
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        create_user({"username": "user1", "password": "passwd1"}, role='buyer')
+        _, _token = authenticate_user(username="user1", password="passwd1")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+
+    def profiles(self):
+        return sorted(os.listdir(self.profile_dir))
+
+    def test_not_profiled_by_default(self):
+        self.client.get(reverse('reset'))
+        self.client.get(reverse('reset'), HTTP_X_PROFILE='wrong')
+        self.assertEqual(self.profiles(), [])
+
+    def test_profile_header(self):
+        response = self.client.get(reverse('reset'), HTTP_X_PROFILE='s3cret')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.profiles(), [response[PROFILE_FILE_HEADER]])
+        match = PROFILE_FILE_PATTERN.match(response[PROFILE_FILE_HEADER])
+        self.assertEqual((match['name'], match['kind']), ('reset', 'prof'))
+
+    @override_settings(PROFILING_SECRET=None, PROFILING_SAMPLE_RATE=1)
+    def test_sample_rate(self):
+        response = self.client.get(reverse('reset'))
+        self.assertNotIn(PROFILE_FILE_HEADER, response)
+        self.assertEqual(len(self.profiles()), 1)
+
+    @override_settings(PROFILING_MODE='sampling', PROFILING_SAMPLING_INTERVAL=0.0001)
+    def test_sampling_mode(self):
+        response = self.client.get(reverse('product-list'), HTTP_X_PROFILE='s3cret')
+        self.assertTrue(response[PROFILE_FILE_HEADER].endswith('.collapsed'))
+
+    def test_sampling_profiler(self):
+        profiler = SamplingProfiler(0.001)
+        profiler.enable()
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+        profiler.disable()
+        path = os.path.join(self.profile_dir, 'stacks.collapsed')
+        profiler.dump_stats(path)
+        with open(path) as profile:
+            stacks = profile.read()
+        self.assertIn('vending_machine.tests.test_profiling:test_sampling_profiler', stacks)
+
+    def test_rotation(self):
+        for i in range(5):
+            open(os.path.join(self.profile_dir, f'{1000 + i}-reset-1ms.prof'), 'w').close()
+        rotate(self.profile_dir, 2)
+        self.assertEqual(self.profiles(), ['1003-reset-1ms.prof', '1004-reset-1ms.prof'])
+
+    def test_profile_summary(self):
+        for _ in range(2):
+            self.client.get(reverse('reset'), HTTP_X_PROFILE='s3cret')
+        with override_settings(PROFILING_MODE='sampling', PROFILING_SAMPLING_INTERVAL=0.0001):
+            self.client.get(reverse('product-list'), HTTP_X_PROFILE='s3cret')
+        out = StringIO()
+        call_command('profile_summary', '--top', '5', '--sort', 'cumulative', stdout=out)
+        output = out.getvalue()
+        self.assertIn('reset: 2 profiled', output)
+        self.assertIn('product-list: 1 profiled', output)
+        self.assertIn('Top functions of 2 cProfile profiles', output)
+        self.assertIn('Top functions of 1 sampled profiles', output)
+
+        out = StringIO()
+        call_command('profile_summary', '--name', 'reset', stdout=out)
+        self.assertNotIn('product-list', out.getvalue())
@@ -0,0 +1,56 @@
+from unittest import mock
+
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from vending_machine import views
+from vending_machine.management.commands.query_budget_report import report_rows
+from vending_machine.query_budget import QueryBudget, QueryBudgetExceeded, ViewCost, get_budget
+from vending_machine.utils import create_user, authenticate_user
+
+
+class TestQueryBudget(APITestCase):
+    """
+        Per-view query budget tests
+    """
+
+    def setUp(self):
+        create_user({"username": "user1", "password": "passwd1"}, role='buyer')
+        _, _token = authenticate_user(username="user1", password="passwd1")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+
+    def test_budget_survives_decorators(self):
+        self.assertEqual(get_budget(views.buy).queries, 17)
+        self.assertEqual(get_budget(views.deposit).queries, 9)
+
+    @override_settings(QUERY_BUDGET_TIME_MS=5)
+    def test_default_time_budget(self):
+        self.assertEqual(QueryBudget(queries=1).time_limit_ms, 5)
+        self.assertEqual(QueryBudget(queries=1, time_ms=50).time_limit_ms, 50)
+        self.assertEqual(QueryBudget(queries=1).violations(1, 6.0), ['6.0ms of SQL > 5ms'])
+
+    def test_within_budget(self):
+        response = self.client.get(reverse('reset'))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_over_budget_raises(self):
+        with mock.patch.object(views.reset, 'query_budget', QueryBudget(queries=1)):
+            with self.assertRaisesMessage(QueryBudgetExceeded, 'reset'):
+                self.client.get(reverse('reset'))
+
+    @override_settings(QUERY_BUDGET_RAISE=False)
+    def test_over_budget_logged(self):
+        with mock.patch.object(views.reset, 'query_budget', QueryBudget(queries=1)):
+            with self.assertLogs('vending_machine.query_budget', 'WARNING') as logs:
+                response = self.client.get(reverse('reset'))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertIn('2 queries > 1', logs.output[0])
+
+    def test_report_rows(self):
+        cost = ViewCost()
+        cost.add(20, 1.5, True)
+        rows = {row[1]: row for row in report_rows({'buy': cost})}
+        self.assertEqual(rows['buy'][2:], (17, 20, 100, 1.5, 1, 'OVER'))
+        self.assertEqual(rows['deposit'][-1], 'NOT COVERED')
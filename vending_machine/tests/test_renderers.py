@@ -0,0 +1,55 @@
+import io
+import json
+
+from django.test import SimpleTestCase, override_settings
+from rest_framework.exceptions import ParseError
+
+from vending_machine.parsers import FastJSONParser
+from vending_machine.renderers import FastJSONRenderer
+
+
+class TestFastJSONRenderer(SimpleTestCase):
+    """
+        Fast JSON renderer tests
+    """
+
+    data = [
+        {"id": 1, "product_name": "Café  ", "seller": 2, "cost": 5, "amount_available": None},
+        {"id": 2, "product_name": "Soda", "seller": 2, "cost": 10, "amount_available": 3},
+    ]
+
+    def test_render_matches_stdlib_output(self):
+        rendered = FastJSONRenderer().render(self.data)
+        self.assertEqual(json.loads(rendered), self.data)
+        self.assertIn(b'\\u2028', rendered)
+
+    @override_settings(JSON_BACKEND='json')
+    def test_render_with_stdlib_backend(self):
+        rendered = FastJSONRenderer().render(self.data)
+        self.assertEqual(json.loads(rendered), self.data)
+
+    def test_render_none(self):
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_render_indented(self):
+        rendered = FastJSONRenderer().render(self.data, 'application/json; indent=4')
+        self.assertIn(b'\n    ', rendered)
+
+
+class TestFastJSONParser(SimpleTestCase):
+    """
+        Fast JSON parser tests
+    """
+
+    def test_parse(self):
+        stream = io.BytesIO(b'{"username": "Bob", "password": "secret"}')
+        self.assertEqual(FastJSONParser().parse(stream), {"username": "Bob", "password": "secret"})
+
+    @override_settings(JSON_BACKEND='json')
+    def test_parse_with_stdlib_backend(self):
+        stream = io.BytesIO(b'{"username": "Bob"}')
+        self.assertEqual(FastJSONParser().parse(stream), {"username": "Bob"})
+
+    def test_parse_invalid_json(self):
+        self.assertRaises(ParseError, FastJSONParser().parse, io.BytesIO(b'{"username": '))
+        self.assertRaises(ParseError, FastJSONParser().parse, io.BytesIO(b'{"cost": NaN}'))
@@ -0,0 +1,107 @@
+import gzip
+import json
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from vending_machine.models import Product, User
+from vending_machine.response_cache import choose_encoding, get_response_cache
+from vending_machine.utils import create_user, bulk_create_products
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'throttle': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'throttle'},
+    'lists': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-lists'},
+})
+class TestResponseCache(APITestCase):
+    """
+        Precompressed list response cache tests
+    """
+
+    def setUp(self):
+        get_response_cache().clear()
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        bulk_create_products(self.seller, [
+            {"product_name": f"product {i}", "cost": 5 * (i + 1), "amount_available": i} for i in range(20)
+        ])
+        self.url = reverse('product-list')
+
+    def test_choose_encoding(self):
+        available = {'identity': b'', 'gzip': b''}
+        self.assertEqual(choose_encoding('gzip, deflate, br', available), 'gzip')
+        self.assertEqual(choose_encoding('br;q=1.0, gzip;q=0.5', available), 'gzip')
+        self.assertEqual(choose_encoding('gzip;q=0', available), 'identity')
+        self.assertEqual(choose_encoding('*', available), 'gzip')
+        self.assertEqual(choose_encoding('', available), 'identity')
+        self.assertEqual(choose_encoding(None, available), 'identity')
+
+    def test_gzip_variant(self):
+        plain = self.client.get(self.url)
+        self.assertEqual(plain.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertEqual(len(plain.json()), 20)
+
+        compressed = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertLess(len(compressed.content), len(plain.content))
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+
+    def test_hits_skip_the_list_query(self):
+        self.client.get(self.url, {"in_stock": "true"})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {"in_stock": "true"})
+        self.assertEqual(len(response.json()), 19)
+        self.assertEqual(len(queries), 1)
+        # Other query strings are cached separately
+        self.assertEqual(len(self.client.get(self.url).json()), 20)
+
+    def test_product_writes_invalidate(self):
+        self.client.get(self.url)
+        Product.objects.create(product_name='new', cost=5, amount_available=1, seller=self.seller)
+        self.assertEqual(len(self.client.get(self.url).json()), 21)
+        Product.objects.filter(product_name='new').delete()
+        self.assertEqual(len(self.client.get(self.url).json()), 20)
+
+    def test_sales_only_invalidate_when_stock_runs_out(self):
+        self.assertEqual(self.client.get(self.url).json()[1]['amount_available'], 1)
+        product = Product.objects.get(product_name='product 2')
+        product.amount_available -= 1
+        product.save()
+        # Stock counts of cached lists lag sales
+        self.assertEqual(self.client.get(self.url).json()[2]['amount_available'], 2)
+        product = Product.objects.get(product_name='product 1')
+        product.amount_available -= 1
+        product.save()
+        self.assertEqual(self.client.get(self.url).json()[1]['amount_available'], 0)
+        self.assertEqual(len(self.client.get(self.url, {"in_stock": "true"}).json()), 18)
+
+    def test_catalog_edits_invalidate(self):
+        self.client.get(self.url)
+        product = Product.objects.get(product_name='product 0')
+        product.cost = 1000
+        product.save()
+        self.assertEqual(self.client.get(self.url).json()[0]['cost'], 1000)
+
+    def test_user_list_is_not_cached(self):
+        url = reverse('users-list')
+        self.assertEqual(self.client.get(url).json()[0]['deposit'], 0)
+        User.objects.filter(pk=self.seller.pk).update(deposit=10)
+        self.assertEqual(self.client.get(url).json()[0]['deposit'], 10)
+
+    def test_soft_delete_invalidates_products(self):
+        self.assertEqual(len(self.client.get(self.url).json()), 20)
+        self.seller.soft_delete()
+        self.assertEqual(self.client.get(self.url).json(), [])
+
+    def test_errors_and_browsers_are_not_cached(self):
+        response = self.client.get(self.url, {"ordering": "nope"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, HTTP_ACCEPT='text/html')
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        self.assertEqual(json.loads(self.client.get(self.url).content)[0]['product_name'], 'product 0')
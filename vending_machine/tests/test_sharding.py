@@ -0,0 +1,166 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db.models import F
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from vending_machine.models import Order, Product, User
+from vending_machine.sharding import shard_for_user, user_id_of_token
+from vending_machine.utils import create_user, authenticate_user
+
+SHARDS = ['users_0', 'users_1']
+
+
+@override_settings(USER_SHARDS=SHARDS)
+class TestUserSharding(APITestCase):
+    """
+        User sharding tests, over two SQLite databases
+    """
+    databases = {'default', 'users_0', 'users_1'}
+
+    def setUp(self):
+        self.users = [
+            create_user({"username": f"user{i}", "password": f"passwd{i}"}, role='buyer') for i in range(6)
+        ]
+
+    def test_shard_for_user_is_stable(self):
+        shards = [shard_for_user(i, SHARDS) for i in range(100)]
+        self.assertEqual(shards, [shard_for_user(i, SHARDS) for i in range(100)])
+        self.assertEqual({shard_for_user(i, SHARDS) for i in range(100)}, set(SHARDS))
+        self.assertEqual(shard_for_user(5, []), 'default')
+
+    def test_users_are_placed_on_their_shard(self):
+        self.assertEqual(len({user.pk for user in self.users}), 6)
+        for user in self.users:
+            self.assertEqual(user._state.db, shard_for_user(user.pk))
+            self.assertTrue(User.objects.using(shard_for_user(user.pk)).filter(pk=user.pk).exists())
+        self.assertFalse(User.objects.using('default').exists())
+        self.assertEqual(sum(User.objects.using(alias).count() for alias in SHARDS), 6)
+
+    def test_token_authentication(self):
+        user, _token = authenticate_user(username="user3", password="passwd3")
+        self.assertEqual(user.pk, self.users[3].pk)
+        self.assertTrue(Token.objects.using(shard_for_user(user.pk)).filter(key=_token.key).exists())
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        response = self.client.get(reverse('deposit', kwargs={"amount": 10}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(User.objects.using(shard_for_user(user.pk)).get(pk=user.pk).deposit, 10)
+
+    def test_signed_token_authentication(self):
+        _, _token = authenticate_user(username="user4", password="passwd4", signed=True)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {_token}')
+        response = self.client.get(reverse('deposit', kwargs={"amount": 20}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(User.objects.using(shard_for_user(self.users[4].pk)).get(pk=self.users[4].pk).deposit, 20)
+
+    def test_user_detail_and_create(self):
+        response = self.client.get(reverse('user-detail', kwargs={"pk": self.users[2].pk}))
+        self.assertEqual(response.data['username'], 'user2')
+        response = self.client.post(reverse('user-create'), {"username": "user2", "password": "passwd2"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('user-create'), {"username": "user6", "password": "passwd6"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(User.objects.using(shard_for_user(response.data['id'])).filter(username='user6').exists())
+
+    def test_user_list_merges_shards(self):
+        response = self.client.get(reverse('users-list'), {"fields": "id,username"})
+        self.assertEqual([user['id'] for user in response.json()], sorted(user.pk for user in self.users))
+        response = self.client.get(reverse('users-list'), {"limit": 2, "after": self.users[1].pk})
+        self.assertEqual([user['username'] for user in response.json()], ['user2', 'user3'])
+
+    def test_reshard(self):
+        out = StringIO()
+        call_command('reshard_users', 'users_1', stdout=out)
+        self.assertEqual(User.objects.using('users_0').count(), 0)
+        self.assertEqual(User.objects.using('users_1').count(), 6)
+        with self.settings(USER_SHARDS=['users_1']):
+            self.assertEqual(authenticate_user(username="user0", password="passwd0")[0].pk, self.users[0].pk)
+        call_command('reshard_users', *SHARDS, '--from', 'users_1', stdout=out)
+        for user in self.users:
+            self.assertTrue(User.objects.using(shard_for_user(user.pk)).filter(pk=user.pk).exists())
+
+    def test_tokens_are_looked_up_on_one_shard(self):
+        for i, user in enumerate(self.users):
+            _, _token = authenticate_user(username=f"user{i}", password=f"passwd{i}")
+            self.assertEqual(user_id_of_token(_token.key), user.pk)
+            self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+            # Within the query budgets of the views
+            self.assertEqual(self.client.get(reverse('product-affordable')).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get(reverse('order-list')).status_code, status.HTTP_200_OK)
+
+    def test_seller_product_writes(self):
+        seller = create_user({"username": "seller", "password": "passwd"}, role='seller')
+        _, _token = authenticate_user(username="seller", password="passwd")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        product = Product.objects.create(product_name='water', cost=10, amount_available=5, seller=seller)
+        url = reverse('product-detail', args=[product.pk])
+        response = self.client.put(url, {"product_name": "water", "cost": 15, "amount_available": 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_200_OK)
+        self.assertFalse(Product.all_objects.filter(pk=product.pk).exists())
+
+    def test_soft_deleted_seller_products_are_hidden(self):
+        seller = create_user({"username": "seller", "password": "passwd"}, role='seller')
+        Product.objects.create(product_name='water', cost=10, amount_available=5, seller=seller)
+        seller.soft_delete()
+        self.assertEqual(self.client.get(reverse('product-list')).json(), [])
+        self.assertEqual(Product.all_objects.count(), 1)
+
+    def test_soft_delete_rolls_back_the_shard(self):
+        seller = create_user({"username": "seller", "password": "passwd"}, role='seller')
+        Product.objects.create(product_name='water', cost=10, amount_available=5, seller=seller)
+        with mock.patch('vending_machine.tasks.enqueue', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                seller.soft_delete()
+        self.assertIsNone(User.all_objects.using(shard_for_user(seller.pk)).get(pk=seller.pk).deleted_at)
+        self.assertTrue(Product.objects.exists())
+
+    def test_login(self):
+        for i, user in enumerate(self.users):
+            response = self.client.post(reverse('login'), {"username": f"user{i}", "password": f"passwd{i}"})
+            self.assertEqual(response.data['user'], user.pk)
+
+    def buy_with_concurrent_update(self, product_changes=None, buyer_changes=None):
+        """
+        Buys one product as a buyer with a deposit of 50, updating the product or the buyer's row
+        on its shard once the request has loaded them, as a concurrent request would
+        """
+        seller = create_user({"username": "seller", "password": "passwd"}, role='seller')
+        product = Product.objects.create(product_name='water', cost=10, amount_available=5, seller=seller)
+        buyer = self.users[0]
+        User.objects.using(shard_for_user(buyer.pk)).filter(pk=buyer.pk).update(deposit=50)
+        _, _token = authenticate_user(username="user0", password="passwd0")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+
+        original_get = Product.objects.get
+
+        def get(*args, **kwargs):
+            _product = original_get(*args, **kwargs)
+            if product_changes:
+                Product.objects.filter(pk=product.pk).update(version=F('version') + 1, **product_changes)
+            if buyer_changes:
+                User.objects.using(shard_for_user(buyer.pk)).filter(pk=buyer.pk).update(
+                    version=F('version') + 1, **buyer_changes
+                )
+            return _product
+
+        with mock.patch.object(Product.objects, 'get', get):
+            response = self.client.get(reverse('buy'), {"product_id": product.pk, "amount": 1})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        product.refresh_from_db()
+        buyer = User.objects.using(shard_for_user(buyer.pk)).get(pk=buyer.pk)
+        self.assertFalse(Order.objects.exists())
+        return product, buyer
+
+    def test_buy_conflict_on_the_product_keeps_the_deposit(self):
+        product, buyer = self.buy_with_concurrent_update(product_changes={"cost": 5})
+        self.assertEqual((product.cost, product.amount_available, buyer.deposit), (5, 5, 50))
+
+    def test_buy_conflict_on_the_deposit_keeps_the_stock(self):
+        product, buyer = self.buy_with_concurrent_update(buyer_changes={"deposit": F('deposit') + 20})
+        self.assertEqual((product.amount_available, buyer.deposit), (5, 70))
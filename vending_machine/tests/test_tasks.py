@@ -0,0 +1,103 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from vending_machine.models import PendingTask, Product, StockAlert, User
+from vending_machine.tasks import run_pending, task, task_queue
+from vending_machine.utils import create_user, authenticate_user
+
+
+@task()
+def failing_task(**payload):
+    raise RuntimeError('failed')
+
+
+class TestBackgroundTasks(APITestCase):
+    """
+        Background task runner tests
+    """
+
+    def setUp(self):
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        self.buyer = create_user({"username": "user2", "password": "passwd2"}, role='buyer')
+        self.product = Product.objects.create(product_name='p', cost=5, amount_available=7, seller=self.seller)
+        _, _token = authenticate_user(username="user2", password="passwd2")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+
+    def buy(self, amount):
+        User.objects.filter(pk=self.buyer.pk).update(deposit=100)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.get(reverse('buy'), {"product_id": self.product.pk, "amount": amount})
+
+    def test_low_stock_alert_after_commit(self):
+        response = self.buy(1)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(StockAlert.objects.exists())
+        response = self.buy(1)
+        alert = StockAlert.objects.get()
+        self.assertEqual(
+            (alert.seller_id, alert.product_id, alert.amount_available), (self.seller.pk, self.product.pk, 5)
+        )
+        self.assertFalse(PendingTask.objects.exists())
+        # Only the sale crossing the threshold alerts
+        self.buy(1)
+        self.assertEqual(StockAlert.objects.count(), 1)
+
+    def test_batch_is_one_insert(self):
+        pending = [
+            PendingTask.objects.create(
+                name='low_stock_alert',
+                payload={"seller_id": self.seller.pk, "product_id": self.product.pk, "amount_available": i}
+            )
+            for i in range(3)
+        ]
+        # select products, bulk insert, delete tasks, and the savepoint around the task
+        with self.assertNumQueries(5):
+            self.assertEqual(run_pending(pending), 3)
+        self.assertEqual(StockAlert.objects.count(), 3)
+        self.assertFalse(PendingTask.objects.exists())
+
+    def test_failed_task_is_kept(self):
+        pending = PendingTask.objects.create(name='failing_task')
+        with self.assertLogs('vending_machine.tasks', 'ERROR'):
+            self.assertEqual(run_pending([pending]), 0)
+        self.assertEqual(PendingTask.objects.get().attempts, 1)
+
+    def test_drain_tasks(self):
+        PendingTask.objects.create(
+            name='low_stock_alert', created_at=timezone.now() - timedelta(minutes=5),
+            payload={"seller_id": self.seller.pk, "product_id": self.product.pk, "amount_available": 1}
+        )
+        PendingTask.objects.create(
+            name='low_stock_alert',
+            payload={"seller_id": self.seller.pk, "product_id": self.product.pk, "amount_available": 2}
+        )
+        out = StringIO()
+        call_command('drain_tasks', stdout=out)
+        self.assertIn('Ran 1 of 1 pending tasks', out.getvalue())
+        self.assertEqual(PendingTask.objects.count(), 1)
+
+
+@override_settings(TASKS_EAGER=False, TASKS_WORKERS=1)
+class TestTaskQueue(TransactionTestCase):
+    """
+        Worker thread pool tests
+    """
+
+    def test_workers_run_committed_tasks(self):
+        seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        product = Product.objects.create(product_name='p', cost=5, amount_available=7, seller=seller)
+        for i in range(10):
+            task_queue.submit(PendingTask.objects.create(
+                name='low_stock_alert',
+                payload={"seller_id": seller.pk, "product_id": product.pk, "amount_available": i}
+            ))
+        task_queue.join()
+        self.assertEqual(StockAlert.objects.count(), 10)
+        self.assertFalse(PendingTask.objects.exists())
@@ -0,0 +1,98 @@
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from vending_machine.throttling import UserTokenBucketThrottle
+from vending_machine.utils import create_user, authenticate_user
+
+THROTTLE_SETTINGS = {
+    'DEFAULT_THROTTLE_RATES': {'deposit': '2/min', 'reset_ip': '3/min'},
+}
+
+
+class FakeView:
+    throttle_scope = 'deposit'
+
+
+class FakeRequest:
+    def __init__(self, user):
+        self.user = user
+        self.META = {'REMOTE_ADDR': '127.0.0.1'}
+
+
+@override_settings(REST_FRAMEWORK=THROTTLE_SETTINGS)
+class TestTokenBucketThrottle(APITestCase):
+    """
+        Token bucket throttling tests
+    """
+
+    def setUp(self):
+        caches['throttle'].clear()
+        self.buyer = create_user({"username": "user1", "password": "passwd1"}, role='buyer')
+        _, _token = authenticate_user(username="user1", password="passwd1")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+
+    def tearDown(self):
+        caches['throttle'].clear()
+
+    def test_per_user_limit(self):
+        url = reverse('deposit', args=[5])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(int(response['Retry-After']), 30)
+        # Other views have their own buckets
+        self.assertEqual(self.client.get(reverse('buy')).status_code, status.HTTP_400_BAD_REQUEST)
+        # And so do other users
+        create_user({"username": "user2", "password": "passwd2"}, role='buyer')
+        _, _token = authenticate_user(username="user2", password="passwd2")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+    def test_per_ip_limit(self):
+        url = reverse('reset')
+        for _ in range(3):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # The address is throttled whatever the credentials
+        create_user({"username": "user2", "password": "passwd2"}, role='buyer')
+        _, _token = authenticate_user(username="user2", password="passwd2")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_bucket_refills_over_time(self):
+        now = [1000.0]
+        throttle = UserTokenBucketThrottle()
+        throttle.timer = lambda: now[0]
+        request, view = FakeRequest(self.buyer), FakeView()
+
+        self.assertEqual([throttle.allow_request(request, view) for _ in range(3)], [True, True, False])
+        now[0] += 29
+        self.assertFalse(throttle.allow_request(request, view))
+        self.assertAlmostEqual(throttle.wait(), 1)
+        now[0] += 1
+        self.assertTrue(throttle.allow_request(request, view))
+        self.assertFalse(throttle.allow_request(request, view))
+        # A full period idle refills the whole burst
+        now[0] += 600
+        self.assertEqual([throttle.allow_request(request, view) for _ in range(3)], [True, True, False])
+
+    def test_busy_bucket_does_not_expire(self):
+        now = [1000.0]
+        throttle = UserTokenBucketThrottle()
+        throttle.timer = lambda: now[0]
+        request, view = FakeRequest(self.buyer), FakeView()
+
+        with mock.patch('django.core.cache.backends.locmem.time.time', lambda: now[0]):
+            self.assertEqual([throttle.allow_request(request, view) for _ in range(2)], [True, True])
+            for _ in range(2):
+                now[0] += 30
+                self.assertTrue(throttle.allow_request(request, view))
+            # Past a whole period after the first write, the bucket is still full
+            now[0] += 2
+            self.assertFalse(throttle.allow_request(request, view))
@@ -1,10 +1,23 @@
 import json
+import threading
+from datetime import timedelta
+from unittest import mock
+
 from rest_framework.test import APITestCase
+from django.db import connection
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 
-from vending_machine.models import User, Product
+from vending_machine import batch
+from vending_machine.models import (
+    User, Product, Order, ProductTombstone, Machine, MachineStock, MachineBalance
+)
 from vending_machine.permissions import *
+from vending_machine.serializer import ProductSerializer
 from vending_machine.utils import (
         create_user, bulk_create_users, authenticate_user, bulk_create_products
     )
@@ -29,7 +42,7 @@ class TestUserCreateAPIView(APITestCase):
             content_type='application/json'
         )
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        sample_user.update({"role": "buyer", "deposit": 0})
+        sample_user.update({"role": "buyer", "deposit": 0, "version": 1})
         sample_user.pop('password')
         response.data.pop('id')
         self.assertDictEqual(response.data, sample_user)
@@ -74,7 +87,9 @@ class TestUserDetailAPIView(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         data = self.credentials.copy()
         data.pop('password')
-        data.update({"deposit": self.user.deposit, "id": self.user.id, "role": self.user.role})
+        data.update({
+            "deposit": self.user.deposit, "id": self.user.id, "role": self.user.role, "version": self.user.version
+        })
         self.assertDictEqual(response.data, data)
 
     def test_user_not_found(self):
@@ -124,6 +139,7 @@ class TestUserDetailAPIView(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         response.data.pop('id')
         _update_data.pop('password')
+        _update_data['version'] = self.user.version + 1
         self.assertDictEqual(
             response.data,
             _update_data
@@ -280,7 +296,7 @@ class TestProductDetailAPIView(APITestCase):
             response.data,
             {
                 "product_name": "prod1", "cost": 10, "seller": self.user.pk,
-                "amount_available": 5, "id": self.product.id
+                "amount_available": 5, "id": self.product.id, "version": 1
             }
         )
 
@@ -336,7 +352,7 @@ class TestProductDetailAPIView(APITestCase):
             response.data,
             {
                 "product_name": "prod11", "cost": 20, "amount_available": 10,
-                "seller": _user.id, "id": self.product.id
+                "seller": _user.id, "id": self.product.id, "version": 2
             }
         )
 
@@ -568,3 +584,906 @@ class TestProductResetDepositAPIView(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(User.objects.get(pk=self.buyer.pk).deposit, 0)
 
+
+
+class TestProductSearchAPIView(APITestCase):
+    """
+        /products/search API endpoint tests
+    """
+
+    def setUp(self):
+        self.url = reverse('product-search')
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        self.products_list = bulk_create_products(self.seller, [
+            {"product_name": "Coca Cola", "cost": 10, "amount_available": 10},
+            {"product_name": "Coca Cola Zero", "cost": 10, "amount_available": 10},
+            {"product_name": "Orange juice", "cost": 20, "amount_available": 5},
+            {"product_name": "Chocolate bar", "cost": 5, "amount_available": 3},
+        ])
+
+    def test_search_missing_query(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['q'][0].code, 'required')
+
+    def test_search_by_token_and_prefix(self):
+        response = self.client.get(self.url, data={"q": "coc"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [product['product_name'] for product in response.data['results']],
+            ["Coca Cola", "Coca Cola Zero"]
+        )
+        response = self.client.get(self.url, data={"q": "cola zer"})
+        self.assertEqual(
+            [product['product_name'] for product in response.data['results']],
+            ["Coca Cola Zero"]
+        )
+        response = self.client.get(self.url, data={"q": "juice"})
+        self.assertEqual(response.data['results'][0]['product_name'], "Orange juice")
+
+    def test_search_pagination(self):
+        response = self.client.get(self.url, data={"q": "c", "limit": 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['next_offset'], 2)
+        response = self.client.get(self.url, data={"q": "c", "limit": 2, "offset": 2})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next_offset'])
+
+    def test_search_index_follows_updates_and_deletes(self):
+        product = Product.objects.get(pk=self.products_list[2]['id'])
+        product.product_name = "Apple juice"
+        product.save()
+        Product.objects.filter(pk=self.products_list[3]['id']).delete()
+        response = self.client.get(self.url, data={"q": "orange"})
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get(self.url, data={"q": "apple"})
+        self.assertEqual(response.data['results'][0]['id'], product.id)
+        response = self.client.get(self.url, data={"q": "chocolate"})
+        self.assertEqual(response.data['results'], [])
+
+
+class TestProductListFilterAPIView(APITestCase):
+    """
+        Product list filtering and ordering tests
+    """
+
+    def setUp(self):
+        self.url = reverse('product-list')
+        self.seller1 = create_user({"username": "user1", "password": "passwd1"}, role="seller")
+        self.seller2 = create_user({"username": "user2", "password": "passwd2"}, role="seller")
+        bulk_create_products(self.seller1, [
+            {"product_name": "prod1", "cost": 50, "amount_available": 10},
+            {"product_name": "prod2", "cost": 5, "amount_available": 0},
+            {"product_name": "prod3", "cost": 20, "amount_available": 1},
+        ])
+        bulk_create_products(self.seller2, [
+            {"product_name": "prod4", "cost": 10, "amount_available": 3},
+            {"product_name": "prod5", "cost": 100, "amount_available": 0},
+        ])
+
+    def _names(self, response):
+        return [product['product_name'] for product in response.json()]
+
+    def test_filter_by_seller(self):
+        response = self.client.get(self.url, data={"seller": self.seller2.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._names(response), ["prod4", "prod5"])
+
+    def test_filter_in_stock(self):
+        response = self.client.get(self.url, data={"in_stock": "true"})
+        self.assertEqual(self._names(response), ["prod1", "prod3", "prod4"])
+        response = self.client.get(self.url, data={"in_stock": "false"})
+        self.assertEqual(self._names(response), ["prod2", "prod5"])
+
+    def test_in_stock_uses_partial_index(self):
+        for in_stock, index in (("true", 'product_in_stock_id_idx'), ("false", 'product_sold_out_id_idx')):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(self.url, data={"in_stock": in_stock})
+            plan = ' '.join(str(row) for row in connection.cursor().execute(
+                f"EXPLAIN QUERY PLAN {queries[-1]['sql']}"
+            ).fetchall())
+            self.assertIn(index, plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_filter_cost_range_sorted_by_cost(self):
+        response = self.client.get(self.url, data={"min_cost": 10, "max_cost": 50})
+        self.assertEqual(self._names(response), ["prod4", "prod3", "prod1"])
+        response = self.client.get(
+            self.url, data={"min_cost": 10, "seller": self.seller1.pk, "ordering": "-cost"}
+        )
+        self.assertEqual(self._names(response), ["prod1", "prod3"])
+
+    def test_invalid_parameters(self):
+        response = self.client.get(self.url, data={"min_cost": 50, "max_cost": 10})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, data={"min_cost": 10, "ordering": "id"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ordering', response.data)
+        response = self.client.get(self.url, data={"ordering": "product_name"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, data={"seller": "abc"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestSellerStatsAPIView(APITestCase):
+    """
+        /seller/stats API endpoint tests
+    """
+
+    def setUp(self):
+        self.url = reverse('seller-stats')
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        self.buyer = create_user({"username": "user2", "password": "passwd2"}, role='buyer')
+        self.water = Product.objects.create(
+            product_name="water", amount_available=10, cost=5, seller=self.seller
+        )
+        self.soda = Product.objects.create(
+            product_name="soda", amount_available=10, cost=20, seller=self.seller
+        )
+
+    def _buy(self, product, amount):
+        _, _token = authenticate_user(username="user2", password="passwd2")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        self.client.get(reverse('deposit', args=[100]))
+        response = self.client.get(reverse('buy'), data={"amount": amount, "product_id": product.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_stats_buyer_role(self):
+        _, _token = authenticate_user(username="user2", password="passwd2")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_buy_records_order_and_updates_stats(self):
+        self._buy(self.water, 2)
+        self._buy(self.soda, 1)
+        self._buy(self.water, 3)
+        order = Order.objects.filter(product=self.soda).get()
+        self.assertEqual(
+            (order.buyer_id, order.seller_id, order.quantity, order.unit_cost),
+            (self.buyer.id, self.seller.id, 1, 20)
+        )
+        _, _token = authenticate_user(username="user1", password="passwd1")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['revenue'], 5 * 5 + 20)
+        self.assertEqual(response.data['units_sold'], 6)
+        self.assertEqual(
+            [dict(product) for product in response.data['top_products']],
+            [
+                {"product": self.water.id, "product_name": "water", "units_sold": 5, "revenue": 25},
+                {"product": self.soda.id, "product_name": "soda", "units_sold": 1, "revenue": 20},
+            ]
+        )
+
+
+class TestOrderListAPIView(APITestCase):
+    """
+        /orders API endpoint tests
+    """
+
+    def setUp(self):
+        self.url = reverse('order-list')
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        self.buyer = create_user({"username": "user2", "password": "passwd2"}, role='buyer')
+        self.other_buyer = create_user({"username": "user3", "password": "passwd3"}, role='buyer')
+        self.product = Product.objects.create(
+            product_name="water", amount_available=100, cost=5, seller=self.seller
+        )
+        self.start = timezone.now() - timedelta(days=10)
+        self.orders = [
+            Order.objects.create(
+                buyer=self.buyer, seller=self.seller, product=self.product, quantity=i + 1,
+                unit_cost=5, created_at=self.start + timedelta(days=i)
+            )
+            for i in range(5)
+        ]
+        Order.objects.create(
+            buyer=self.other_buyer, seller=self.seller, product=self.product, quantity=1,
+            unit_cost=5, created_at=self.start
+        )
+        _, _token = authenticate_user(username="user2", password="passwd2")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+
+    def test_orders_keyset_pagination(self):
+        response = self.client.get(self.url, data={"limit": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [order['id'] for order in response.data['results']]
+        while response.data['next_cursor']:
+            response = self.client.get(self.url, data={"limit": 2, "cursor": response.data['next_cursor']})
+            ids += [order['id'] for order in response.data['results']]
+        self.assertEqual(ids, [order.id for order in reversed(self.orders)])
+
+    def test_orders_time_range(self):
+        response = self.client.get(self.url, data={
+            "since": (self.start + timedelta(days=1)).isoformat(),
+            "until": (self.start + timedelta(days=3)).isoformat(),
+        })
+        self.assertEqual(
+            [order['id'] for order in response.data['results']],
+            [self.orders[2].id, self.orders[1].id]
+        )
+        self.assertIsNone(response.data['next_cursor'])
+
+    def test_orders_invalid_cursor(self):
+        response = self.client.get(self.url, data={"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['cursor'][0].code, 'invalid_cursor')
+
+    def test_order_buckets(self):
+        Order.objects.create(
+            buyer=self.buyer, seller=self.seller, product=self.product, quantity=10,
+            unit_cost=5, created_at=self.start
+        )
+        response = self.client.get(reverse('order-buckets'), data={"bucket": "day"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(
+            (response.data[0]['orders'], response.data[0]['units'], response.data[0]['spent']),
+            (2, 11, 55)
+        )
+
+
+class TestIdempotencyKeyAPIView(APITestCase):
+    """
+        Idempotency-Key header tests on /deposit and /buy
+    """
+
+    def setUp(self):
+        self.buyer = create_user({"username": "user1", "password": "passwd1"}, role='buyer')
+        self.seller = create_user({"username": "user2", "password": "passwd2"}, role='seller')
+        _, _token = authenticate_user(username="user1", password="passwd1")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+
+    def test_deposit_retry_is_replayed(self):
+        url = reverse('deposit', args=[20])
+        first = self.client.get(url, HTTP_IDEMPOTENCY_KEY='key-1')
+        retry = self.client.get(url, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(User.objects.get(pk=self.buyer.pk).deposit, 20)
+
+        self.client.get(url, HTTP_IDEMPOTENCY_KEY='key-2')
+        self.client.get(url)
+        self.assertEqual(User.objects.get(pk=self.buyer.pk).deposit, 60)
+
+    def test_buy_retry_is_replayed(self):
+        _product = Product.objects.create(
+            product_name="prod1", amount_available=10, cost=5, seller=self.seller
+        )
+        self.client.get(reverse('deposit', args=[50]))
+        # The first sale of the product, past the low stock threshold and out of stock: the most expensive purchase
+        for _ in range(3):
+            response = self.client.get(
+                reverse('buy'), data={"amount": 10, "product_id": _product.id}, HTTP_IDEMPOTENCY_KEY='buy-1'
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(json.loads(response.content), {"product": "prod1", "total": 50})
+        self.assertEqual(Product.objects.get(pk=_product.pk).amount_available, 0)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_is_scoped_to_credentials(self):
+        url = reverse('deposit', args=[20])
+        self.client.get(url, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.client.credentials()
+        response = self.client.get(url, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_invalid_key(self):
+        response = self.client.get(reverse('deposit', args=[20]), HTTP_IDEMPOTENCY_KEY='k' * 256)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestSparseFieldsetsAPIView(APITestCase):
+    """
+        ?fields= sparse fieldset tests on product and user GET endpoints
+    """
+
+    def setUp(self):
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role="seller")
+        self.products_list = bulk_create_products(self.seller, [
+            {"product_name": "prod1", "cost": 5, "amount_available": 10},
+            {"product_name": "prod2", "cost": 10, "amount_available": 3},
+        ])
+
+    def test_product_list_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('product-list'), data={"fields": "id,product_name,cost"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            json.loads(response.content),
+            [{"id": p['id'], "product_name": p['product_name'], "cost": p['cost']} for p in self.products_list]
+        )
+        # The catalog version lookup of the response cache, then the list
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('amount_available', queries[1]['sql'].split('FROM')[0])
+        self.assertNotIn('seller_id', queries[1]['sql'].split('FROM')[0])
+
+    def test_product_detail_fields(self):
+        response = self.client.get(
+            reverse('product-detail', args=[self.products_list[0]['id']]), data={"fields": "seller, cost"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertDictEqual(response.data, {"seller": self.seller.pk, "cost": 5})
+
+    def test_user_endpoints_fields(self):
+        response = self.client.get(reverse('users-list'), data={"fields": "username"})
+        self.assertEqual(json.loads(response.content), [{"username": "user1"}])
+        response = self.client.get(reverse('user-detail', args=[self.seller.pk]), data={"fields": "id,role"})
+        self.assertDictEqual(response.data, {"id": self.seller.pk, "role": "seller"})
+
+    def test_unknown_fields(self):
+        response = self.client.get(reverse('product-list'), data={"fields": "id,secret"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('secret', response.data['fields'][0])
+        # Write only fields cannot be requested either
+        response = self.client.get(reverse('users-list'), data={"fields": "password"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestProductChangesAPIView(APITestCase):
+    """
+        /products/changes delta sync tests
+    """
+
+    def setUp(self):
+        self.url = reverse('product-changes')
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role="seller")
+        self.products_list = bulk_create_products(self.seller, [
+            {"product_name": f"prod{i}", "cost": 5, "amount_available": 10} for i in range(5)
+        ])
+
+    def _sync(self, since, limit=100):
+        response = self.client.get(self.url, data={"since": since, "limit": limit})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_full_sync_pages(self):
+        seen, since, has_more = [], 0, True
+        while has_more:
+            data = self._sync(since, limit=2)
+            seen += [product['id'] for product in data['changes']]
+            since, has_more = data['seq'], data['has_more']
+        self.assertEqual(seen, [product['id'] for product in self.products_list])
+        self.assertEqual(self._sync(since), {"changes": [], "deleted": [], "seq": since, "has_more": False})
+
+    def test_only_changed_rows_are_returned(self):
+        since = self._sync(0)['seq']
+        _product = Product.objects.get(pk=self.products_list[1]['id'])
+        _product.amount_available = 9
+        _product.save()
+        Product.objects.get(pk=self.products_list[3]['id']).delete()
+
+        data = self._sync(since)
+        self.assertEqual([product['id'] for product in data['changes']], [_product.id])
+        self.assertEqual(data['changes'][0]['amount_available'], 9)
+        self.assertEqual(data['deleted'], [self.products_list[3]['id']])
+        self.assertFalse(data['has_more'])
+        self.assertEqual(self._sync(data['seq'])['changes'], [])
+
+    def test_rows_sharing_a_sequence_value_stay_on_one_page(self):
+        since = self._sync(0)['seq']
+        Product.objects.filter(seller=self.seller).update(change_seq=since + 1)
+        data = self._sync(since, limit=2)
+        self.assertEqual(len(data['changes']), 5)
+        self.assertFalse(data['has_more'])
+
+    def test_buy_bumps_change_sequence(self):
+        since = self._sync(0)['seq']
+        create_user({"username": "user2", "password": "passwd2"}, role="buyer")
+        _, _token = authenticate_user(username="user2", password="passwd2")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        self.client.get(reverse('deposit', args=[50]))
+        self.client.get(reverse('buy'), data={"product_id": self.products_list[0]['id'], "amount": 1})
+        data = self._sync(since)
+        self.assertEqual(
+            [(product['id'], product['amount_available']) for product in data['changes']],
+            [(self.products_list[0]['id'], 9)]
+        )
+
+
+class TestUserSoftDeleteAPIView(APITestCase):
+    """
+        User soft delete and purge tests
+    """
+
+    def setUp(self):
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        self.buyer = create_user({"username": "user2", "password": "passwd2"}, role='buyer')
+        self.products = [
+            Product.objects.create(product_name=f'cola {i}', cost=5, amount_available=10, seller=self.seller)
+            for i in range(5)
+        ]
+        Order.objects.create(
+            buyer=self.buyer, seller=self.seller, product=self.products[0], quantity=1, unit_cost=5
+        )
+        self.url = reverse('user-detail', kwargs={"pk": self.seller.pk})
+
+    def test_product_queries_do_not_join_sellers(self):
+        self.assertNotIn(User._meta.db_table, str(Product.objects.filter(cost=5).query))
+
+    def test_soft_delete_hides_user_and_products(self):
+        response = self.client.delete(self.url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(self.client.get(reverse('users-list')).json()), 1)
+        self.assertEqual(self.client.get(reverse('product-list')).json(), [])
+        self.assertEqual(self.client.get(reverse('product-search'), {"q": "cola"}).data['results'], [])
+        self.assertEqual(Product.all_objects.count(), 5)
+        _user = User.all_objects.get(pk=self.seller.pk)
+        self.assertFalse(_user.is_active)
+        # The username stays taken until the user is purged
+        response = self.client.post(reverse('user-create'), {"username": "user1", "password": "passwd1"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_purge_after_commit(self):
+        with self.settings(USER_PURGE_BATCH_SIZE=2), self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(self.url)
+        self.assertFalse(User.all_objects.filter(pk=self.seller.pk).exists())
+        self.assertFalse(Product.all_objects.exists())
+        self.assertFalse(Order.objects.exists())
+        # Purged products are reported as deleted by delta sync, in batches sharing a change sequence value
+        response = self.client.get(reverse('product-changes'), {"since": 0})
+        self.assertEqual(sorted(response.data['deleted']), sorted(product.pk for product in self.products))
+        self.assertEqual(ProductTombstone.objects.values('change_seq').distinct().count(), 3)
+
+
+class TestMachineAPIView(APITestCase):
+    """
+        Machine stock and balance API view tests
+    """
+
+    def setUp(self):
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        self.buyer = create_user({"username": "user2", "password": "passwd2"}, role='buyer')
+        self.machines = [Machine.objects.create(name=f'machine {i}') for i in range(2)]
+        self.product = Product.objects.create(product_name='cola', cost=15, amount_available=0, seller=self.seller)
+        _, self.seller_token = authenticate_user(username="user1", password="passwd1")
+        _, self.buyer_token = authenticate_user(username="user2", password="passwd2")
+
+    def set_stock(self, machine, amount):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.seller_token}')
+        return self.client.put(
+            reverse('machine-stock', kwargs={"machine_id": machine.pk, "product_id": self.product.pk}),
+            {"amount_available": amount}
+        )
+
+    def test_stock_and_list(self):
+        self.assertEqual(self.set_stock(self.machines[0], 3).status_code, status.HTTP_200_OK)
+        self.set_stock(self.machines[0], 4)
+        response = self.client.get(reverse('machine-product-list', kwargs={"machine_id": self.machines[0].pk}))
+        self.assertEqual(response.data, [
+            {"id": self.product.pk, "product_name": "cola", "seller": self.seller.pk, "cost": 15, "amount_available": 4}
+        ])
+        response = self.client.get(reverse('machine-product-list', kwargs={"machine_id": self.machines[1].pk}))
+        self.assertEqual(response.data, [])
+        response = self.client.get(reverse('machine-product-list', kwargs={"machine_id": 1000}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stock_requires_owner(self):
+        other = create_user({"username": "user3", "password": "passwd3"}, role='seller')
+        _, _token = authenticate_user(username="user3", password="passwd3")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        response = self.client.put(
+            reverse('machine-stock', kwargs={"machine_id": self.machines[0].pk, "product_id": self.product.pk}),
+            {"amount_available": 3}
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.set_stock(self.machines[0], -1).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_buy_uses_machine_stock_and_balance(self):
+        self.set_stock(self.machines[0], 6)
+        self.set_stock(self.machines[1], 3)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.buyer_token}')
+        for coin in (20, 10):
+            response = self.client.get(
+                reverse('machine-deposit', kwargs={"machine_id": self.machines[0].pk, "amount": coin})
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.get(reverse('machine-deposit', kwargs={"machine_id": self.machines[1].pk, "amount": 5}))
+        self.assertEqual(MachineBalance.objects.get(machine=self.machines[0]).deposit, 30)
+        self.assertEqual(User.objects.get(pk=self.buyer.pk).deposit, 0)
+
+        url = reverse('machine-buy', kwargs={"machine_id": self.machines[1].pk})
+        response = self.client.get(url, {"product_id": self.product.pk, "amount": 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        url = reverse('machine-buy', kwargs={"machine_id": self.machines[0].pk})
+        response = self.client.get(url, {"product_id": self.product.pk, "amount": 7})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # Takes the stock down to the low stock threshold: the most expensive purchase
+        response = self.client.get(url, {"product_id": self.product.pk, "amount": 1}, HTTP_IDEMPOTENCY_KEY='buy-1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {"product": "cola", "total": 15, "change": 15})
+        self.assertEqual(MachineStock.objects.get(machine=self.machines[0]).amount_available, 5)
+        self.assertEqual(MachineStock.objects.get(machine=self.machines[1]).amount_available, 3)
+        self.assertEqual(MachineBalance.objects.get(machine=self.machines[0]).deposit, 0)
+        self.assertEqual(MachineBalance.objects.get(machine=self.machines[1]).deposit, 5)
+        self.assertEqual(Order.objects.get().buyer_id, self.buyer.pk)
+
+        response = self.client.get(reverse('machine-reset', kwargs={"machine_id": self.machines[1].pk}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(MachineBalance.objects.get(machine=self.machines[1]).deposit, 0)
+
+
+class TestProductAffordableAPIView(APITestCase):
+    """
+        Affordable products API view tests
+    """
+
+    def setUp(self):
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        self.buyer = create_user({"username": "user2", "password": "passwd2"}, role='buyer', deposit=50)
+        self.products = {
+            name: Product.objects.create(product_name=name, cost=cost, amount_available=amount, seller=self.seller)
+            for name, cost, amount in [
+                ('gum', 5, 3), ('water', 10, 20), ('cola', 20, 1), ('chips', 20, 8),
+                ('sold out', 5, 0), ('juice', 55, 10),
+            ]
+        }
+        _, _token = authenticate_user(username="user2", password="passwd2")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        self.url = reverse('product-affordable')
+
+    def test_affordable_products(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['deposit'], 50)
+        self.assertEqual(
+            [(product['product_name'], product['max_quantity']) for product in response.data['results']],
+            [('gum', 3), ('water', 5), ('cola', 1), ('chips', 2)]
+        )
+        self.assertIsNone(response.data['next_cursor'])
+
+    def test_pagination(self):
+        names = []
+        params = {"limit": 3}
+        while True:
+            response = self.client.get(self.url, params)
+            names += [product['product_name'] for product in response.data['results']]
+            if response.data['next_cursor'] is None:
+                break
+            params['cursor'] = response.data['next_cursor']
+        self.assertEqual(names, ['gum', 'water', 'cola', 'chips'])
+        response = self.client.get(self.url, {"cursor": "bad"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_uses_cost_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        plan = ' '.join(str(row) for row in connection.cursor().execute(
+            f"EXPLAIN QUERY PLAN {queries[-1]['sql']}"
+        ).fetchall())
+        self.assertIn('product_cost_stock_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_seller_forbidden(self):
+        _, _token = authenticate_user(username="user1", password="passwd1")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TestBatchAPIView(APITestCase):
+    """
+        Batch API view tests
+    """
+
+    def setUp(self):
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        self.buyer = create_user({"username": "user2", "password": "passwd2"}, role='buyer')
+        self.product = Product.objects.create(product_name='water', cost=10, amount_available=5, seller=self.seller)
+        _, _token = authenticate_user(username="user2", password="passwd2")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        self.url = reverse('batch')
+
+    def post_batch(self, *requests):
+        return self.client.post(self.url, {"requests": list(requests)}, format='json')
+
+    def test_batch(self):
+        response = self.post_batch(
+            {"method": "GET", "path": f"user/{self.buyer.pk}?fields=id,username"},
+            {"method": "GET", "path": "/api/v1/products?in_stock=true"},
+            {"method": "GET", "path": f"product/{self.product.pk}"},
+            {"method": "GET", "path": "product/0"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['responses']
+        self.assertEqual([result['status'] for result in results], [200, 200, 200, 404])
+        self.assertEqual(results[0]['body'], {"id": self.buyer.pk, "username": "user2"})
+        self.assertEqual([product['id'] for product in results[1]['body']], [self.product.pk])
+        self.assertEqual(results[2]['body']['product_name'], 'water')
+
+    def test_writes_run_in_order(self):
+        response = self.post_batch(
+            {"method": "GET", "path": "deposit/10"},
+            {"method": "GET", "path": f"buy?product_id={self.product.pk}&amount=1"},
+            {"method": "GET", "path": f"product/{self.product.pk}"},
+        )
+        results = response.data['responses']
+        self.assertEqual([result['status'] for result in results], [200, 200, 200])
+        self.assertEqual(results[2]['body']['amount_available'], 4)
+
+    def test_sub_request_errors(self):
+        response = self.post_batch(
+            {"method": "GET", "path": "nowhere"},
+            {"method": "POST", "path": "batch", "body": {"requests": []}},
+            {"method": "POST", "path": "product", "body": {"product_name": "chips", "cost": 5}},
+        )
+        self.assertEqual(
+            [result['status'] for result in response.data['responses']],
+            [status.HTTP_404_NOT_FOUND, status.HTTP_400_BAD_REQUEST, status.HTTP_403_FORBIDDEN]
+        )
+
+    def test_idempotency_key_header(self):
+        request = {"method": "GET", "path": "deposit/10", "headers": {"Idempotency-Key": "k1"}}
+        response = self.post_batch(request, request)
+        results = response.data['responses']
+        self.assertEqual(results[1]['headers'].get('Idempotent-Replayed'), 'true')
+        self.buyer.refresh_from_db()
+        self.assertEqual(self.buyer.deposit, 10)
+
+    def test_invalid_batch(self):
+        self.assertEqual(self.post_batch().status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.post_batch(*[{"method": "GET", "path": "products"}] * 21)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.post_batch({"method": "TRACE", "path": "products"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_authentication_required(self):
+        self.client.credentials()
+        response = self.post_batch({"method": "GET", "path": "products"})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_independent_gets_run_on_the_pool(self):
+        threads = []
+
+        def run_sub_request(sub):
+            threads.append((sub.request.path, threading.current_thread().name))
+            return batch._result(200, None)
+
+        with mock.patch.object(batch, '_in_transaction', return_value=False), \
+                mock.patch.object(batch, 'run_sub_request', side_effect=run_sub_request):
+            self.post_batch(
+                {"method": "GET", "path": "products"},
+                {"method": "GET", "path": "products/search?q=water"},
+                {"method": "GET", "path": "deposit/10"},
+            )
+        threads = dict(threads)
+        self.assertTrue(threads['/api/v1/products'].startswith('batch'))
+        self.assertTrue(threads['/api/v1/products/search'].startswith('batch'))
+        self.assertEqual(threads['/api/v1/deposit/10'], threading.current_thread().name)
+
+
+class TestProductBulkUpdateAPIView(APITestCase):
+    """
+        Bulk product update API view tests
+    """
+
+    def setUp(self):
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        self.other_seller = create_user({"username": "user2", "password": "passwd2"}, role='seller')
+        self.products = [
+            Product.objects.create(product_name=name, cost=cost, amount_available=amount, seller=self.seller)
+            for name, cost, amount in [('water', 10, 20), ('cola', 25, 5), ('chips', 15, 8)]
+        ]
+        self.other_product = Product.objects.create(
+            product_name='gum', cost=5, amount_available=10, seller=self.other_seller
+        )
+        _, _token = authenticate_user(username="user1", password="passwd1")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        self.url = reverse('product-bulk-update')
+
+    def values(self):
+        return list(Product.objects.order_by('pk').values_list('product_name', 'cost', 'amount_available'))
+
+    def test_explicit_changes(self):
+        water, cola, _ = self.products
+        response = self.client.patch(self.url, {"products": {
+            str(water.pk): {"cost": 12}, str(cola.pk): {"amount_available": 30, "product_name": "cola zero"},
+        }}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(self.values(), [
+            ('water', 12, 20), ('cola zero', 25, 30), ('chips', 15, 8), ('gum', 5, 10)
+        ])
+        water.refresh_from_db()
+        cola.refresh_from_db()
+        self.assertEqual(water.change_seq, cola.change_seq)
+        self.assertGreater(water.change_seq, self.other_product.change_seq)
+
+    def test_rules(self):
+        response = self.client.patch(self.url, {"rules": [
+            {"field": "cost", "operation": "multiply", "value": 1.1},
+            {"field": "amount_available", "operation": "add", "value": -6},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 3)
+        self.assertEqual(self.values(), [
+            ('water', 11, 14), ('cola', 28, 0), ('chips', 17, 2), ('gum', 5, 10)
+        ])
+
+    def test_rules_restricted_to_ids(self):
+        water = self.products[0]
+        response = self.client.patch(self.url, {
+            "rules": [{"field": "amount_available", "operation": "set", "value": 50}], "ids": [water.pk]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"updated": 1, "ids": [water.pk]})
+        self.assertEqual(self.values()[:2], [('water', 10, 50), ('cola', 25, 5)])
+
+    def test_products_of_other_sellers(self):
+        before = self.values()
+        response = self.client.patch(self.url, {"products": {
+            str(self.products[0].pk): {"cost": 12}, str(self.other_product.pk): {"cost": 50},
+        }}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data['missing'], [self.other_product.pk])
+        self.assertEqual(self.values(), before)
+
+    def test_delta_sync_sees_the_changes(self):
+        since = max(product.change_seq for product in Product.objects.all())
+        self.client.patch(self.url, {"rules": [{"field": "cost", "operation": "add", "value": 5}]}, format='json')
+        response = self.client.get(reverse('product-changes'), {"since": since})
+        self.assertEqual(len(response.data['changes']), 3)
+
+    def test_query_count_does_not_grow_with_products(self):
+        bulk_create_products(self.seller, [
+            {"product_name": f"p{i}", "cost": 5, "amount_available": 1} for i in range(50)
+        ])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.patch(self.url, {"rules": [{"field": "cost", "operation": "add", "value": 5}]}, format='json')
+        # The two sequences and the products
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 3)
+
+    @override_settings(PRODUCT_BULK_MAX_PRODUCTS=5)
+    def test_invalid_requests(self):
+        for body in [
+            {},
+            {"products": {"1": {"cost": 5}}, "rules": [{"field": "cost", "operation": "add", "value": 1}]},
+            {"products": {"water": {"cost": 5}}},
+            {"products": {"1": {}}},
+            {"rules": [{"field": "cost", "operation": "add", "value": 1.5}]},
+            {"rules": [{"field": "seller", "operation": "set", "value": 1}]},
+            {"rules": [{"field": "cost", "operation": "add", "value": 1}], "ids": list(range(1, 8))},
+        ]:
+            response = self.client.patch(self.url, body, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+    def test_buyer_forbidden(self):
+        create_user({"username": "user3", "password": "passwd3"}, role='buyer')
+        _, _token = authenticate_user(username="user3", password="passwd3")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        response = self.client.patch(self.url, {"rules": []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TestOptimisticConcurrencyAPIView(APITestCase):
+    """
+        Versioned writes and concurrent updates tests
+    """
+
+    def setUp(self):
+        self.seller = create_user({"username": "user1", "password": "passwd1"}, role='seller')
+        self.product = Product.objects.create(product_name='water', cost=10, amount_available=5, seller=self.seller)
+        _, _token = authenticate_user(username="user1", password="passwd1")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+        self.url = reverse('product-detail', args=[self.product.pk])
+
+    def put(self, data, **headers):
+        return self.client.put(self.url, {"product_name": "water", "cost": 10, "amount_available": 5, **data},
+                               format='json', **headers)
+
+    def test_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['ETag'], '"1"')
+        response = self.client.get(self.url, {"fields": "cost"})
+        self.assertEqual(response['ETag'], '"1"')
+        response = self.put({"cost": 15})
+        self.assertEqual(response['ETag'], '"2"')
+        self.assertEqual(response.data['version'], 2)
+
+    def test_if_match(self):
+        response = self.put({"cost": 15}, HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.put({"amount_available": 0}, HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(response['ETag'], '"2"')
+        self.assertEqual((response.data['cost'], response.data['amount_available']), (15, 5))
+        response = self.put({"amount_available": 0}, HTTP_IF_MATCH='*')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_body_version(self):
+        response = self.put({"cost": 15, "version": 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.put({"amount_available": 0, "version": 1})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['version'], 2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.amount_available, 5)
+
+    def test_concurrent_write_between_read_and_save(self):
+        def is_valid(serializer, **kwargs):
+            Product.objects.filter(pk=self.product.pk).update(amount_available=3, version=F('version') + 1)
+            return original_is_valid(serializer, **kwargs)
+
+        original_is_valid = ProductSerializer.is_valid
+        with mock.patch.object(ProductSerializer, 'is_valid', is_valid):
+            response = self.put({"cost": 15}, HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual((response.data['cost'], response.data['amount_available']), (10, 3))
+
+    def test_user_if_match(self):
+        url = reverse('user-detail', args=[self.seller.pk])
+        etag = self.client.get(url)['ETag']
+        data = {"username": "user1", "password": "passwd2", "deposit": 5, "role": "seller"}
+        response = self.client.put(url, data, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.put(url, data, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertNotIn('password', response.data)
+
+    def test_buy_does_not_overwrite_a_concurrent_edit(self):
+        buyer = create_user({"username": "user2", "password": "passwd2"}, role='buyer', deposit=50)
+        _, _token = authenticate_user(username="user2", password="passwd2")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+
+        def record_sale(buyer, product, quantity):
+            raise AssertionError('The sale must not be recorded')
+
+        original_get = Product.objects.get
+
+        def get(*args, **kwargs):
+            product = original_get(*args, **kwargs)
+            Product.objects.filter(pk=product.pk).update(cost=5, version=F('version') + 1)
+            return product
+
+        with mock.patch.object(Product.objects, 'get', get), \
+                mock.patch('vending_machine.views.record_sale', record_sale):
+            response = self.client.get(reverse('buy'), {"product_id": self.product.pk, "amount": 1})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.product.refresh_from_db()
+        buyer.refresh_from_db()
+        self.assertEqual((self.product.cost, self.product.amount_available), (5, 5))
+        self.assertEqual(buyer.deposit, 50)
+
+    def as_buyer_with_concurrent_update(self, **changes):
+        """
+        Authenticates as a buyer, and returns a patch updating the buyer's row once the request has
+        loaded it, as a concurrent request would
+        """
+        buyer = create_user({"username": "user2", "password": "passwd2"}, role='buyer', deposit=10)
+        _, _token = authenticate_user(username="user2", password="passwd2")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {_token}')
+
+        def has_permission(permission, request, view):
+            User.objects.filter(pk=buyer.pk).update(version=F('version') + 1, **changes)
+            return True
+
+        return buyer, mock.patch.object(HasBuyerRolePermission, 'has_permission', has_permission)
+
+    def test_concurrent_deposits_are_kept(self):
+        buyer, concurrent = self.as_buyer_with_concurrent_update(deposit=F('deposit') + 20, username='renamed')
+        with concurrent:
+            response = self.client.get(reverse('deposit', args=[5]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        buyer.refresh_from_db()
+        self.assertEqual((buyer.deposit, buyer.username), (35, 'renamed'))
+
+    def test_buy_does_not_zero_a_concurrent_deposit(self):
+        buyer, concurrent = self.as_buyer_with_concurrent_update(deposit=F('deposit') + 20)
+        with concurrent:
+            response = self.client.get(reverse('buy'), {"product_id": self.product.pk, "amount": 1})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        buyer.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual((buyer.deposit, self.product.amount_available), (30, 5))
+
+    def test_reset_only_writes_the_deposit(self):
+        buyer, concurrent = self.as_buyer_with_concurrent_update(username='renamed')
+        with concurrent:
+            response = self.client.get(reverse('reset'))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        buyer.refresh_from_db()
+        self.assertEqual((buyer.deposit, buyer.username), (0, 'renamed'))
@@ -0,0 +1,122 @@
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+# Cache backends are per thread; keep a reference to skip the caches[] lookup on every request
+_local = threading.local()
+
+
+def get_throttle_cache():
+    alias = getattr(settings, 'THROTTLE_CACHE', 'default')
+    if getattr(_local, 'alias', None) != alias:
+        _local.cache, _local.alias = caches[alias], alias
+    return _local.cache
+
+
+@receiver(setting_changed)
+def _reset_throttle_cache(setting, **kwargs):
+    if setting in ('CACHES', 'THROTTLE_CACHE'):
+        _local.__dict__.clear()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket throttle, implemented as a generic cell rate algorithm (GCRA).
+    The bucket is a single integer in the THROTTLE_CACHE cache: the theoretical arrival time (TAT)
+    of the next request in microseconds. Each accepted request is one atomic cache.incr(); a client
+    coming back to a refilled bucket costs a cache.set() as well, and a rejected request one
+    cache.decr() to undo its increment. Buckets are written with a fixed expiry of `bucket_ttl`,
+    which incr() does not extend: a bucket in use for that long expires and comes back full, so a
+    client gets at most one extra burst per `bucket_ttl`.
+
+    A rate of 'N/period' allows bursts of N requests, refilled at N per period. Rates are looked up
+    in DEFAULT_THROTTLE_RATES by scope: the view's `throttle_scope` attribute, or the view function
+    name for @api_view views (e.g. 'buy', 'deposit', 'product_create'), followed by `rate_suffix`.
+    Views whose scope has no rate are not throttled.
+    """
+    timer = time.time
+    cache_format = 'throttle_%(scope)s_%(ident)s'
+    rate_suffix = ''
+    bucket_ttl = 86400
+
+    def get_ident_key(self, request):
+        """
+        Returns the identity to throttle the request as, or None not to throttle it
+        """
+        raise NotImplementedError('.get_ident_key() must be overridden')
+
+    def get_scope(self, view):
+        return (getattr(view, 'throttle_scope', None) or type(view).__name__) + self.rate_suffix
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def parse_rate(rate):
+        num, period = rate.split('/')
+        return int(num), {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+
+    def allow_request(self, request, view):
+        self.wait_time = None
+        scope = self.get_scope(view)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        if rate is None:
+            return True
+        ident = self.get_ident_key(request)
+        if ident is None:
+            return True
+
+        capacity, period = self.parse_rate(rate)
+        interval = period * 1000000 // capacity
+        burst = capacity * interval
+        key = self.cache_format % {'scope': scope, 'ident': ident}
+        ttl = max(self.bucket_ttl, period + 1)
+        cache = get_throttle_cache()
+        now = int(self.timer() * 1000000)
+
+        try:
+            tat = cache.incr(key, interval)
+        except ValueError:  # No bucket yet
+            if cache.add(key, now + interval, ttl):
+                return True
+            tat = cache.incr(key, interval)
+
+        if tat < now + interval:
+            # The bucket was idle and is full again: restart from now
+            cache.set(key, now + interval, ttl)
+            return True
+        if tat - now > burst:
+            cache.decr(key, interval)
+            self.wait_time = (tat - burst - now) / 1000000
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_time
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """
+    Throttles authenticated requests per user, with the '<scope>' rate
+    """
+
+    def get_ident_key(self, request):
+        if request.user and request.user.is_authenticated:
+            return f'user_{request.user.pk}'
+        return None
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    """
+    Throttles every request per client address, with the '<scope>_ip' rate
+    """
+    rate_suffix = '_ip'
+
+    def get_ident_key(self, request):
+        return f'ip_{self.get_ident(request)}'
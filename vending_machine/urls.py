@@ -8,11 +8,26 @@ urlpatterns = [
     # path('example', views.example_view, name='example'),
     path('user', views.user_create, name='user-create'),
     path('user/<int:pk>', views.user_detail, name='user-detail'),
+    path('login', views.login, name='login'),
+    path('logout', views.logout, name='logout'),
     path('users', views.user_list, name='users-list'),
     path('product', views.product_create, name='product-create'),
     path('products', views.product_list, name='product-list'),
+    path('products/affordable', views.product_affordable, name='product-affordable'),
+    path('products/search', views.product_search, name='product-search'),
+    path('products/changes', views.product_changes, name='product-changes'),
+    path('products/bulk', views.product_bulk_update, name='product-bulk-update'),
     path('product/<int:pk>', views.product_detail, name='product-detail'),
     path('deposit/<int:amount>', views.deposit, name='deposit'),
     path('buy', views.buy, name='buy'),
     path('reset', views.reset, name='reset'),
+    path('seller/stats', views.seller_stats, name='seller-stats'),
+    path('orders', views.order_list, name='order-list'),
+    path('orders/buckets', views.order_buckets, name='order-buckets'),
+    path('machines/<int:machine_id>/products', views.machine_product_list, name='machine-product-list'),
+    path('machines/<int:machine_id>/stock/<int:product_id>', views.machine_stock, name='machine-stock'),
+    path('machines/<int:machine_id>/deposit/<int:amount>', views.machine_deposit, name='machine-deposit'),
+    path('machines/<int:machine_id>/buy', views.machine_buy, name='machine-buy'),
+    path('machines/<int:machine_id>/reset', views.machine_reset, name='machine-reset'),
+    path('batch', views.batch, name='batch'),
 ]
@@ -1,8 +1,14 @@
 from django.contrib.auth import authenticate
 from django.db import models
+from django.db.models import Case, ExpressionWrapper, F, FloatField, IntegerField, Value, When
+from django.db.models.functions import Cast, Greatest, Round
 from rest_framework.authtoken.models import Token
 
-from vending_machine.models import User, Product
+from vending_machine.authentication import issue_token
+from vending_machine import events
+from vending_machine.models import User, Product, Order, SellerProductStats, Sequence
+from vending_machine.signals import CATALOG_SEQUENCE, PRODUCT_SEQUENCE, product_event_data, publish_product_event
+from vending_machine.sharding import sharding_enabled, token_key_for_user
 
 
 def create_user(credentials: dict, **kwargs):
@@ -18,11 +24,18 @@ def bulk_create_users(users_list: list):
         create_user(credentials=user)
 
 
-def authenticate_user(username="", password=""):
+def authenticate_user(username="", password="", signed=False):
+    """
+    Returns the user and either its DRF Token, or a signed token when signed is True
+    """
     _user = authenticate(username=username, password=password)
     _token = ''
-    if _user:
-        _token, _ = Token.objects.get_or_create(user=_user)
+    if _user and signed:
+        _token, _ = issue_token(_user)
+    elif _user:
+        # Sharded users get keys naming their shard, see ShardedTokenAuthentication
+        defaults = {"key": token_key_for_user(_user.pk)} if sharding_enabled() else {}
+        _token, _ = Token.objects.using(_user._state.db).get_or_create(user=_user, defaults=defaults)
 
     return _user, _token
 
@@ -36,7 +49,71 @@ def bulk_create_products(seller, products_list=[]):
             "product_name": prod.product_name,
             "cost": prod.cost,
             "amount_available": prod.amount_available,
-            "seller": prod.seller.id,
+            "seller": prod.seller_id,
         })
 
     return products
+
+
+def record_sale(buyer, product, quantity):
+    """
+    Writes the purchase record and increments the product sales summary.
+    Must run inside the purchase transaction.
+    """
+    order = Order.objects.create(
+        buyer=buyer, seller_id=product.seller_id, product=product,
+        quantity=quantity, unit_cost=product.cost
+    )
+    SellerProductStats.add_sale(product, quantity)
+    return order
+
+
+def _rule_expression(field, operation, value):
+    if operation == 'set':
+        return Value(value)
+    if operation == 'add':
+        return Greatest(F(field) + value, Value(0))
+    return Cast(Round(ExpressionWrapper(F(field) * value, output_field=FloatField())), IntegerField())
+
+
+def patch_seller_products(seller_id, changes=None, rules=None, ids=None, batch_size=500):
+    """
+    Updates products of a seller without loading them and returns the ids of the updated products.
+    changes maps product ids to new field values, written bulk_update style with one
+    UPDATE ... SET field = CASE id WHEN ... per batch of ids. rules, such as
+    {"field": "cost", "operation": "multiply", "value": 1.1}, are applied to all the seller's
+    products, or to the ones in ids, by a single UPDATE with F() expressions.
+    Every UPDATE is restricted to seller_id, so products of other sellers are left out.
+    Must run inside a transaction.
+    """
+    # One change sequence value for every updated product, delta sync never splits it between pages
+    change_seq = Sequence.next_value(PRODUCT_SEQUENCE)
+    Sequence.next_value(CATALOG_SEQUENCE)
+    _products = Product.all_objects.filter(seller_id=seller_id)
+    if changes:
+        items = sorted(changes.items())
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            fields = {name for _, data in batch for name in data}
+            cases = {
+                name: Case(
+                    *[When(pk=pk, then=Value(data[name])) for pk, data in batch if name in data],
+                    default=F(name), output_field=Product._meta.get_field(name)
+                )
+                for name in fields
+            }
+            _products.filter(pk__in=[pk for pk, _ in batch]).update(
+                change_seq=change_seq, version=F('version') + 1, **cases
+            )
+    if rules:
+        if ids is not None:
+            _products = _products.filter(pk__in=ids)
+        _products.update(change_seq=change_seq, version=F('version') + 1, **{
+            rule['field']: _rule_expression(rule['field'], rule['operation'], rule['value']) for rule in rules
+        })
+
+    updated = []
+    for product in Product.all_objects.filter(seller_id=seller_id, change_seq=change_seq).order_by('pk').iterator():
+        publish_product_event(events.PRODUCT_UPDATED, product.pk, change_seq, product_event_data(product))
+        updated.append(product.pk)
+    return updated
@@ -1,14 +1,40 @@
-from rest_framework.authentication import TokenAuthentication
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, ExpressionWrapper, F, IntegerField, Q, Sum, Value
+from django.db.models.functions import Least, Trunc
+from django.utils.http import parse_etags, quote_etag
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.generics import GenericAPIView
-from rest_framework.parsers import JSONParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 
-from .models import User, Product
-from .permissions import HasSellerRolePermission, IsSellerOwnerOfProduct, HasBuyerRolePermission
-from .serializer import UserSerializer, ProductSerializer
+from .authentication import (
+    SignedTokenAuthentication, ShardedTokenAuthentication, decode_token, revocation_list
+)
+from .batch import dispatch
+from .idempotency import idempotent
+from .models import (
+    User, Product, SellerProductStats, Order, ProductTombstone, Machine, MachineStock, MachineBalance,
+    VersionConflict
+)
+from .query_budget import query_budget
+from .response_cache import cached_list
+from .permissions import (
+    HasSellerRolePermission, IsSellerOwnerOfProduct, HasBuyerRolePermission, SELLER_OWNER_PERMISSION_MESSAGE
+)
+from .search import search_products
+from .sharding import atomic_on, merged_scan, shard_for_user
+from .signals import CATALOG_SEQUENCE
+from .tasks import enqueue
+from .serializer import (
+    UserSerializer, ProductSerializer, ProductSearchSerializer, ProductFilterSerializer,
+    SellerProductStatsSerializer, OrderSerializer, OrderListSerializer, OrderBucketSerializer,
+    KeysetCursorField, ProductChangesSerializer, LoginSerializer, MachineStockSerializer, UserListSerializer,
+    AffordableProductSerializer, AffordableProductListSerializer, ProductCostCursorField, BatchSerializer,
+    ProductBulkUpdateSerializer
+)
+from .utils import record_sale, authenticate_user, patch_seller_products
 from .models import CoinChoices
 
 
@@ -24,6 +50,50 @@ class UserCreateAPIView(GenericAPIView):
         return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def _etag(instance):
+    return quote_etag(str(instance.version))
+
+
+def _versioned_response(data, instance, status_code):
+    """
+    Returns data with the version of instance as ETag, for If-Match on the next update
+    """
+    response = Response(data, status=status_code)
+    response['ETag'] = _etag(instance)
+    return response
+
+
+def _version_mismatch(request, instance):
+    """
+    Checks the version an update was based on, from the If-Match header or the version of the body.
+    Returns 412 or 409 respectively when it is not the current version of instance, None otherwise.
+    """
+    if_match = request.headers.get('If-Match')
+    if if_match is not None:
+        etags = parse_etags(if_match)
+        if '*' not in etags and _etag(instance) not in etags:
+            return status.HTTP_412_PRECONDITION_FAILED
+    version = request.data.get('version')
+    if version is not None and str(version) != str(instance.version):
+        return status.HTTP_409_CONFLICT
+    return None
+
+
+def _save_versioned(request, serializer, instance):
+    """
+    Saves serializer with UPDATE ... WHERE id = ? AND version = ?, for the version instance was
+    read at. Returns the status of a lost race, None once saved.
+    """
+    instance.expected_version = instance.version
+    try:
+        with transaction.atomic():
+            serializer.save()
+    except VersionConflict:
+        return status.HTTP_412_PRECONDITION_FAILED if 'If-Match' in request.headers else status.HTTP_409_CONFLICT
+    return None
+
+
+@query_budget(queries=7)
 @api_view(['GET', 'PUT', 'DELETE'])
 def user_detail(request, pk=0):
     """
@@ -32,47 +102,73 @@ def user_detail(request, pk=0):
             /user/<id>
         Methods:
             GET, PUT, DELETE, PATCH
+        Query parameters (GET):
+            fields: comma separated subset of the fields to return
+        Versioning (PUT):
+            Responses carry the row version as ETag. Updates sent with If-Match, or with the
+            version in the body, get 412 or 409 and the current representation when the row
+            changed since that version; every update is only applied to the version it read.
     """
+    _users = User.objects.using(shard_for_user(pk))
+    if request.method == 'GET':
+        fields = UserSerializer.parse_fields(request.query_params.get('fields'))
+        _users = UserSerializer.project(_users, fields, extra=('version', ))
+
     try:
-        _user = User.objects.get(pk=pk)
+        _user = _users.get(pk=pk)
     except User.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
     if request.method == 'GET':
-        user_serializer = UserSerializer(_user)
-        return Response(user_serializer.data, status=status.HTTP_200_OK)
+        user_serializer = UserSerializer(_user, fields=fields)
+        return _versioned_response(user_serializer.data, _user, status.HTTP_200_OK)
 
     elif request.method == 'PUT':
-        _data = JSONParser().parse(request)
-        user_serializer = UserSerializer(_user, data=_data)
+        mismatch = _version_mismatch(request, _user)
+        if mismatch:
+            return _versioned_response(UserSerializer(_user).data, _user, mismatch)
+        user_serializer = UserSerializer(_user, data=request.data)
         if user_serializer.is_valid():
-            user_serializer.save()
-            return Response(user_serializer.data, status=status.HTTP_200_OK)
+            mismatch = _save_versioned(request, user_serializer, _user)
+            if mismatch:
+                _user = _users.get(pk=pk)
+                return _versioned_response(UserSerializer(_user).data, _user, mismatch)
+            return _versioned_response(user_serializer.data, _user, status.HTTP_200_OK)
         return Response(user_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     elif request.method == 'DELETE':
-        _user.delete()
+        _user.soft_delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+@query_budget(queries=2)
 @api_view(['GET'])
 def user_list(request):
     """
-        User list API
+        User list API, ordered by id. Pages of `limit` users are fetched with `after`, the last id
+        of the previous page; users are merged from every shard when they are sharded.
         Endpoints:
-            /users
+            /users?fields=<field>,<field>&limit=<limit>&after=<id>
         Methods:
             GET
     """
     if request.method == 'GET':
-        _users = User.objects.all()
-        serializer = UserSerializer(_users, many=True)
+        fields = UserSerializer.parse_fields(request.query_params.get('fields'))
+        params = UserListSerializer(data=request.query_params.dict())
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        _users = merged_scan(
+            UserSerializer.project(User.objects.all(), fields),
+            limit=params.validated_data.get('limit'), after=params.validated_data.get('after')
+        )
+        serializer = UserSerializer(_users, many=True, fields=fields)
         return Response(serializer.data, status=status.HTTP_200_OK)
     return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+@query_budget(queries=4)
 @api_view(['POST'])
 def user_create(request):
     """
@@ -83,8 +179,7 @@ def user_create(request):
             POST
     """
     if request.method == 'POST':
-        user_data = JSONParser().parse(request)
-        user_serializer = UserSerializer(data=user_data)
+        user_serializer = UserSerializer(data=request.data)
         if user_serializer.is_valid():
             user_serializer.save()
             return Response(user_serializer.data, status=status.HTTP_201_CREATED)
@@ -93,9 +188,52 @@ def user_create(request):
     return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+@query_budget(queries=2)
+@api_view(['POST'])
+@authentication_classes([])
+def login(request):
+    """
+        Signed token login API, the token is sent as 'Authorization: Bearer <token>'
+        Endpoints:
+            /login
+        Methods:
+            POST
+    """
+    serializer = LoginSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    _user, _token = authenticate_user(**serializer.validated_data, signed=True)
+    if not _user:
+        return Response({"detail": "Invalid credentials."}, status=status.HTTP_401_UNAUTHORIZED)
+    _claims = decode_token(_token)
+    return Response({
+        "token": _token,
+        "user": _user.pk,
+        "expires_at": _claims.expires_at_datetime,
+    }, status=status.HTTP_200_OK)
+
+
+@query_budget(queries=5)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@authentication_classes([SignedTokenAuthentication])
+def logout(request):
+    """
+        Revokes the signed token of the request
+        Endpoints:
+            /logout
+        Methods:
+            POST
+    """
+    revocation_list.revoke(request.auth)
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@idempotent
+@query_budget(queries=5)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated, HasSellerRolePermission])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([SignedTokenAuthentication, ShardedTokenAuthentication])
 def product_create(request):
     """
         Product create API
@@ -105,7 +243,7 @@ def product_create(request):
             POST
     """
     if request.method == 'POST':
-        product_data = JSONParser().parse(request)
+        product_data = request.data.copy()
         product_data['seller'] = request.user.pk
         product_serializer = ProductSerializer(data=product_data)
         if product_serializer.is_valid():
@@ -116,26 +254,194 @@ def product_create(request):
     return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+@query_budget(queries=2)
+@cached_list(CATALOG_SEQUENCE)
 @api_view(['GET'])
 def product_list(request):
     """
         Product list API view
         Endpoints:
-            /products
+            /products?seller=<id>&in_stock=<bool>&min_cost=<cost>&max_cost=<cost>&ordering=<field>
+                &fields=<field>,<field>
         Methods:
             GET
     """
     if request.method == 'GET':
-        _products = Product.objects.all()
-        serializer = ProductSerializer(_products, many=True)
+        params = ProductFilterSerializer(data=request.query_params.dict())
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        fields = ProductSerializer.parse_fields(request.query_params.get('fields'))
+        _products = ProductSerializer.project(params.filter_queryset(Product.objects.all()), fields)
+        serializer = ProductSerializer(_products, many=True, fields=fields)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+@query_budget(queries=2)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, HasBuyerRolePermission])
+@authentication_classes([SignedTokenAuthentication, ShardedTokenAuthentication])
+def product_affordable(request):
+    """
+        In stock products the buyer's deposit can pay for, cheapest first, with the maximum
+        quantity the deposit buys. Served by a range scan of product_cost_stock_idx, keyset paginated.
+        Endpoints:
+            /products/affordable?limit=<limit>&cursor=<next_cursor>
+        Methods:
+            GET
+    """
+    params = AffordableProductListSerializer(data=request.query_params.dict())
+    if not params.is_valid():
+        return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    limit, deposit = params.validated_data['limit'], request.user.deposit
+    _products = Product.objects.filter(cost__gt=0, cost__lte=deposit, amount_available__gt=0)
+    if 'cursor' in params.validated_data:
+        cost, amount_available, pk = params.validated_data['cursor']
+        _products = _products.filter(
+            Q(cost__gt=cost)
+            | Q(cost=cost, amount_available__gt=amount_available)
+            | Q(cost=cost, amount_available=amount_available, pk__gt=pk)
+        )
+    _products = list(
+        _products.annotate(
+            max_quantity=Least(
+                F('amount_available'),
+                ExpressionWrapper(Value(deposit) / F('cost'), output_field=IntegerField())
+            )
+        ).order_by('cost', 'amount_available', 'id')[:limit + 1]
+    )
+
+    next_cursor = None
+    if len(_products) > limit:
+        _products = _products[:limit]
+        next_cursor = ProductCostCursorField.encode(_products[-1])
+    return Response(
+        {
+            "deposit": deposit,
+            "results": AffordableProductSerializer(_products, many=True).data,
+            "next_cursor": next_cursor,
+        },
+        status=status.HTTP_200_OK
+    )
+
+
+@query_budget(queries=1)
+@api_view(['GET'])
+def product_search(request):
+    """
+        Product search API view
+        Endpoints:
+            /products/search?q=<query>&limit=<limit>&offset=<offset>
+        Methods:
+            GET
+    """
+    params = ProductSearchSerializer(data=request.query_params)
+    if not params.is_valid():
+        return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    limit, offset = params.validated_data['limit'], params.validated_data['offset']
+    _products = search_products(params.validated_data['q'], limit=limit + 1, offset=offset)
+    serializer = ProductSerializer(_products[:limit], many=True)
+    return Response(
+        {
+            "results": serializer.data,
+            "next_offset": offset + limit if len(_products) > limit else None,
+        },
+        status=status.HTTP_200_OK
+    )
+
+
+@query_budget(queries=6)
+@api_view(['GET'])
+def product_changes(request):
+    """
+        Product delta sync API view: products written and deleted after a change sequence value.
+        Clients pass the returned `seq` as `since` on their next call, until `has_more` is false.
+        Endpoints:
+            /products/changes?since=<seq>&limit=<limit>
+        Methods:
+            GET
+    """
+    params = ProductChangesSerializer(data=request.query_params.dict())
+    if not params.is_valid():
+        return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    since, limit = params.validated_data['since'], params.validated_data['limit']
+    _products = list(Product.objects.filter(change_seq__gt=since).order_by('change_seq', 'id')[:limit + 1])
+    _tombstones = list(
+        ProductTombstone.objects.filter(change_seq__gt=since).order_by('change_seq', 'id')[:limit + 1]
+    )
+    changes = sorted(_products + _tombstones, key=lambda change: change.change_seq)
+    has_more = len(changes) > limit
+    if has_more:
+        # Never split the rows sharing a change sequence value between two pages
+        last_seq = changes[limit - 1].change_seq
+        _products = [product for product in _products if product.change_seq < last_seq]
+        _tombstones = [tombstone for tombstone in _tombstones if tombstone.change_seq < last_seq]
+        _products += Product.objects.filter(change_seq=last_seq)
+        _tombstones += ProductTombstone.objects.filter(change_seq=last_seq)
+        changes = _products + _tombstones
+        has_more = Product.objects.filter(change_seq__gt=last_seq).exists() \
+            or ProductTombstone.objects.filter(change_seq__gt=last_seq).exists()
+
+    return Response(
+        {
+            "changes": ProductSerializer(_products, many=True).data,
+            "deleted": [tombstone.product_id for tombstone in _tombstones],
+            "seq": max((change.change_seq for change in changes), default=since),
+            "has_more": has_more,
+        },
+        status=status.HTTP_200_OK
+    )
+
+
+@idempotent
+@query_budget(queries=8)
+@api_view(['PATCH'])
+@permission_classes([IsAuthenticated, HasSellerRolePermission])
+@authentication_classes([SignedTokenAuthentication, ShardedTokenAuthentication])
+def product_bulk_update(request):
+    """
+        Updates many products of the seller at once, without loading them: explicit changes are
+        written in batches of PRODUCT_BULK_BATCH_SIZE with CASE expressions, rules with a single
+        UPDATE using F() expressions. Only the seller's products are updated, and nothing is when
+        one of the given ids is not one of them. Responds with the count and ids of the updated
+        products, their new values are published as product events.
+        Endpoints:
+            /products/bulk
+        Methods:
+            PATCH
+        Body:
+            {"products": {"<id>": {"cost": 15, "amount_available": 40}}}
+            {"rules": [{"field": "cost", "operation": "multiply", "value": 1.1}], "ids": [<id>, <id>]}
+    """
+    serializer = ProductBulkUpdateSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    params = serializer.validated_data
+    requested = set(params['products'] if 'products' in params else params.get('ids', ()))
+    with transaction.atomic():
+        _ids = patch_seller_products(
+            request.user.pk, changes=params.get('products'), rules=params.get('rules'), ids=params.get('ids'),
+            batch_size=getattr(settings, 'PRODUCT_BULK_BATCH_SIZE', 500)
+        )
+        missing = requested - set(_ids)
+        if missing:
+            transaction.set_rollback(True)
+            return Response(
+                {"detail": "These products do not exist or are not yours", "missing": sorted(missing)},
+                status=status.HTTP_404_NOT_FOUND
+            )
+    return Response({"updated": len(_ids), "ids": _ids}, status=status.HTTP_200_OK)
+
+
+@query_budget(queries=12)
 @api_view(['GET', 'PUT', 'DELETE'])
 @permission_classes([IsSellerOwnerOfProduct, ])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([SignedTokenAuthentication, ShardedTokenAuthentication])
 def product_detail(request, pk):
     """
         Product detail API view
@@ -143,26 +449,46 @@ def product_detail(request, pk):
             /product/<id>
         Methods:
             GET, PUT, PATCH, DELETE
+        Query parameters (GET):
+            fields: comma separated subset of the fields to return
+        Versioning (PUT):
+            Responses carry the row version as ETag. Updates sent with If-Match, or with the
+            version in the body, get 412 or 409 and the current representation when the row
+            changed since that version; every update is only applied to the version it read.
     """
+    _products = Product.objects.all()
+    if request.method == 'GET':
+        fields = ProductSerializer.parse_fields(request.query_params.get('fields'))
+        _products = ProductSerializer.project(_products, fields, extra=('version', ))
+
     try:
-        _product = Product.objects.get(pk=pk)
+        _product = _products.get(pk=pk)
     except Product.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
     if request.method == 'GET':
-        serializer = ProductSerializer(_product)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        serializer = ProductSerializer(_product, fields=fields)
+        return _versioned_response(serializer.data, _product, status.HTTP_200_OK)
 
-    if not request.user.pk == _product.seller.pk:
+    if not request.user.pk == _product.seller_id:
         return Response(status=status.HTTP_403_FORBIDDEN)
 
     if request.method == 'PUT':
-        _data = JSONParser().parse(request)
+        mismatch = _version_mismatch(request, _product)
+        if mismatch:
+            return _versioned_response(ProductSerializer(_product).data, _product, mismatch)
+        _data = request.data.copy()
         _data['seller'] = request.user.pk
         serializer = ProductSerializer(_product, data=_data)
         if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            mismatch = _save_versioned(request, serializer, _product)
+            if mismatch:
+                try:
+                    _product = _products.get(pk=pk)
+                except Product.DoesNotExist:
+                    return Response(status=status.HTTP_404_NOT_FOUND)
+                return _versioned_response(ProductSerializer(_product).data, _product, mismatch)
+            return _versioned_response(serializer.data, _product, status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     elif request.method == 'DELETE':
@@ -170,15 +496,19 @@ def product_detail(request, pk):
         return Response(status=status.HTTP_200_OK)
 
 
+@idempotent
+@query_budget(queries=9)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated, HasBuyerRolePermission])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([SignedTokenAuthentication, ShardedTokenAuthentication])
 def deposit(request, amount):
     if amount not in CoinChoices.values:
         return Response({"detail": f"{amount} is an invalid coin"}, status=status.HTTP_406_NOT_ACCEPTABLE)
-    _buyer = User.objects.get(pk=request.user.pk)
-    _buyer.deposit += amount
-    _buyer.save()
+    _buyer = request.user
+    # Added in the UPDATE statement, so that concurrent deposits and edits of the user are kept
+    _buyer.deposit = F('deposit') + amount
+    _buyer.save(update_fields=['deposit'])
+    _buyer.refresh_from_db(fields=['deposit', 'version'])
     return Response(
         {
             "detail": f"An amount of {amount} is deposited to {_buyer.username}'s account"
@@ -187,10 +517,10 @@ def deposit(request, amount):
     )
 
 
-@api_view(['GET'])
-@permission_classes([IsAuthenticated, HasBuyerRolePermission])
-@authentication_classes([TokenAuthentication])
-def buy(request):
+def _buy_params(request):
+    """
+    Returns the product_id and amount query parameters of a purchase, and the errors found in them
+    """
     product_id = request.query_params.get('product_id', None)
     amount = request.query_params.get('amount', None)
     _message = f"This parameter is required"
@@ -208,6 +538,16 @@ def buy(request):
     else:
         amount = int(amount)
 
+    return product_id, amount, _error_dict
+
+
+@idempotent
+@query_budget(queries=17)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, HasBuyerRolePermission])
+@authentication_classes([SignedTokenAuthentication, ShardedTokenAuthentication])
+def buy(request):
+    product_id, amount, _error_dict = _buy_params(request)
     if _error_dict:
         return Response(_error_dict, status=status.HTTP_400_BAD_REQUEST)
 
@@ -230,10 +570,31 @@ def buy(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     _change = _user_deposit - _total_cost
-    request.user.deposit = 0
-    request.user.save()
-    _product.amount_available -= amount
-    _product.save()
+    _user_version = request.user.version
+    try:
+        # The user may live on a shard: both databases roll back when either save conflicts
+        with atomic_on(request.user._state.db, DEFAULT_DB_ALIAS):
+            # Conditional on the versions the stock and the deposit were checked at, so that
+            # neither this sale nor a concurrent deposit, sale or edit is lost
+            _product.expected_version = _product.version
+            _product.amount_available -= amount
+            _product.save()
+            record_sale(request.user, _product, amount)
+            if _product.amount_available <= settings.LOW_STOCK_THRESHOLD < _product.amount_available + amount:
+                enqueue(
+                    'low_stock_alert', seller_id=_product.seller_id, product_id=_product.pk,
+                    amount_available=_product.amount_available,
+                )
+            request.user.expected_version = request.user.version
+            request.user.deposit = 0
+            request.user.save(update_fields=['deposit'])
+    except VersionConflict:
+        request.user.deposit, request.user.version = _user_deposit, _user_version
+        return Response(
+            {"detail": f"{request.user.username}'s deposit or {_product.product_name} was changed "
+                       f"by another request, please retry"},
+            status=status.HTTP_409_CONFLICT
+        )
     response_dict = {
         "product": _product.product_name,
         "total": _total_cost,
@@ -244,10 +605,304 @@ def buy(request):
     return Response(response_dict, status=status.HTTP_200_OK)
 
 
+@idempotent
+@query_budget(queries=3)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated, HasBuyerRolePermission])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([SignedTokenAuthentication, ShardedTokenAuthentication])
 def reset(request):
     request.user.deposit = 0
-    request.user.save()
+    request.user.save(update_fields=['deposit'])
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@query_budget(queries=3)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, HasSellerRolePermission])
+@authentication_classes([SignedTokenAuthentication, ShardedTokenAuthentication])
+def seller_stats(request):
+    """
+        Seller sales statistics API view
+        Endpoints:
+            /seller/stats?top=<count>
+        Methods:
+            GET
+    """
+    try:
+        top = max(1, min(int(request.query_params.get('top', 10)), 100))
+    except ValueError:
+        return Response({"top": "A valid integer is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+    _stats = SellerProductStats.objects.filter(seller=request.user)
+    _totals = _stats.aggregate(revenue=Sum('revenue'), units_sold=Sum('units_sold'))
+    _top_products = _stats.select_related('product').order_by('-revenue')[:top]
+    return Response(
+        {
+            "revenue": _totals['revenue'] or 0,
+            "units_sold": _totals['units_sold'] or 0,
+            "top_products": SellerProductStatsSerializer(_top_products, many=True).data,
+        },
+        status=status.HTTP_200_OK
+    )
+
+
+def _buyer_orders(request, params):
+    _orders = Order.objects.filter(buyer=request.user)
+    if 'since' in params:
+        _orders = _orders.filter(created_at__gte=params['since'])
+    if 'until' in params:
+        _orders = _orders.filter(created_at__lt=params['until'])
+    return _orders
+
+
+@query_budget(queries=2)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, HasBuyerRolePermission])
+@authentication_classes([SignedTokenAuthentication, ShardedTokenAuthentication])
+def order_list(request):
+    """
+        Purchase history API view, newest first, keyset paginated over (buyer, created_at)
+        Endpoints:
+            /orders?since=<datetime>&until=<datetime>&limit=<limit>&cursor=<next_cursor>
+        Methods:
+            GET
+    """
+    params = OrderListSerializer(data=request.query_params.dict())
+    if not params.is_valid():
+        return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    limit = params.validated_data['limit']
+    _orders = _buyer_orders(request, params.validated_data)
+    if 'cursor' in params.validated_data:
+        created_at, pk = params.validated_data['cursor']
+        _orders = _orders.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+    _orders = list(_orders.order_by('-created_at', '-id')[:limit + 1])
+
+    next_cursor = None
+    if len(_orders) > limit:
+        _orders = _orders[:limit]
+        next_cursor = KeysetCursorField.encode(_orders[-1].created_at, _orders[-1].pk)
+    return Response(
+        {"results": OrderSerializer(_orders, many=True).data, "next_cursor": next_cursor},
+        status=status.HTTP_200_OK
+    )
+
+
+@query_budget(queries=2)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, HasBuyerRolePermission])
+@authentication_classes([SignedTokenAuthentication, ShardedTokenAuthentication])
+def order_buckets(request):
+    """
+        Purchase history aggregated per time bucket
+        Endpoints:
+            /orders/buckets?bucket=<hour|day|week|month>&since=<datetime>&until=<datetime>
+        Methods:
+            GET
+    """
+    params = OrderBucketSerializer(data=request.query_params.dict())
+    if not params.is_valid():
+        return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    _buckets = (
+        _buyer_orders(request, params.validated_data)
+        .annotate(bucket=Trunc('created_at', params.validated_data['bucket']))
+        .values('bucket')
+        .annotate(orders=Count('id'), units=Sum('quantity'), spent=Sum(F('quantity') * F('unit_cost')))
+        .order_by('bucket')
+    )
+    return Response(list(_buckets), status=status.HTTP_200_OK)
+
+
+def _machine_exists(machine_id):
+    return Machine.objects.filter(pk=machine_id).exists()
+
+
+@query_budget(queries=2)
+@api_view(['GET'])
+def machine_product_list(request, machine_id):
+    """
+        Products stocked in a machine
+        Endpoints:
+            /machines/<machine_id>/products
+        Methods:
+            GET
+    """
+    if not _machine_exists(machine_id):
+        return Response(status=status.HTTP_404_NOT_FOUND)
+    _stock = MachineStock.objects.filter(
+        machine_id=machine_id, product__seller_deleted=False
+    ).select_related('product').order_by('product_id')
+    return Response(MachineStockSerializer(_stock, many=True).data, status=status.HTTP_200_OK)
+
+
+@query_budget(queries=8)
+@api_view(['PUT'])
+@permission_classes([IsAuthenticated, HasSellerRolePermission])
+@authentication_classes([SignedTokenAuthentication, ShardedTokenAuthentication])
+def machine_stock(request, machine_id, product_id):
+    """
+        Sets the amount of one of the seller's products available in a machine
+        Endpoints:
+            /machines/<machine_id>/stock/<product_id>
+        Methods:
+            PUT
+    """
+    if not _machine_exists(machine_id):
+        return Response(status=status.HTTP_404_NOT_FOUND)
+    try:
+        _product = Product.objects.only('seller_id').get(pk=product_id)
+    except Product.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+    if _product.seller_id != request.user.pk:
+        return Response({"detail": SELLER_OWNER_PERMISSION_MESSAGE}, status=status.HTTP_403_FORBIDDEN)
+
+    serializer = MachineStockSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    _amount = serializer.validated_data['amount_available']
+    _stock = MachineStock.objects.filter(machine_id=machine_id, product_id=product_id)
+    if not _stock.update(amount_available=_amount):
+        _, created = MachineStock.objects.get_or_create(
+            machine_id=machine_id, product_id=product_id, defaults={"amount_available": _amount}
+        )
+        if not created:  # Created concurrently
+            _stock.update(amount_available=_amount)
+    return Response({"id": product_id, "amount_available": _amount}, status=status.HTTP_200_OK)
+
+
+@idempotent
+@query_budget(queries=9)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, HasBuyerRolePermission])
+@authentication_classes([SignedTokenAuthentication, ShardedTokenAuthentication])
+def machine_deposit(request, machine_id, amount):
+    """
+        Inserts a coin in a machine, credited to the buyer's balance in that machine
+        Endpoints:
+            /machines/<machine_id>/deposit/<amount>
+        Methods:
+            GET
+    """
+    if amount not in CoinChoices.values:
+        return Response({"detail": f"{amount} is an invalid coin"}, status=status.HTTP_406_NOT_ACCEPTABLE)
+    if not _machine_exists(machine_id):
+        return Response(status=status.HTTP_404_NOT_FOUND)
+    _balances = MachineBalance.objects.filter(machine_id=machine_id, buyer_id=request.user.pk)
+    with transaction.atomic():
+        if not _balances.update(deposit=F('deposit') + amount):
+            _balance, created = MachineBalance.objects.get_or_create(
+                machine_id=machine_id, buyer_id=request.user.pk, defaults={"deposit": amount}
+            )
+            if not created:  # Created concurrently
+                _balances.update(deposit=F('deposit') + amount)
+    return Response(
+        {"detail": f"An amount of {amount} is deposited to your balance in machine {machine_id}"},
+        status=status.HTTP_200_OK
+    )
+
+
+@idempotent
+@query_budget(queries=16)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, HasBuyerRolePermission])
+@authentication_classes([SignedTokenAuthentication, ShardedTokenAuthentication])
+def machine_buy(request, machine_id):
+    """
+        Buys a product from a machine with the buyer's balance in that machine.
+        The stock and balance rows are locked, other machines are not affected.
+        Endpoints:
+            /machines/<machine_id>/buy?product_id=<id>&amount=<amount>
+        Methods:
+            GET
+    """
+    product_id, amount, _error_dict = _buy_params(request)
+    if _error_dict:
+        return Response(_error_dict, status=status.HTTP_400_BAD_REQUEST)
+
+    with transaction.atomic():
+        try:
+            _stock = MachineStock.objects.select_for_update().select_related('product').get(
+                machine_id=machine_id, product_id=product_id, product__seller_deleted=False
+            )
+        except MachineStock.DoesNotExist:
+            return Response(
+                {"product_id": f'No product matches this query'}, status=status.HTTP_404_NOT_FOUND
+            )
+        _product = _stock.product
+        if _stock.amount_available < amount:
+            return Response(
+                {"detail": f'Only {_stock.amount_available} of {_product.product_name} are remaining'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        _total_cost = amount * _product.cost
+        _balance = MachineBalance.objects.select_for_update().filter(
+            machine_id=machine_id, buyer_id=request.user.pk
+        ).first()
+        _user_deposit = _balance.deposit if _balance else 0
+        if _user_deposit < _total_cost:
+            return Response(
+                {"detail": f"Your deposit in machine {machine_id} is less than total cost"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        _change = _user_deposit - _total_cost
+        _balance.deposit = 0
+        _balance.save(update_fields=['deposit'])
+        _stock.amount_available -= amount
+        _stock.save(update_fields=['amount_available'])
+        record_sale(request.user, _product, amount)
+        if _stock.amount_available <= settings.LOW_STOCK_THRESHOLD < _stock.amount_available + amount:
+            enqueue(
+                'low_stock_alert', seller_id=_product.seller_id, product_id=_product.pk,
+                amount_available=_stock.amount_available,
+            )
+
+    response_dict = {
+        "product": _product.product_name,
+        "total": _total_cost,
+    }
+    if _change:  # Normally the machine should return the change whatever it is
+        response_dict['change'] = _change
+
+    return Response(response_dict, status=status.HTTP_200_OK)
+
+
+@idempotent
+@query_budget(queries=2)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, HasBuyerRolePermission])
+@authentication_classes([SignedTokenAuthentication, ShardedTokenAuthentication])
+def machine_reset(request, machine_id):
+    """
+        Returns the buyer's balance in a machine
+        Endpoints:
+            /machines/<machine_id>/reset
+        Methods:
+            GET
+    """
+    MachineBalance.objects.filter(machine_id=machine_id, buyer_id=request.user.pk).update(deposit=0)
     return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@authentication_classes([SignedTokenAuthentication, ShardedTokenAuthentication])
+def batch(request):
+    """
+        Runs up to BATCH_MAX_REQUESTS requests to this API in one round trip, authenticated once
+        as the batch. Consecutive GETs without side effects run concurrently, other requests run
+        alone in the order they were sent. Each request is checked against its own query budget.
+        Endpoints:
+            /batch
+        Methods:
+            POST
+        Body:
+            {"requests": [{"method": "GET", "path": "products?in_stock=true", "headers": {}, "body": {}}]}
+    """
+    serializer = BatchSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    return Response(
+        {"responses": dispatch(request, serializer.validated_data['requests'])}, status=status.HTTP_200_OK
+    )
@@ -0,0 +1,82 @@
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.urls import URLPattern, URLResolver, get_resolver
+from rest_framework.settings import api_settings
+
+
+def _compile_patterns(resolver):
+    for pattern in resolver.url_patterns:
+        pattern.pattern.regex
+        if isinstance(pattern, URLResolver):
+            _compile_patterns(pattern)
+        elif isinstance(pattern, URLPattern):
+            pattern.lookup_str
+
+
+def warm_up_url_resolver():
+    resolver = get_resolver()
+    _compile_patterns(resolver)
+    # Builds the reverse lookup tables of every namespace
+    resolver.reverse_dict
+    resolver.app_dict
+
+
+def warm_up_models():
+    for model in apps.get_models():
+        model._meta.get_fields()
+        model._meta._relation_tree
+
+
+def warm_up_rest_framework():
+    for setting in ('DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES', 'DEFAULT_AUTHENTICATION_CLASSES',
+                    'DEFAULT_PERMISSION_CLASSES', 'DEFAULT_THROTTLE_CLASSES', 'DEFAULT_THROTTLE_RATES',
+                    'DEFAULT_CONTENT_NEGOTIATION_CLASS', 'EXCEPTION_HANDLER'):
+        getattr(api_settings, setting)
+
+
+def warm_up_serializers():
+    # Serializer fields are built again for every serializer instance, only the ?fields= lookup
+    # tables of the sparse fieldset serializers are kept
+    from vending_machine import serializer
+
+    for serializer_class in (serializer.UserSerializer, serializer.ProductSerializer):
+        serializer_class.readable_sources()
+
+
+def warm_up_views():
+    # Imports every view module, with the permission, throttling, rendering and signal modules they use
+    from vending_machine import views, throttling, renderers, parsers  # noqa: F401
+
+
+WARM_UP_STEPS = (
+    ('models', warm_up_models),
+    ('url resolver', warm_up_url_resolver),
+    ('rest framework settings', warm_up_rest_framework),
+    ('views', warm_up_views),
+    ('serializers', warm_up_serializers),
+)
+
+
+def warm_up():
+    """
+    Builds the structures Django and DRF otherwise create lazily on the first requests of a worker,
+    and keep for its lifetime: model relation trees, compiled URL patterns and reverse tables,
+    imported DRF setting classes and view modules, and the ?fields= lookup tables of the sparse
+    fieldset serializers. Runs before the server forks workers when the WSGI/ASGI module is imported by
+    the master (e.g. gunicorn --preload). It does not open database connections, which must not be
+    shared across forks.
+    Returns the time spent in each step, in seconds.
+    """
+    timings = {}
+    for name, step in WARM_UP_STEPS:
+        start = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - start
+    return timings
+
+
+def warm_up_on_startup():
+    if getattr(settings, 'WARM_UP_ON_STARTUP', True):
+        warm_up()